@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Per-slice overhead of each pynav conversion backend.
+
+Converts one synthetic png, cut in --slices slices, with every available
+backend and prints the time per slice.
+
+    python benchmarks/bench_backends.py --slices 20 --convert /usr/bin/convert
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import pynav
+import synthetic
+
+
+def bench_backend(name, convert_app, source, dest, slices, slice_size, repeat, jobs):
+    """Returns the best time (seconds) of converting source with backend name."""
+    backend = pynav.get_backend(name, convert_app, jobs)
+    best = None
+    try:
+        for n in range(repeat):
+            start = time.time()
+            pynav.convert_image(backend, "90", "png", "jpg", float(slice_size), source,
+                os.path.join(dest, "{0}_{1}.jpg".format(name, n)), single_pass=False)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        backend.close()
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-slice overhead of the pynav backends")
+    parser.add_argument("--convert", default="convert", help="convert executable (benchmarks/fake_convert.py to test without ImageMagick)")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--slice-size", type=int, default=256)
+    parser.add_argument("--slices", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(pynav.CONVERT_BACKENDS))
+    parser.add_argument("--json", dest="json", help="Write the results to a json file")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="pynav-bench-")
+    results = []
+    try:
+        source = os.path.join(tmp, "source.png")
+        synthetic.write_png(source, args.width, args.slice_size * args.slices)
+        for name in args.backends.split(","):
+            try:
+                seconds = bench_backend(name, args.convert, source, tmp, args.slices, args.slice_size, args.repeat, 1)
+            except (ValueError, OSError) as e:
+                print("{0:<10} skipped ({1})".format(name, e))
+                continue
+            results.append({"backend": name, "slices": args.slices, "seconds": seconds,
+                "perSliceMs": seconds * 1000.0 / args.slices})
+            print("{0:<10} {1:8.2f} ms/slice  ({2:.3f} s for {3} slices)".format(name,
+                seconds * 1000.0 / args.slices, seconds, args.slices))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
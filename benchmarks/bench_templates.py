@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Html render throughput (pages/sec) of the pynav templates.
+
+Compares the compiled templates with the old chain of str.replace calls
+plus the <img> regex search of the mobile sheet.
+
+    python benchmarks/bench_templates.py --pages 20000 --slices 8
+"""
+
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import pynav
+
+
+def render_replace(template, mobile, title, css, width, height, nextHtmlFile, slice_images):
+    """The pre-compiled-template renderer, kept for comparison."""
+    tags = template
+    tags = tags.replace("[pynav-title]", title)
+    tags = tags.replace("[pynav-css]", css)
+    tags = tags.replace("[pynav-img-width]", width)
+    tags = tags.replace("[pynav-img-height]", height)
+    tags = tags.replace("[pynav-next-html]", nextHtmlFile)
+    if mobile:
+        img_tag = re.search("<[^>]+\\[pynav-img\\][^>]+>", tags).group()
+        tags = tags.replace(img_tag, "".join(img_tag.replace("[pynav-img]", img) for img in slice_images))
+    else:
+        tags = tags.replace("[pynav-img]", slice_images[0])
+    return tags
+
+def pages_per_second(render, template, mobile, pages, slices):
+    """Renders pages htmls and returns the pages per second."""
+    slice_images = ["page_slice_{0}.jpg".format(n) for n in range(slices)]
+    start = time.time()
+    for n in range(pages):
+        render(template, mobile, "Pynav", "", "1280", "9000", "page_{0}.html".format(n + 1), slice_images)
+    return pages / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Html render throughput of the pynav templates")
+    parser.add_argument("--pages", type=int, default=20000)
+    parser.add_argument("--slices", type=int, default=8)
+    parser.add_argument("--json", dest="json", help="Write the results to a json file")
+    args = parser.parse_args()
+
+    results = []
+    sheets = pynav.default_sheets()
+    for name, text, mobile in (("desktop", sheets["desktop"], False), ("mobile", sheets["mobile"], True)):
+        old = pages_per_second(render_replace, text, mobile, args.pages, args.slices)
+        new = pages_per_second(pynav.render_html_page, pynav.compile_template(text), mobile, args.pages, args.slices)
+        results.append({"template": name, "replacePagesPerSec": old, "compiledPagesPerSec": new})
+        print("{0:<8} str.replace {1:10.0f} pages/s   compiled {2:10.0f} pages/s".format(name, old, new))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
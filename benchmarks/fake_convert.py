@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Stand-in for ImageMagick convert in the pynav benchmarks.
+
+Understands the command lines pynav writes (one crop, single pass, batch
+and resized variants) and writes a solid image of the crop size for every
+output. The latency of each call is set in seconds with
+PYNAV_FAKE_CONVERT_LATENCY, plus PYNAV_FAKE_CONVERT_SLICE_LATENCY per
+written file. A call whose arguments contain PYNAV_FAKE_CONVERT_FAIL exits
+with status 1, and so does one that leaves no image to write at the end,
+like convert ("no images defined").
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import synthetic
+
+# Settings followed by their values
+OPTION_VALUES = {"-quality": 1, "-crop": 1, "-write": 1, "-resize": 1, "-limit": 2}
+
+
+def parse_outputs(args):
+    """Returns the (file, width, height) written by a convert command line."""
+    outputs = []
+    width = height = 1
+    stack = []
+    for n, arg in enumerate(args):
+        if arg == "(":
+            stack.append((width, height))
+        elif arg == ")" and stack:
+            width, height = stack.pop()
+        elif arg == "-crop" and n + 1 < len(args):
+            size = args[n + 1].split("+")[0]
+            width, height = [int(v) for v in size.split("x")]
+        elif arg == "-resize" and n + 1 < len(args):
+            # Only the WIDTHx geometry pynav writes
+            newWidth = int(args[n + 1].rstrip("x"))
+            width, height = newWidth, max(1, int(round(height * float(newWidth) / width)))
+        elif arg == "-write" and n + 1 < len(args):
+            outputs.append((args[n + 1], width, height))
+    if args and args[-1] != "null:" and not args[-1].startswith(("-", "(", ")")):
+        outputs.append((args[-1], width, height))
+    return outputs
+
+def count_images(args):
+    """Returns the images left on the list before the output file of a convert command line.
+
+    Inputs and +clone add one, +delete removes the last one and the images of
+    a ( ) group go back to the list it was opened in.
+    """
+    stack = [0]
+    n = 0
+    while n < len(args) - 1:
+        arg = args[n]
+        if arg == "(":
+            stack.append(0)
+        elif arg == ")" and len(stack) > 1:
+            images = stack.pop()
+            stack[-1] += images
+        elif arg == "+clone":
+            stack[-1] += 1
+        elif arg == "+delete":
+            stack[-1] = max(0, stack[-1] - 1)
+        elif arg in OPTION_VALUES:
+            n += OPTION_VALUES[arg]
+        elif not arg.startswith(("-", "+")):
+            stack[-1] += 1
+        n += 1
+    return stack[0]
+
+def main():
+    args = sys.argv[1:]
+    fail = os.environ.get("PYNAV_FAKE_CONVERT_FAIL")
+    if fail and fail in " ".join(args):
+        sys.exit(1)
+    if args and count_images(args) == 0:
+        sys.stderr.write("convert: no images defined `{0}'\n".format(args[-1]))
+        sys.exit(1)
+
+    outputs = parse_outputs(args)
+    time.sleep(float(os.environ.get("PYNAV_FAKE_CONVERT_LATENCY", "0"))
+        + float(os.environ.get("PYNAV_FAKE_CONVERT_SLICE_LATENCY", "0")) * len(outputs))
+
+    for path, width, height in outputs:
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        if ext in ("jpg", "jpeg"):
+            synthetic.write_jpeg(path, width, height)
+        elif ext == "png":
+            synthetic.write_png(path, width, height)
+        elif ext == "gif":
+            synthetic.write_gif(path, width, height)
+        else:
+            with open(path, "wb") as f:
+                f.write(b"pynav fake convert")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Pynav benchmark suite.
+
+Generates synthetic source trees, runs pynav.build() against benchmarks/fake_convert.py
+(no ImageMagick needed) and reports the time of header probing, template
+rendering, directory scanning, zipping and whole builds. Results can be saved
+as json and compared with the results of another commit.
+
+    python benchmarks/run.py --json before.json
+    python benchmarks/run.py --json after.json --compare before.json
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import json
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+import bench_templates
+
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+
+
+def build_settings(source, dest, **overrides):
+    """Returns the BuildSettings of a build of source into dest."""
+    settings = {
+        "convert_app": FAKE_CONVERT,
+        "inputFormat": "psd",
+        "quality": 90,
+        "index": True,
+        "overwrite": True,
+        "flush": True
+    }
+    settings.update(overrides)
+    return pynav.BuildSettings(source, dest, **settings)
+
+def best_of(repeat, func, setup=None):
+    """Returns the best wall time of repeat calls to func."""
+    best = None
+    for n in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_probe(tmp, args):
+    folder = os.path.join(tmp, "probe")
+    files = []
+    for image_format in synthetic.FORMATS:
+        files += synthetic.make_project(os.path.join(folder, image_format), args.probe_files, 640, 480, image_format)
+
+    def probe():
+        for f in files:
+            pynav.get_image_size(f)
+    cold = best_of(args.repeat, probe, setup=pynav._probe_cache.clear)
+    warm = best_of(args.repeat, probe)
+    return [
+        {"name": "probe.cold", "seconds": cold, "items": len(files), "unit": "file"},
+        {"name": "probe.warm", "seconds": warm, "items": len(files), "unit": "file"}
+    ]
+
+def bench_render(tmp, args):
+    results = []
+    sheets = pynav.default_sheets()
+    for name, text, mobile in (("desktop", sheets["desktop"], False), ("mobile", sheets["mobile"], True)):
+        template = pynav.compile_template(text)
+        rate = max(bench_templates.pages_per_second(pynav.render_html_page, template, mobile, args.pages, 8)
+            for n in range(args.repeat))
+        results.append({"name": "render.{0}".format(name), "seconds": args.pages / rate, "items": args.pages, "unit": "page"})
+    return results
+
+def bench_scan(tmp, args):
+    folder = os.path.join(tmp, "scan")
+    os.makedirs(folder)
+    for n in range(args.scan_files):
+        ext = "psd" if n % 2 else "txt"
+        open(os.path.join(folder, "page_{0}.{1}".format(n, ext)), "w").close()
+    seconds = best_of(args.repeat, lambda: pynav.get_files_from_folder(folder, "psd"))
+    results = [{"name": "scan", "seconds": seconds, "items": args.scan_files, "unit": "entry"}]
+
+    # The same entries in 10 sections of 10 subfolders
+    tree = os.path.join(tmp, "scan-tree")
+    for n in range(args.scan_files):
+        sub = os.path.join(tree, "section_{0}".format(n % 10), "part_{0}".format(n // 10 % 10))
+        if not os.path.isdir(sub):
+            os.makedirs(sub)
+        ext = "psd" if n % 2 else "txt"
+        open(os.path.join(sub, "page_{0}.{1}".format(n, ext)), "w").close()
+    seconds = best_of(args.repeat, lambda: pynav.get_files_from_folder(tree, "psd", recursive=True, exclude=["*_9.psd"]))
+    results.append({"name": "scan.recursive", "seconds": seconds, "items": args.scan_files, "unit": "entry"})
+    return results
+
+def bench_zip(tmp, args):
+    source = os.path.join(tmp, "zip-src")
+    dest = os.path.join(tmp, "zip-out")
+    synthetic.make_project(source, args.pages_per_build, args.width, args.height, "png")
+    pynav.build(build_settings(source, dest, inputFormat="png"))
+    files = [os.path.join(dest, f) for f in pynav.get_file_list(dest)]
+    archive = os.path.join(tmp, "bench.zip")
+
+    def stream():
+        streamer = pynav.ZipStreamer(archive)
+        for f in files:
+            streamer.add(f)
+        streamer.close()
+
+    def deflate_all():
+        zf = zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED)
+        for f in files:
+            zf.write(f, os.path.basename(f))
+        zf.close()
+
+    return [
+        {"name": "zip.deflate_all", "seconds": best_of(args.repeat, deflate_all), "items": len(files), "unit": "file"},
+        {"name": "zip.format_aware", "seconds": best_of(args.repeat, lambda: pynav.zip(dest, archive)), "items": len(files), "unit": "file"},
+        {"name": "zip.streamer", "seconds": best_of(args.repeat, stream), "items": len(files), "unit": "file"}
+    ]
+
+def bench_build(tmp, args):
+    source = os.path.join(tmp, "build-src")
+    synthetic.make_project(source, args.pages_per_build, args.width, args.height, "psd")
+    dest = os.path.join(tmp, "build-out")
+    jobs = os.cpu_count() or 1
+    variants = [
+        ("build.serial", {"jobs": 1}),
+        ("build.jobs", {"jobs": jobs}),
+        ("build.single_pass", {"jobs": jobs, "singlePass": True}),
+        ("build.batch", {"jobs": jobs, "backend": "batch"}),
+        ("build.mobile_zip", {"jobs": jobs, "singlePass": True, "mobile": True, "zip": True})
+    ]
+    results = []
+    for name, overrides in variants:
+        settings = build_settings(source, dest, **overrides)
+        seconds = best_of(args.repeat, lambda: pynav.build(settings))
+        results.append({"name": name, "seconds": seconds, "items": args.pages_per_build, "unit": "page"})
+    return results
+
+BENCHMARKS = (
+    ("probe", bench_probe),
+    ("render", bench_render),
+    ("scan", bench_scan),
+    ("zip", bench_zip),
+    ("build", bench_build)
+)
+
+def git_commit():
+    """Returns the current git commit of pynav, None outside a repository."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(BENCH_DIR),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def compare(results, baseline):
+    """Prints the change of every result against a baseline results file."""
+    with open(baseline) as f:
+        old = dict((r["name"], r) for r in json.load(f)["results"])
+    print("\nCompared with {0}".format(baseline))
+    for r in results:
+        if r["name"] in old:
+            ratio = old[r["name"]]["seconds"] / r["seconds"] if r["seconds"] else float("inf")
+            print("{0:<22} {1:10.4f} s -> {2:10.4f} s  x{3:.2f}".format(r["name"], old[r["name"]]["seconds"], r["seconds"], ratio))
+
+def main():
+    parser = argparse.ArgumentParser(description="Pynav benchmark suite")
+    parser.add_argument("--only", help="Comma separated benchmarks: {0}".format(",".join(n for n, f in BENCHMARKS)))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=20000, help="Pages rendered by the render benchmark")
+    parser.add_argument("--probe-files", type=int, default=50, help="Files of each format probed")
+    parser.add_argument("--scan-files", type=int, default=5000)
+    parser.add_argument("--pages-per-build", type=int, default=20)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per fake convert call")
+    parser.add_argument("--json", dest="json", help="Write the results to a json file")
+    parser.add_argument("--compare", help="Results json of another run to compare with")
+    args = parser.parse_args()
+
+    os.environ["PYNAV_FAKE_CONVERT_LATENCY"] = str(args.latency)
+    only = args.only.split(",") if args.only else None
+
+    tmp = tempfile.mkdtemp(prefix="pynav-bench-")
+    results = []
+    try:
+        for name, bench in BENCHMARKS:
+            if only and name not in only:
+                continue
+            os.makedirs(os.path.join(tmp, name))
+            for r in bench(os.path.join(tmp, name), args):
+                r["perItemMs"] = r["seconds"] * 1000.0 / r["items"]
+                results.append(r)
+                print("{0:<22} {1:10.4f} s  {2:10.4f} ms/{3}".format(r["name"], r["seconds"], r["perItemMs"], r["unit"]))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args)
+        },
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Synthetic source trees for the pynav benchmarks.
+
+Writes small but valid png, jpg, gif and psd files of any size without any
+image library: solid color images whose encoded data is cheap to generate.
+
+    python benchmarks/synthetic.py /tmp/project --count 60 --width 1280 --height 9000 --format psd
+"""
+
+from __future__ import print_function
+import os
+import zlib
+import struct
+import argparse
+
+FORMATS = ("png", "jpg", "gif", "psd")
+
+
+def write_png(path, width, height, gray=0x80):
+    """Writes a solid rgb png of width x height."""
+    def chunk(kind, data):
+        return struct.pack(">L", len(data)) + kind + data + struct.pack(">L", zlib.crc32(kind + data) & 0xffffffff)
+    compressor = zlib.compressobj()
+    row = b"\x00" + bytes(bytearray([gray])) * (width * 3)
+    idat = b"".join(compressor.compress(row) for n in range(height)) + compressor.flush()
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">LLBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", idat))
+        f.write(chunk(b"IEND", b""))
+
+def write_jpeg(path, width, height):
+    """Writes a solid gray baseline jpeg of width x height.
+
+    One component, one-code huffman tables: every 8x8 block is a zero DC
+    difference plus an end of block, two bits.
+    """
+    blocks = ((width + 7) // 8) * ((height + 7) // 8)
+    bits = blocks * 2
+    data = b"\x00" * (bits // 8)
+    if bits % 8:
+        # Pad the last byte with 1 bits
+        data += bytes(bytearray([(1 << (8 - bits % 8)) - 1]))
+    counts = b"\x01" + b"\x00" * 15
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8")
+        f.write(b"\xff\xdb" + struct.pack(">HB", 67, 0) + b"\x01" * 64)
+        f.write(b"\xff\xc0" + struct.pack(">HBHHBBBB", 11, 8, height, width, 1, 1, 0x11, 0))
+        f.write(b"\xff\xc4" + struct.pack(">HB", 20, 0x00) + counts + b"\x00")
+        f.write(b"\xff\xc4" + struct.pack(">HB", 20, 0x10) + counts + b"\x00")
+        f.write(b"\xff\xda" + struct.pack(">HBBBBBB", 8, 1, 1, 0x00, 0, 63, 0))
+        f.write(data)
+        f.write(b"\xff\xd9")
+
+def _pack_codes(codes, width):
+    """Packs lzw codes of width bits, lsb first."""
+    out = bytearray()
+    acc = 0
+    nbits = 0
+    for code in codes:
+        acc |= code << nbits
+        nbits += width
+        while nbits >= 8:
+            out.append(acc & 0xff)
+            acc >>= 8
+            nbits -= 8
+    if nbits:
+        out.append(acc & 0xff)
+    return bytes(out)
+
+def write_gif(path, width, height):
+    """Writes a solid gif of width x height.
+
+    Uncompressed lzw: 9 bit literal codes with a clear code every 250 pixels,
+    so the code size never grows. Eight groups are byte aligned and repeated.
+    """
+    clear, end, run = 256, 257, 250
+    group = [clear] + [0] * run
+    period = _pack_codes(group * 8, 9)
+    pixels = width * height
+    periods, rest = divmod(pixels, run * 8)
+    tail = []
+    while rest:
+        n = min(run, rest)
+        tail += [clear] + [0] * n
+        rest -= n
+    data = period * periods + _pack_codes(tail + [end], 9)
+
+    with open(path, "wb") as f:
+        f.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xf7, 0, 0))
+        # 256 gray levels global palette
+        f.write(b"".join(bytes(bytearray([n, n, n])) for n in range(256)))
+        f.write(b"\x2c" + struct.pack("<HHHHB", 0, 0, width, height, 0))
+        f.write(b"\x08")
+        for n in range(0, len(data), 255):
+            block = data[n:n + 255]
+            f.write(bytes(bytearray([len(block)])) + block)
+        f.write(b"\x00\x3b")
+
+def write_psd(path, width, height, version=1):
+    """Writes a flat rgb psd (psb with version 2) with an rle composite image."""
+    # PackBits: runs of 128 equal bytes
+    row = b""
+    left = width
+    while left:
+        n = min(128, left)
+        row += struct.pack(">bB", 1 - n, 0x80)
+        left -= n
+    rowCounts = 3 * height
+    with open(path, "wb") as f:
+        f.write(b"8BPS" + struct.pack(">H", version) + b"\x00" * 6)
+        f.write(struct.pack(">HLLHH", 3, height, width, 8, 3))
+        # Color mode data, image resources, layer and mask info
+        if version == 2:
+            f.write(struct.pack(">LLQ", 0, 0, 0))
+            f.write(struct.pack(">H", 1) + struct.pack(">L", len(row)) * rowCounts)
+        else:
+            f.write(struct.pack(">LLL", 0, 0, 0))
+            f.write(struct.pack(">H", 1) + struct.pack(">H", len(row)) * rowCounts)
+        f.write(row * rowCounts)
+
+def write_image(path, width, height, image_format):
+    """Writes a synthetic image_format file."""
+    writers = {"png": write_png, "jpg": write_jpeg, "gif": write_gif, "psd": write_psd}
+    writers[image_format](path, width, height)
+
+def make_project(folder, count, width, height, image_format="psd"):
+    """Writes count synthetic pages into folder and returns their paths."""
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    paths = []
+    for n in range(count):
+        path = os.path.join(folder, "page_{0:03d}.{1}".format(n + 1, image_format))
+        write_image(path, width, height, image_format)
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic pynav source tree")
+    parser.add_argument("folder")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--format", dest="image_format", default="psd", choices=FORMATS)
+    args = parser.parse_args()
+    make_project(args.folder, args.count, args.width, args.height, args.image_format)
+
+if __name__ == "__main__":
+    main()
@@ -28,9 +28,42 @@ import argparse
 import math
 import zipfile
 import re
-import imghdr
 import struct
 import json
+import concurrent.futures
+import hashlib
+import threading
+import queue
+import select
+import ctypes
+import ctypes.util
+import contextlib
+import dataclasses
+import heapq
+import itertools
+import fnmatch
+import socket
+import socketserver
+import uuid
+import gzip
+import mimetypes
+import email.utils
+import http.server
+import urllib.parse
+import io
+
+try:
+    from PIL import Image, ImageChops, ImageStat
+except ImportError:
+    Image = None
+    ImageChops = None
+    ImageStat = None
+
+# --min-ssim only
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 SCRIPT_FILE_PATH = os.path.realpath(__file__)
@@ -39,15 +72,105 @@ CONFIG_DIR_PATH = os.path.join(SCRIPT_DIR_PATH, "pynav-conf")
 CONFIG_FILE_PATH = os.path.join(CONFIG_DIR_PATH, "pynav.conf")
 DESKTOP_HTML_SHEET = os.path.join(CONFIG_DIR_PATH, "pynav-desktop.html")
 MOBILE_HTML_SHEET = os.path.join(CONFIG_DIR_PATH, "pynav-mobile.html")
+INDEX_HTML_SHEET = os.path.join(CONFIG_DIR_PATH, "pynav-index.html")
 INDEX_PAGE_NAME = "index.html"
+VIEWER_HTML_SHEET = os.path.join(CONFIG_DIR_PATH, "pynav-viewer.html")
+TILES_HTML_SHEET = os.path.join(CONFIG_DIR_PATH, "pynav-tiles.html")
+VIEWER_PAGE_NAME = "viewer.html"
+VIEWER_PAGES_NAME = "pages.json"
+MANIFEST_FILE_NAME = ".pynav-manifest.json"
+MANIFEST_VERSION = 1
+# --resume, the pages converted so far by the build running (or interrupted) in a folder
+JOURNAL_FILE_NAME = ".pynav-journal.jsonl"
+# Outputs are written under this prefix and renamed once complete, see temp_name()
+TEMP_PREFIX = ".pynav-tmp-"
+# --retries, seconds before the first retry of a failed conversion, doubled on every retry
+RETRY_DELAY = 1.0
+# --cache, conversions shared by every build of this machine
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pynav")
+CACHE_SIZE = 2048
+CACHE_VERSION = 1
+CACHE_PAGE_NAME = "page.json"
+# Scratch folders of the cache older than this (seconds) are from builds that died
+CACHE_STALE = 3600
+PROBE_HEAD_SIZE = 512
+# --draft, psd image resources: jpeg thumbnail (rgb, and bgr of Photoshop 4) and version info
+PSD_THUMBNAIL = 1036
+PSD_THUMBNAIL_BGR = 1033
+PSD_VERSION_INFO = 1057
+# psd color modes of the 8 bit composites read by --draft, others use the thumbnail
+PSD_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+TEMPLATE_TAG_RE = re.compile(r"\[pynav-([a-z0-9-]+)\]")
+# The whole <img> tag (or <picture> element) of [pynav-img], repeated once per slice in mobile htmls
+TEMPLATE_IMG_BLOCK_RE = re.compile(r"<picture\b(?:(?!</picture>).)*?\[pynav-img\].*?</picture>|<[^>]+\[pynav-img\][^>]+>", re.S)
+# The whole tag (or <picture> element) of a [pynav-img-slice-N], dropped if the image has no slice N
+TEMPLATE_SLICE_BLOCK_RE = re.compile(r"<picture\b(?:(?!</picture>).)*?\[pynav-img-slice-(\d+)\].*?</picture>|<[^>]+\[pynav-img-slice-(\d+)\][^>]*>", re.S)
+# Tags with a value per slice, see responsive_values()
+TEMPLATE_RESPONSIVE_TAGS = ("img-srcset", "img-sources", "img-image-set")
+# Memory of a convert process before any pixel, see estimate_memory()
+MEMORY_BASE = 32 << 20
+# Extensions of the source formats with more than one
+FORMAT_EXTENSIONS = {"jpg": (".jpg", ".jpeg"), "jpeg": (".jpg", ".jpeg"), "tif": (".tif", ".tiff"), "tiff": (".tif", ".tiff")}
+NATURAL_SPLIT_RE = re.compile(r"(\d+)")
+# --content-slices, rows within this of their first pixel are uniform
+UNIFORM_TOLERANCE = 2
+# Shortest single color band left out of the images, a css block instead
+FLAT_BAND_MIN = 32
+# How far up (part of a slice) a cut looks for a uniform row
+CUT_SEARCH = 0.25
+FLAT_BLOCK_HTML = "<div class='pynav-flat' style='background:{color};aspect-ratio:{width}/{height}'></div>"
+# --tiles, deep zoom pyramid of square tiles (no overlap)
+TILE_SIZE = 256
+DZI_XML = ("<?xml version='1.0' encoding='utf-8'?>\n<Image xmlns='http://schemas.microsoft.com/deepzoom/2008'"
+    " TileSize='{size}' Overlap='0' Format='{format}'><Size Width='{width}' Height='{height}'/></Image>\n")
+# Quality search (--slice-kb, --page-kb, --min-psnr, --min-ssim), lowest quality tried
+QUALITY_MIN = 30
+QUALITY_FORMATS = ("jpg", "jpeg", "webp")
+# Side of the ssim windows, in pixels
+SSIM_WINDOW = 8
+# Slice keys set by the search, see search_quality()
+SEARCH_KEYS = ("quality", "bytes", "psnr", "ssim")
+SERVE_PORT = 8000
+SERVE_CHUNK_SIZE = 64 << 10
+SERVE_GZIP_LEVEL = 6
+SERVE_GZIP_TYPES = ("text/html", "text/css", "application/javascript", "text/javascript", "application/json")
+# bytes=first-last, a single range
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# --dedupe names, the digest of the content
+CONTENT_ADDRESS_RE = re.compile(r"^[0-9a-f]{20}\.[a-z0-9]+$")
+WATCH_DEBOUNCE = 0.5
+WATCH_POLL_INTERVAL = 1.0
+
+CONVERT_BACKENDS = ("external", "batch", "python")
+# --distributed, host:port of a tcp queue (else a shared folder)
+QUEUE_TCP_RE = re.compile(r"^([\w.-]*):(\d+)$")
+QUEUE_POLL_INTERVAL = 0.2
+# Seconds a shared folder job goes untouched before its worker is taken as lost
+JOB_LEASE = 60.0
+JOB_RETRIES = 3
+WORKER_RETRY_INTERVAL = 1.0
+# Coordinator threads waiting for workers
+DISTRIBUTED_THREADS = 64
+
+# Already compressed formats, stored as they are in the zip
+ZIP_STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip", ".gz", ".psd", ".psb")
+
+# (path, size, mtime) -> (format, width, height), see probe_image()
+_probe_cache = {}
+_probe_cache_lock = threading.Lock()
+
+# convert_app -> first line of its -version, see convert_version()
+_convert_versions = {}
+_convert_versions_lock = threading.Lock()
 
 
 def timming(f):
     """Process timming decorator"""
-    start = time.clock()
     def inner(*args, **kwargs):
-        f(*args, **kwargs)
-        print("Exe time for {0}(), {1:2f}".format(f.__name__, time.clock() - start))
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        print("Exe time for {0}(), {1:2f}".format(f.__name__, time.perf_counter() - start))
+        return result
     return inner
 
 def errprint(msg):
@@ -65,13 +188,13 @@ def load_settings(settingDic):
     except:
         errprint("El archivo {0} no existe o no puede abrirse".format(CONFIG_FILE_PATH))
 
-def load_html_template(file_tpl):
+def load_html_template(file_tpl, required_tag="[pynav-img]"):
     """Returns a string with the content of an valid pynav html template."""
     try:
         file_html = open(file_tpl, "r")
         content = file_html.read()
         file_html.close()
-        if "[pynav-img]" not in content:
+        if required_tag not in content:
             return False
         return content
     except:
@@ -99,58 +222,307 @@ def resolve_conflict(myDir, dirPath):
     else:
         return myDir
 
-def get_files_from_folder(folder, image_format):
-    """Gets file list with custom extension."""
-    return [ os.path.join(folder, file) for file in os.listdir(folder)\
-        if os.path.isfile(os.path.join(folder, file)) and file[-3:] == image_format]
+def natural_key(name):
+    """Sort key of name with its digit runs as numbers, page_2 before page_10."""
+    return [int(part) if part.isdigit() else part.lower() for part in NATURAL_SPLIT_RE.split(name)]
+
+def format_extensions(image_format):
+    """Returns the file extensions of image_format, jpg is also .jpeg and tif .tiff."""
+    image_format = image_format.lower().lstrip(".")
+    return FORMAT_EXTENSIONS.get(image_format, ("." + image_format,))
+
+def is_source_file(name, image_format):
+    """True if name has an extension of image_format, in any case."""
+    return os.path.splitext(name)[1].lower() in format_extensions(image_format)
+
+def _glob_match(relPath, patterns):
+    """True if relPath (/ separated) or its base name matches any of the glob patterns."""
+    name = relPath.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatchcase(relPath, p) or ("/" not in p and fnmatch.fnmatchcase(name, p)) for p in patterns)
+
+def scan_sources(folder, image_format, recursive=False, include=None, exclude=None):
+    """Returns the os.DirEntry of the image_format files of folder in natural order.
+
+    One os.scandir per folder and the file type comes from the directory
+    entries, no stat per entry. The stat() of the returned entries is
+    cached (and free on Windows), builds take the sizes and mtimes from it. With
+    recursive the files of every subfolder follow those of its parent,
+    skipping hidden folders and pynav destinations (with a manifest).
+    include and exclude are glob patterns of the path relative to folder, or
+    of the name: a file must match an include one and no exclude one, an
+    excluded folder is not entered.
+    """
+    extensions = format_extensions(image_format)
+    sources = []
+    pending = [("", folder)]
+    while pending:
+        relDir, path = pending.pop()
+        files = []
+        subfolders = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() in extensions:
+                    if entry.is_file():
+                        files.append(entry)
+                elif entry.name == MANIFEST_FILE_NAME and relDir:
+                    break
+                elif recursive and not entry.name.startswith(".") and entry.is_dir():
+                    subfolders.append(entry)
+            else:
+                files.sort(key=lambda entry: natural_key(entry.name))
+                sources += [entry for entry in files if (not exclude or not _glob_match(relDir + entry.name, exclude))
+                    and (not include or _glob_match(relDir + entry.name, include))]
+                # Depth first, subfolders in natural order
+                subfolders.sort(key=lambda entry: natural_key(entry.name), reverse=True)
+                pending += [(relDir + entry.name + "/", entry.path) for entry in subfolders
+                    if not exclude or not _glob_match(relDir + entry.name, exclude)]
+    return sources
+
+def get_files_from_folder(folder, image_format, recursive=False, include=None, exclude=None):
+    """Gets file list with custom extension, see scan_sources()."""
+    return [entry.path for entry in scan_sources(folder, image_format, recursive, include, exclude)]
+
+def source_name(path, folder):
+    """Returns the / separated path of a source file relative to the source folder."""
+    return os.path.relpath(path, folder).replace(os.sep, "/")
 
 def shift(seq, n):
     """Shifts list items by n."""
     n = n % len(seq)
     return seq[n:] + seq[:n]
 
-def get_image_size(fname):
-    """Determines the image type of fhandle and return its size."""
-    fhandle = open(fname, 'rb')
-    ext = os.path.splitext(fname)[1]
+def _probe_jpeg(fhandle):
+    """Walks the jpeg markers of fhandle up to the first SOFn and returns its size."""
+    fhandle.seek(2)
+    while True:
+        byte = fhandle.read(1)
+        if not byte:
+            return
+        if byte != b"\xff":
+            continue
+        # Fill bytes
+        while byte == b"\xff":
+            byte = fhandle.read(1)
+        marker = ord(byte) if byte else 0
+        # Standalone markers, no length
+        if marker == 0x01 or 0xd0 <= marker <= 0xd9:
+            continue
+        length = fhandle.read(2)
+        if len(length) != 2:
+            return
+        # SOFn, but DHT (c4), JPG (c8) and DAC (cc)
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            data = fhandle.read(5)
+            if len(data) != 5:
+                return
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        fhandle.seek(struct.unpack(">H", length)[0] - 2, 1)
 
-    if ext == ".psd":
-        fhandle.read(14)
-        height, width = struct.unpack("!LL", fhandle.read(8))
-        fhandle.close()
+def _probe_tiff(fhandle, head):
+    """Reads ImageWidth and ImageLength of the first tiff IFD."""
+    endian = "<" if head[:2] == b"II" else ">"
+    offset = struct.unpack(endian + "L", head[4:8])[0]
+    if offset + 2 <= len(head):
+        ifd = head[offset:]
     else:
-        head = fhandle.read(24)
-        if len(head) != 24:
+        fhandle.seek(offset)
+        ifd = fhandle.read(PROBE_HEAD_SIZE)
+    if len(ifd) < 2:
+        return
+    count = struct.unpack(endian + "H", ifd[:2])[0]
+    if len(ifd) < 2 + count * 12:
+        fhandle.seek(offset)
+        ifd = fhandle.read(2 + count * 12)
+    width = height = None
+    for n in range(count):
+        entry = ifd[2 + n * 12:14 + n * 12]
+        if len(entry) != 12:
             return
-        if imghdr.what(fname) == 'png':
-            check = struct.unpack('>i', head[4:8])[0]
-            if check != 0x0d0a1a0a:
-                return
-            width, height = struct.unpack('>ii', head[16:24])
-        elif imghdr.what(fname) == 'gif':
-            width, height = struct.unpack('<HH', head[6:10])
-        elif imghdr.what(fname) == 'jpeg':
-            try:
-                fhandle.seek(0) # Read 0xff next
-                size = 2
-                ftype = 0
-                while not 0xc0 <= ftype <= 0xcf:
-                    fhandle.seek(size, 1)
-                    byte = fhandle.read(1)
-                    while ord(byte) == 0xff:
-                        byte = fhandle.read(1)
-                    ftype = ord(byte)
-                    size = struct.unpack('>H', fhandle.read(2))[0] - 2
-                # We are at a SOFn block
-                fhandle.seek(1, 1)  # Skip `precision' byte.
-                height, width = struct.unpack('>HH', fhandle.read(4))
-            except Exception: #IGNORE:W0703
-                return
+        tag, kind = struct.unpack(endian + "HH", entry[:4])
+        if tag not in (256, 257):
+            continue
+        # SHORT or LONG values
+        if kind == 3:
+            value = struct.unpack(endian + "H", entry[8:10])[0]
         else:
-            return
-
+            value = struct.unpack(endian + "L", entry[8:12])[0]
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    if width is None or height is None:
+        return
     return width, height
 
+def _probe_header(fhandle):
+    """Detects the image format of fhandle from its magic bytes and returns (format, width, height)."""
+    head = fhandle.read(PROBE_HEAD_SIZE)
+
+    if head[:4] == b"8BPS" and len(head) >= 22:
+        # Version 1 psd, version 2 psb, same header layout
+        version = struct.unpack(">H", head[4:6])[0]
+        height, width = struct.unpack(">LL", head[14:22])
+        return ("psb" if version == 2 else "psd"), width, height
+
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        width, height = struct.unpack(">LL", head[16:24])
+        return "png", width, height
+
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", head[6:10])
+        return "gif", width, height
+
+    if head[:2] == b"\xff\xd8":
+        size = _probe_jpeg(fhandle)
+        if size:
+            return "jpeg", size[0], size[1]
+        return
+
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack("<HH", head[26:30])
+            return "webp", width & 0x3fff, height & 0x3fff
+        if chunk == b"VP8L" and head[20:21] == b"\x2f":
+            bits = struct.unpack("<L", head[21:25])[0]
+            return "webp", (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b"VP8X":
+            width = struct.unpack("<L", head[24:27] + b"\x00")[0] + 1
+            height = struct.unpack("<L", head[27:30] + b"\x00")[0] + 1
+            return "webp", width, height
+        return
+
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        size = _probe_tiff(fhandle, head)
+        if size:
+            return "tiff", size[0], size[1]
+        return
+
+    if head[:2] == b"BM" and len(head) >= 26:
+        headerSize = struct.unpack("<L", head[14:18])[0]
+        if headerSize == 12:
+            width, height = struct.unpack("<HH", head[18:22])
+        else:
+            width, height = struct.unpack("<ll", head[18:26])
+        return "bmp", abs(width), abs(height)
+
+def probe_image(fname):
+    """Returns (format, width, height) of an image file or None if unknown.
+
+    The file is opened once and only its header is read. Results are cached
+    by (path, size, mtime) so a source tree is only probed once per change.
+    """
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return
+    key = (os.path.abspath(fname), stat.st_size, stat.st_mtime)
+
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            return _probe_cache[key]
+
+    try:
+        with open(fname, "rb") as fhandle:
+            info = _probe_header(fhandle)
+    except (IOError, OSError, struct.error):
+        info = None
+
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+    return info
+
+def get_image_size(fname):
+    """Determines the image type of fname and return its size."""
+    info = probe_image(fname)
+    if info is None:
+        return
+    return info[1], info[2]
+
+def _psd_resources(fhandle, length, wanted):
+    """Returns id -> data of the wanted image resources of a psd section of length bytes."""
+    found = {}
+    end = fhandle.tell() + length
+    while fhandle.tell() + 12 <= end:
+        signature, resource, nameLength = struct.unpack(">4sHB", fhandle.read(7))
+        if signature != b"8BIM":
+            break
+        # Pascal name, padded to even with its length byte
+        fhandle.seek(nameLength + (nameLength + 1) % 2, 1)
+        size = struct.unpack(">I", fhandle.read(4))[0]
+        if resource in wanted:
+            found[resource] = fhandle.read(size)
+            fhandle.seek(size % 2, 1)
+        else:
+            fhandle.seek(size + size % 2, 1)
+    fhandle.seek(end)
+    return found
+
+def _psd_composite(fhandle, version, channels, width, height, mode):
+    """Returns the composite image of a psd at its image data section, None if compressed with zip."""
+    compression = struct.unpack(">H", fhandle.read(2))[0]
+    planes = []
+    if compression == 0:
+        for n in range(len(mode)):
+            planes.append(Image.frombytes("L", (width, height), fhandle.read(width * height)))
+    elif compression == 1:
+        # Rle (packbits) rows, after the byte counts of every row of every channel
+        counts = struct.unpack(">{0}{1}".format(channels * height, "I" if version == 2 else "H"),
+            fhandle.read(channels * height * (4 if version == 2 else 2)))
+        for n in range(len(mode)):
+            data = fhandle.read(sum(counts[n * height:(n + 1) * height]))
+            planes.append(Image.frombytes("L", (width, height), data, "packbits", "L"))
+    else:
+        return None
+    if mode == "CMYK":
+        # Stored as 255 - ink
+        planes = [ImageChops.invert(plane) for plane in planes]
+    return Image.merge(mode, planes)
+
+def read_psd_draft(fname):
+    """Reads a psd/psb without ImageMagick and returns (Pillow image, "composite" or "thumbnail").
+
+    The composite is the merged image Photoshop stores with maximize
+    compatibility (8 bit gray, rgb or cmyk). Without it, the jpeg thumbnail
+    of the image resources, scaled up to the document size so the slices
+    fall where they would. None if the file has neither.
+    """
+    with open(fname, "rb") as fhandle:
+        head = fhandle.read(26)
+        if head[:4] != b"8BPS":
+            return None
+        version, channels, height, width, depth, colorMode = struct.unpack(">H6xHIIHH", head[4:26])
+        # Color mode data, image resources and layers
+        fhandle.seek(struct.unpack(">I", fhandle.read(4))[0], 1)
+        resources = _psd_resources(fhandle, struct.unpack(">I", fhandle.read(4))[0],
+            (PSD_THUMBNAIL, PSD_THUMBNAIL_BGR, PSD_VERSION_INFO))
+        if version == 2:
+            fhandle.seek(struct.unpack(">Q", fhandle.read(8))[0], 1)
+        else:
+            fhandle.seek(struct.unpack(">I", fhandle.read(4))[0], 1)
+        # Version info has the hasRealMergedData flag after its version
+        info = resources.get(PSD_VERSION_INFO)
+        merged = info is None or len(info) < 5 or info[4] != 0
+        mode = PSD_MODES.get(colorMode)
+        if merged and depth == 8 and mode is not None and channels >= len(mode):
+            image = _psd_composite(fhandle, version, channels, width, height, mode)
+            if image is not None:
+                return image, "composite"
+
+    for resource in (PSD_THUMBNAIL, PSD_THUMBNAIL_BGR):
+        data = resources.get(resource)
+        # Format 1 is jfif, after a 28 bytes header
+        if data is None or len(data) <= 28 or struct.unpack(">I", data[:4])[0] != 1:
+            continue
+        thumbnail = Image.open(io.BytesIO(data[28:]))
+        thumbnail = thumbnail.convert("RGB")
+        if resource == PSD_THUMBNAIL_BGR:
+            blue, green, red = thumbnail.split()
+            thumbnail = Image.merge("RGB", (red, green, blue))
+        return thumbnail.resize((width, height), Image.BICUBIC), "thumbnail"
+    return None
+
 def get_list_dir(path):
     """Returns List of folders."""
     return [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
@@ -159,6 +531,122 @@ def get_file_list(path):
     """Returns List of files."""
     return [d for d in os.listdir(path) if not os.path.isdir(os.path.join(path, d))]
 
+def temp_name(path):
+    """Returns the name path is written under until it is complete, TEMP_PREFIX + its name in the same folder.
+
+    The extension stays, convert and Pillow pick the format from it.
+    """
+    return os.path.join(os.path.dirname(path), TEMP_PREFIX + os.path.basename(path))
+
+def final_name(path):
+    """Returns the name of a file written under temp_name(), path itself otherwise."""
+    folder, name = os.path.split(path)
+    if name.startswith(TEMP_PREFIX):
+        return os.path.join(folder, name[len(TEMP_PREFIX):])
+    return path
+
+def write_atomic(path, text):
+    """Writes text into path, temp file + rename so a crash never leaves it half written."""
+    tmpPath = temp_name(path)
+    with open(tmpPath, "w") as f:
+        f.write(text)
+    os.replace(tmpPath, path)
+
+def remove_temp_files(path):
+    """Removes the temp_name() files left in the folder path by a build that died."""
+    for name in get_file_list(path):
+        if name.startswith(TEMP_PREFIX):
+            os.remove(os.path.join(path, name))
+
+class Tracer(object):
+    """Collects the timed spans of the build stages, from any thread.
+
+    Spans are written as a Chrome trace-event file (chrome://tracing,
+    Perfetto) or, for a .jsonl path, one json span per line.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, stage, **args):
+        """Times the with block as a span of stage, yields its args dict to add results."""
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name,
+                "cat": stage,
+                "ph": "X",
+                "ts": round((start - self._origin) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": threading.current_thread().ident,
+                "args": args
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def write(self, path):
+        """Writes the spans into path."""
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            if path.endswith(".jsonl"):
+                for event in events:
+                    f.write(json.dumps(event) + "\n")
+            else:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def _totals(self):
+        """Returns {stage: (seconds, count)} and {source: seconds} of the spans."""
+        stages = {}
+        sources = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            seconds = event["dur"] / 1e6
+            total, count = stages.get(event["cat"], (0.0, 0))
+            stages[event["cat"]] = (total + seconds, count + 1)
+            source = event["args"].get("source")
+            if source:
+                sources[source] = sources.get(source, 0.0) + seconds
+        return stages, sources
+
+    def stage_times(self):
+        """Returns the total seconds of each stage."""
+        return dict((stage, total) for stage, (total, count) in self._totals()[0].items())
+
+    def summary(self, top=10):
+        """Returns the profile summary text: time per stage and the slowest sources."""
+        stages, sources = self._totals()
+
+        lines = ["Stage        total (s)   count   mean (ms)"]
+        for stage, (total, count) in sorted(stages.items(), key=lambda item: -item[1][0]):
+            lines.append("{0:<12} {1:9.3f} {2:7d} {3:11.2f}".format(stage, total, count, total * 1000.0 / count))
+        lines.append("")
+        lines.append("Slowest sources       time (s)")
+        for source, total in sorted(sources.items(), key=lambda item: -item[1])[:top]:
+            lines.append("{0:<20} {1:9.3f}".format(source, total))
+        return "\n".join(lines)
+
+# Shared no-op tracer of the calls made outside a traced build
+NULL_TRACER = Tracer(enabled=False)
+
+def zip_compress_type(fname):
+    """Returns the zip compression for fname, stored for already compressed formats."""
+    if os.path.splitext(fname)[1].lower() in ZIP_STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
 def zip(src, dst):
     """zip files in a src with dst name."""
     if os.path.isfile(dst):
@@ -169,470 +657,4215 @@ def zip(src, dst):
 
     zf = zipfile.ZipFile(dst, "w")
     for f in files:
-        zf.write(os.path.join(abs_src, f), os.path.basename(f))
+        zf.write(os.path.join(abs_src, f), os.path.basename(f), compress_type=zip_compress_type(f))
     zf.close()
 
-def pynav(settings):
-    """Get user and private settings, convert files and generate htmls."""
-
-    # Dictionary items into vars.
-    pynav_convert_app = settings["convert_app"]
-    pynav_quality = str(settings["quality"])
-    pynav_input_format = str(settings["inputFormat"])
-    pynav_output_format = str(settings["outputFormat"])
-    pynav_mobile = settings["mobile"]
-    pynav_title = str(settings["title"])
-    pynav_overwrite = settings["overwrite"]
-    pynav_verbose = settings["verbose"]
-    pynav_fullPath = settings["fullPath"]
-    pynav_index = settings["index"]
-    pynav_zip = settings["zip"]
-    pynav_only_image = settings["onlyimage"]
-    pynav_flush = settings["flush"]
-    pynav_slice_size = float(settings["sliceSize"])
-    pynav_css = str(settings["css"])
-    pynav_mobl_tpl = str(settings["mobileSheet"])
-    pynav_desk_tpl = str(settings["desktopSheet"])
-    pynav_dest = os.path.abspath(settings["destinationPath"])
-    pynav_src = os.path.abspath(settings["sourcePath"])
-    pynav_file_name = settings["fileName"]
-
-    # Timing!
-    start = time.clock()
+class ZipStreamer(object):
+    """Writes files into a zip archive, from a background thread, as they are produced.
 
-    # Get source files.
-    sourceFiles = get_files_from_folder(pynav_src, pynav_input_format)
-    if not sourceFiles:
-        errprint("No existen archivos tipo {0} en el directorio {1}".format(pynav_input_format, pynav_src))
-        sys.exit()
+    The archive is written next to dst and renamed over it on close, so a
+    stopped build never leaves a half written zip behind. Every arcname is
+    added once, already compressed formats are stored and text is deflated.
+    """
 
-    # Directory creation.
-    # If the destination directory exists and not --ovwerwrite args,
-    # Pynav will createa a directory_name(n) directory.
+    def __init__(self, dst, tracer=NULL_TRACER):
+        self.dst = dst
+        self.tracer = tracer
+        self.tmp = "{0}.tmp".format(dst)
+        self.added = set()
+        self._error = None
+        self._queue = queue.Queue()
+        self._zf = zipfile.ZipFile(self.tmp, "w")
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
 
-    # Destination path exists and not --overwrite
-    if os.path.exists(pynav_dest) == True and pynav_overwrite == False:
-        trailNumber = resolve_conflict(os.path.basename(pynav_dest), pynav_dest.split(os.path.basename(pynav_dest))[0])
-        pynav_dest = "{0}({1})".format(pynav_dest, trailNumber)
-        os.makedirs(pynav_dest)
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, arcname = item
+            if self._error is not None:
+                continue
+            try:
+                with self.tracer.span(arcname, "zip", bytes=os.path.getsize(path)):
+                    self._zf.write(path, arcname, compress_type=zip_compress_type(arcname))
+            except (IOError, OSError, zipfile.BadZipfile) as e:
+                self._error = e
 
-    # Destination path doesn't exists
-    if not os.path.exists(pynav_dest):
-        os.makedirs(pynav_dest)
+    def add(self, path, arcname=None):
+        """Queues path to be written into the archive as arcname (its base name by default)."""
+        if arcname is None:
+            arcname = os.path.basename(path)
+        if arcname in self.added:
+            return
+        self.added.add(arcname)
+        self._queue.put((path, arcname))
 
-    # Command user custon names
-    if pynav_file_name != None:
-        # dest\user_custom_file_name.jpg
-        imgsFullPath = [os.path.abspath("{}/{}_{:02d}.{}".format(pynav_dest, pynav_file_name, n, pynav_output_format))\
-            for n in range(len(sourceFiles))]
+    def close(self):
+        """Waits for the queued files and moves the archive to dst."""
+        self._queue.put(None)
+        self._thread.join()
+        self._zf.close()
+        if self._error is not None:
+            os.remove(self.tmp)
+            raise self._error
+        os.replace(self.tmp, self.dst)
 
-        # dest\user_custom_file_name.html
-        htmlsFullPath = [os.path.abspath("{}/{}_{:02d}.html".format(pynav_dest, pynav_file_name, n))\
-            for n in range(len(sourceFiles))]
-    else:
-        # dest\original_name.jpg
-        imgsFullPath = [os.path.abspath("{0}/{1}.{2}".format(pynav_dest, f, pynav_output_format))\
-            for f in [os.path.basename(f[:-4]) for f in sourceFiles]]
+    def abort(self):
+        """Drops the archive."""
+        self._queue.put(None)
+        self._thread.join()
+        self._zf.close()
+        os.remove(self.tmp)
 
-        # dest\original_name.html
-        htmlsFullPath = [os.path.abspath("{0}/{1}.html".format(pynav_dest, f)) for f in [os.path.basename(f[:-4])\
-            for f in sourceFiles]]
+class PriorityExecutor(concurrent.futures.Executor):
+    """Thread pool that runs the queued calls lowest priority first, in submit order among equals.
 
-    # Pynav <a href> target htmls
-    tarHtmlsFullPath = shift(htmlsFullPath, 1)
+    Builds queue their pages by minus pixel area, the largest start first and
+    the small ones fill the gaps at the end. Shared by all the projects of
+    batch_build().
+    """
 
-    index_anchor_tag = ""
+    def __init__(self, max_workers):
+        self._queue = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._shutdown = False
+        self._threads = []
+        for n in range(max(1, max_workers)):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
 
-    # Starts convert process
-    print("\nPynav. Francis Vega 2014", end="\n")
-    print("Simple Navigation html+image from image files", end="\n\n")
+    def submit(self, fn, *args, priority=0, **kwargs):
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            heapq.heappush(self._queue, (priority, next(self._seq), future, fn, args, kwargs))
+            self._cond.notify()
+        return future
 
-    # Verbose
-    if pynav_verbose:
-        print("Convert formats: {0} to {1}".format(pynav_input_format, pynav_output_format), end="\n")
-        print("Source Path {0}".format(pynav_src), end="\n")
-        print("Destination Path {0}".format(pynav_dest), end="\n\n")
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                priority, seq, future, fn, args, kwargs = heapq.heappop(self._queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
 
-    try:
-        fileConverted = 0
-        filesToConvert = len(sourceFiles)
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for item in self._queue:
+                    item[2].cancel()
+                self._queue = []
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
 
-        # --css-style
-        customCss = ""
-        if len(pynav_css) > 0:
-            customCss = "/* CSS Style Command Inline*/\n{0}".format(pynav_css)
+def _wait_rusage(process, cancel=None, timeout=None):
+    """Waits for process and returns its exit code and peak RSS in bytes (None where unknown).
 
-        # --flush
-        if pynav_flush:
-            for content in os.listdir(pynav_dest):
-                content = os.path.join(pynav_dest, content)
-                if os.path.isdir(content):
-                    shutil.rmtree(content)
-                else:
-                    os.remove(content)
+    The process is killed after timeout seconds, raising TimeoutExpired.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    polling = cancel is not None or deadline is not None
+    if not hasattr(os, "wait4"):
+        while True:
+            try:
+                return process.wait(timeout=0.1 if polling else None), None
+            except subprocess.TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    process.kill()
+                    process.wait()
+                    raise concurrent.futures.CancelledError()
+                if deadline is not None and time.time() > deadline:
+                    process.kill()
+                    process.wait()
+                    raise subprocess.TimeoutExpired(process.args, timeout)
+    delay = 0.0005
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG if polling else 0)
+        if pid:
+            break
+        if cancel is not None and cancel.is_set():
+            process.kill()
+            os.wait4(process.pid, 0)
+            process.returncode = -9
+            raise concurrent.futures.CancelledError()
+        if deadline is not None and time.time() > deadline:
+            process.kill()
+            os.wait4(process.pid, 0)
+            process.returncode = -9
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on linux, bytes on mac
+    peak = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return process.returncode, peak
 
-        # File by file
-        for i in range(filesToConvert):
+def run_command(command, cancel=None, timeout=None):
+    """Runs command and returns its peak RSS in bytes (None where unknown).
 
-            inFile = sourceFiles[i]
-            outFile = imgsFullPath[i]
+    Raises CalledProcessError on a non zero exit status. If the cancel event
+    is set while it runs the process is killed and CancelledError is raised,
+    if it runs over timeout seconds it is killed and TimeoutError raised.
+    """
+    process = subprocess.Popen(command, shell=False)
+    try:
+        returnCode, peak = _wait_rusage(process, cancel, timeout)
+    except subprocess.TimeoutExpired:
+        raise TimeoutError("{0} sin terminar tras {1} s".format(os.path.basename(command[0]), timeout))
+    if returnCode:
+        raise subprocess.CalledProcessError(returnCode, command)
+    return peak
 
-            # If file exists and overwrite == False, skip
-            fileExists = os.path.isfile(outFile)
-            if fileExists and pynav_overwrite == False:
-                path = os.path.basename(inFile)
-                pct = int(100.0 / filesToConvert) * (i + 1)
+class MemoryBudget(object):
+    """Admits jobs while the sum of their estimated memory fits in size bytes, in arrival order.
 
-                if pynav_fullPath:
-                    path = inFile
+    A job larger than the whole budget runs alone.
+    """
 
-                print ("{:03d}% ... {} (Skip)".format(pct, path), end="\n")
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._cond = threading.Condition()
+        self._tickets = 0
+        self._head = 0
 
-            else:
-                # Select correct HTML Sheet
-                if pynav_mobile == True:
-                    Convert_HTML_template = pynav_mobl_tpl
-                else:
-                    Convert_HTML_template = pynav_desk_tpl
+    def acquire(self, amount, cancel=None):
+        """Blocks until amount bytes fit in the budget and takes them."""
+        with self._cond:
+            ticket = self._tickets
+            self._tickets += 1
+            while True:
+                if ticket == self._head:
+                    if cancel is not None and cancel.is_set():
+                        self._head += 1
+                        self._cond.notify_all()
+                        raise concurrent.futures.CancelledError()
+                    if self.used == 0 or self.used + amount <= self.size:
+                        break
+                self._cond.wait(0.1)
+            self._head += 1
+            self.used += amount
+            self._cond.notify_all()
 
-                size = get_image_size(inFile)
+    def release(self, amount):
+        """Gives back amount bytes taken by acquire()."""
+        with self._cond:
+            self.used -= amount
+            self._cond.notify_all()
 
-                width = str(size[0])
-                height = str(size[1])
+def estimate_memory(backend, width, height, slice_size):
+    """Returns the estimated peak memory in bytes of converting a width x height image.
 
-                nSlices = int(math.ceil(float(height) / pynav_slice_size))
+    The decoded image plus a slice and its resized copy, at the backend
+    bytes per pixel. Compare with the peak RSS of the trace to calibrate.
+    """
+    slicePixels = width * min(height, int(slice_size))
+    return MEMORY_BASE + (width * height + 2 * slicePixels) * backend.pixelBytes
 
-                slice_images = []
-                for slcs in range(nSlices):
-                    newSliceSize = pynav_slice_size
+def memory_limit_args(limit):
+    """Returns the convert -limit arguments that keep its pixel cache in limit bytes of memory (the rest mapped)."""
+    if not limit:
+        return []
+    megabytes = max(1, limit >> 20)
+    return ['-limit', 'memory', '{0}MiB'.format(megabytes), '-limit', 'map', '{0}MiB'.format(2 * megabytes)]
 
-                    if int(pynav_slice_size) > float(height) - (slcs * pynav_slice_size):
-                        newSliceSize = float(height) - (slcs * pynav_slice_size)
+def crop_geometry(slc):
+    """Returns the convert -crop geometry (WxH+X+Y) of a slice."""
+    return '{0}x{1}+{2}+{3}'.format(slc["width"], slc["height"], slc["x"], slc["y"])
 
-                    # change the output file name adding number for slice
-                    ofile = outFile
+def slice_variants(slc, widths=(), webp=False):
+    """Returns the responsive variants of a slice, narrowest first.
 
-                    if slcs > 0:
-                        ofile = "{0}_slice_{1}.{2}".format(outFile[:-4], str(slcs), pynav_output_format)
+    A variant is {"width", "height", "files"}: image.jpg gets image_640w.jpg
+    (and image_640w.webp) for every width below its own, plus image.webp at
+    its own width with webp.
+    """
+    base, ext = os.path.splitext(slc["file"])
+    webp = webp and ext.lower() != ".webp"
+    variants = []
+    for width in sorted(set(widths)):
+        if width >= slc["width"]:
+            continue
+        name = "{0}_{1}w".format(base, width)
+        variants.append({
+            "width": width,
+            "height": max(1, int(round(slc["height"] * float(width) / slc["width"]))),
+            "files": [name + ext] + ([name + ".webp"] if webp else [])
+        })
+    if webp:
+        variants.append({"width": slc["width"], "height": slc["height"], "files": [base + ".webp"]})
+    return variants
 
-                    # generate output files
-                    crop = '{0}x{1}+{2}+{3}'.format(int(width), int(newSliceSize), 0, int(slcs * pynav_slice_size))
+def variant_args(slc):
+    """Returns the convert arguments that write the variants of a cropped slice, from the same decode."""
+    args = []
+    for variant in slc.get("variants", ()):
+        if variant["width"] == slc["width"]:
+            for f in variant["files"]:
+                args += ['-write', f]
+        else:
+            args += ['(', '+clone', '+repage', '-resize', '{0}x'.format(variant["width"])]
+            for f in variant["files"]:
+                args += ['-write', f]
+            args += ['+delete', ')']
+    return args
 
-                    # convert
-                    # hack adding [0] suffix to flat psd when call to convert app
-                    if pynav_input_format == "psd":
-                        convertFile = "{0}[0]".format(inFile)
-                    else:
-                        convertFile = inFile
+def row_profile(image):
+    """Returns, for every row of a decoded image, whether it is uniform and its color (rgba).
 
-                    # call to convert app
-                    subprocess.call(
-                        [pynav_convert_app, '-quality', pynav_quality, convertFile, '-crop', crop, ofile],
-                        shell=False
-                    )
+    Vectorised with Pillow: every row is compared with its first pixel, the
+    rows whose pixels all stay within UNIFORM_TOLERANCE are uniform.
+    """
+    rgba = image.convert("RGBA")
+    width, height = rgba.size
+    column = rgba.crop((0, 0, 1, height))
+    bands = ImageChops.difference(rgba, column.resize((width, height), Image.NEAREST)).split()
+    diff = bands[0]
+    for band in bands[1:]:
+        diff = ImageChops.lighter(diff, band)
+    # Any pixel off makes the row mean non zero
+    rows = diff.point(lambda v: 255 if v > UNIFORM_TOLERANCE else 0).convert("F").resize((1, height), Image.BOX)
+    return [value == 0 for value in rows.getdata()], list(column.getdata())
 
-                    # Generate html img tag to include into html file
-                    slice_images.append(os.path.basename(ofile))
+def plan_content_slices(image, slice_size, collapse=False):
+    """Returns the (y, height, color) bands of a decoded image, color None for the image slices.
 
-                # --only-image false
-                if pynav_only_image == False:
+    Cuts move up to the nearest uniform row, at most CUT_SEARCH of a slice,
+    so they fall in blank space instead of through text. With collapse the
+    opaque single color runs of FLAT_BAND_MIN rows or more are flat bands
+    with their "#rrggbb" color, no image, unless short and between two
+    pieces that fit in one slice.
+    """
+    uniform, colors = row_profile(image)
+    height = len(uniform)
+    slice_size = int(slice_size)
 
-                    # Creates html file
-                    htmlFile = htmlsFullPath[i]
-                    targetFile = tarHtmlsFullPath[i]
-                    
-                    html = open(htmlFile, "w")
-
-                    # Html params
-                    nextHtmlFile = os.path.basename(targetFile)
-                    webImageFile = os.path.basename(outFile)
-
-                    # Replace custom tags
-                    tags = Convert_HTML_template
-                    tags = tags.replace("[pynav-title]", pynav_title)
-                    tags = tags.replace("[pynav-css]", customCss)
-                    tags = tags.replace("[pynav-img-width]", width)
-                    tags = tags.replace("[pynav-img-height]", height)
-                    tags = tags.replace("[pynav-next-html]", nextHtmlFile)
-
-                    
-                    if pynav_mobile:
-                        # Replace [pynav-img] with multiples img tags in case of slicing
-                        # first, grab the whole <img> tag
-                        img_tag = re.search("<[^>]+\[pynav-img\][^>]+>", tags).group()
-                        
-                        multiple_slice_images_with_img_tag = ""
-                        for img in slice_images:
-                            multiple_slice_images_with_img_tag += img_tag.replace("[pynav-img]", img)
-
-                        # Add <img> tags to final data to write html file
-                        tags = tags.replace(img_tag, multiple_slice_images_with_img_tag)
-                    else:
-                        tags = tags.replace("[pynav-img]", slice_images[0])
+    flats = []
+    y = 0
+    while collapse and y < height:
+        end = y + 1
+        if uniform[y]:
+            while end < height and uniform[end] and colors[end] == colors[y]:
+                end += 1
+            if end - y >= FLAT_BAND_MIN and colors[y][3] == 255:
+                flats.append((y, end))
+        y = end
 
-                    # Write html
-                    html.write(tags)
-                    html.close()
+    # A short band between two pieces that fit in one slice stays in it, a request less
+    kept = []
+    start = 0
+    for n, (top, bottom) in enumerate(flats):
+        nextTop = flats[n + 1][0] if n + 1 < len(flats) else height
+        if bottom - top < slice_size * CUT_SEARCH and start < top and bottom < nextTop and nextTop - start <= slice_size:
+            continue
+        kept.append((top, bottom))
+        start = bottom
+    flats = kept
 
-                # --full-path
-                if pynav_fullPath:
-                    outFile = outFile
-                else:
-                    inFile = os.path.basename(inFile)
-                    outFile = os.path.basename(outFile)
+    plan = []
+    start = 0
+    for top, bottom in flats + [(height, height)]:
+        while top - start > slice_size:
+            cut = start + slice_size
+            for row in range(cut, max(start, cut - int(slice_size * CUT_SEARCH)), -1):
+                if uniform[row]:
+                    cut = row
+                    break
+            plan.append((start, cut - start, None))
+            start = cut
+        if top > start:
+            plan.append((start, top - start, None))
+        if bottom > top:
+            plan.append((top, bottom - top, "#{0:02x}{1:02x}{2:02x}".format(*colors[top][:3])))
+        start = bottom
+    return plan
 
-                # Print info into terminal
-                print("{:03d}% ... {}".format(int((100.0 / filesToConvert) * (i + 1)), inFile))
+def content_slices(plan, outFile, output_format, width, widths=(), webp=False):
+    """Returns the slices and page blocks of a plan_content_slices() plan.
 
-                fileConverted = fileConverted + 1
+    Blocks are {"slice": n, "height"} for the image slices and {"color",
+    "height"} for the flat bands, in page order.
+    """
+    slices = []
+    blocks = []
+    for y, height, color in plan:
+        if color is not None:
+            blocks.append({"color": color, "height": height})
+            continue
+        ofile = outFile
+        if slices:
+            ofile = "{0}_slice_{1}.{2}".format(os.path.splitext(outFile)[0], len(slices), output_format)
+        slc = {"file": ofile, "x": 0, "y": y, "width": int(width), "height": height}
+        slc["variants"] = slice_variants(slc, widths, webp)
+        blocks.append({"slice": len(slices), "height": height})
+        slices.append(slc)
+    return slices, blocks
 
-            index_anchor_tag += "<li><a href='{0}'>{1}</a></li>\n".format(\
-                os.path.basename(htmlsFullPath[i]), os.path.basename(outFile)[:-4]\
-            )
+class ConvertBackend(object):
+    """Converts the slices of a page job.
 
+    A job is a dict with the source file ("source"), the file name given to
+    convert ("convertFile", with the [0] psd suffix), "quality", output
+    "format", "singlePass" and the list of "slices" (x, y, width, height,
+    output "file" and the "variants" of slice_variants()). With "dedupe" a
+    backend that sees the decoded raster may set the slice "raster" key and,
+    instead of encoding it again, the "stored" files of a raster already in
+    the "rasters" index or "sameAs" an earlier slice of the job. A backend
+    that decodes in process plans the slices of a job with "content" itself
+    (see plan_content_slices()), setting its "slices" and "blocks". A
+    backend that searches the quality of a job with "search" (see
+    search_quality()) encodes every slice within its "budget" bytes and
+    sets the slice "quality", "bytes" and scores.
+    """
+    name = None
+    tracer = NULL_TRACER
+    # --timeout, seconds a conversion may take, None unlimited
+    timeout = None
+    # Memory per decoded pixel, ImageMagick Q16 rgba
+    pixelBytes = 8
+    decodes = False
+    searches = False
 
-        indexHTML = u"<!--\
-\n\
-\n    Pynav 2014\
-\n    Francis Vega\
-\n\
-\n    hisco@inartx.com\
-\n-->\
-\n\
-\n<!DOCTYPE html>\
-\n<html>\
-\n    <head>\
-\n    <title>Index of {0}</title>\
-\n    <style>\
-\n        * {{ font-family: Arial; border: 0; margin: 0; padding: 0; }}\
-\n        a {{ color: black; text-decoration: none; }}\
-\n        a:visited {{ color: inherit; }}\
-\n        a:hover {{ color: black; font-weight: bold; }}\
-\n        h1 {{ margin: 20px 0 0 20px; }}\
-\n        li {{ line-height: 1.6; }}\
-\n        ul {{ list-style: none; margin: 20px 0 0 20px; }}\
-\n        {1}\
-\n    </style>\
-\n    </head>\
-\n    <body>\
-\n    <h1>Index of {0}</h1>\
-\n    <ul>\
-\n        {2}\
-\n    </ul>\
-\n    </body>\
-\n</html>".format(pynav_title, customCss, index_anchor_tag)
+    def _call(self, command, cancel, job, slices):
+        """Runs a convert command traced as a convert span with its exit code and peak RSS.
 
-    except KeyboardInterrupt:
-        print("", end="\n")
-        print("\nInterrupted by a user", end="\n")
+        The job "peakRss" is the largest of its commands.
+        """
+        source = os.path.basename(job["source"])
+        command = command[:1] + memory_limit_args(job.get("memoryLimit")) + command[1:]
+        with self.tracer.span(source, "convert", source=source, slices=slices) as args:
+            try:
+                peak = run_command(command, cancel, self.timeout)
+                args["exitCode"] = 0
+                args["peakRss"] = peak
+                if peak is not None:
+                    job["peakRss"] = max(job.get("peakRss") or 0, peak)
+            except subprocess.CalledProcessError as e:
+                args["exitCode"] = e.returncode
+                raise
+            except TimeoutError:
+                args["timeout"] = self.timeout
+                raise
 
-    elapsed = (time.clock() - start)
-    print("", end="\n")
-    print("{0} files converted in {1} seconds".format(str(fileConverted), str(round(elapsed,2))), end="\n\n")
-    print("Mockup finished at {0}".format(os.path.abspath(pynav_dest)), end="\n\n")
+    def convert(self, job, cancel=None):
+        """Writes every slice of job, raises on failure.
 
-    # Removes the temporal folder
-    try:
-        shutil.rmtree(tmp)
-    except:
+        Raises CancelledError if the cancel event is set before it is done,
+        and TimeoutError if it takes longer than timeout seconds.
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """Returns what tells the output of this backend apart, see ConversionCache."""
+        return self.name
+
+    def close(self):
+        """Releases the backend resources."""
         pass
 
-    # --index-of-pages
-    if pynav_index:
-        index = open(os.path.join(pynav_dest, INDEX_PAGE_NAME), "w")
-        index.write(indexHTML)
-        index.close()
+class ExternalConvertBackend(ConvertBackend):
+    """One convert process per slice, or per page with singlePass."""
+    name = "external"
 
-    # --zip
-    if pynav_zip:
-        zip_file_name = "{0}.zip".format(os.path.basename(pynav_dest))
-        zip_path_name = os.path.join(pynav_dest, zip_file_name)
-        zip(pynav_dest, zip_path_name)
-        print("Mockup zipped at {0}".format(zip_path_name), end="\n\n")
+    def __init__(self, convert_app):
+        self.convert_app = convert_app
 
+    def version(self):
+        return convert_version(self.convert_app)
 
-# Html templates
+    def convert(self, job, cancel=None):
+        # A page of flat bands only (--content-slices) has no slice to write
+        if not job["slices"]:
+            return
+        # call to convert app, a non zero exit status raises CalledProcessError
+        if job["singlePass"] and (len(job["slices"]) > 1 or job["slices"][0].get("variants")):
+            # convert in[0] ( +clone -crop A -write a +delete ) ( +clone -crop B -write b +delete ) null:
+            command = [self.convert_app, '-quality', job["quality"], job["convertFile"]]
+            for slc in job["slices"]:
+                command += ['(', '+clone', '-crop', crop_geometry(slc), '-write', slc["file"]] + variant_args(slc) + ['+delete', ')']
+            command.append('null:')
+            self._call(command, cancel, job, [os.path.basename(slc["file"]) for slc in job["slices"]])
+        else:
+            for slc in job["slices"]:
+                self._call(
+                    [self.convert_app, '-quality', job["quality"], job["convertFile"], '-crop', crop_geometry(slc)] + variant_args(slc) + [slc["file"]],
+                    cancel, job, [os.path.basename(slc["file"])]
+                )
 
-try:
-    desktopSheet = load_html_template(DESKTOP_HTML_SHEET)
-except:
-    desktopSheet ="\
-\n<!DOCTYPE html>\
-\n<html>\
-\n    <head>\
-\n    <title>[pynav-title]</title>\
-\n    <style>\
-\n        /* Pynav default style */\
-\n        * { padding: 0; margin: 0; }\
-\n        div { margin: 0 auto; background: url('[pynav-img]') top center no-repeat; height: [pynav-img-height]px; width: [pynav-img-width]px; }\
-\n        [pynav-css]\
-\n    </style>\
-\n    </head>\
-\n    <body>\
-\n        <a href='[pynav-next-html]'><div></div></a>\
-\n    </body>\
-\n</html>"
+class BatchConvertBackend(ConvertBackend):
+    """Groups the pages queued by the workers into a single convert call.
 
-try:
-    mobileSheet = load_html_template(MOBILE_HTML_SHEET)
-except:
-    mobileSheet = "\
-\n<!DOCTYPE html>\
-\n<html>\
-\n    <head>\
-\n    <title>[pynav-title]</title>\
-\n    <style>\
-\n        /* Pynav default style */\
-\n        * { padding: 0; margin: 0; }\
-\n        img { width: 100%; height: auto; display: block;}\
-\n        [pynav-css]\
-\n    </style>\
-\n    </head>\
-\n    <body>\
-\n        <a href='[pynav-next-html]'>\
-\n            <img src='[pynav-img]'>\
-\n            <img src='[pynav-img-slice-1]'>\
-\n            <img src='[pynav-img-slice-2]'>\
-\n            <img src='[pynav-img-slice-3]'>\
-\n            <img src='[pynav-img-slice-4]'>\
-\n            <img src='[pynav-img-slice-5]'>\
-\n        </a>\
-\n    </body>\
-\n</html>"
+    Each convert session decodes every page of the batch once and writes all
+    its slices, so the process and ImageMagick startup is paid once per batch.
+    A batch that fails is retried page by page to report the faulty ones.
+    """
+    name = "batch"
 
-# Pynav internal defatul settings
-userSettings = {
-        "convert_app": "C:/Program Files/Adobe/Adobe Photoshop CC (64 Bit)/convert.exe",
-        "default_title": "Pynav",
-        "default_inputFormat": "psd",
-        "default_outputFormat": "jpg",
-        "default_outputDirName": "Pynav_",
-        "default_quality": [100],
-        "default_sliceSize": [1034]
-}
+    def __init__(self, convert_app, batch_size=4, linger=0.05):
+        self.convert_app = convert_app
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._pending = []
 
-# Load settings from pynav.conf
-load_settings(userSettings)
-
-# Checks if the convert app path is correct
-# to do: En vez de mirar directamente el path, mirar que este en el sistema
-# por ejemplo en la variable de entorno PATH
-if not os.path.isfile(userSettings["convert_app"]):
-    errprint("No se encuentra el archivo {0}".format(userSettings["convert_app"]))
-    # Use imagemagick installed on osx / linux
-    if os.name == "posix":
-        userSettings["convert_app"] = "convert"
-    # sys.exit()
-
-# ARGSPARSER
-PARSER = argparse.ArgumentParser( prog="pynav", description="Creates html navigations from image files", epilog="Example of use: pynav.py --title \"Previz\" --mobile /project/psd", formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=60) )
-PARSER.add_argument( "sourcePath", metavar="Source", type=str, nargs=1, help="Source Path of Images" )
-PARSER.add_argument( "destinationPath", metavar="Destination", type=str, nargs="?", help="Destination Path of Mokcup" )
-PARSER.add_argument( "--in-format", "-if", nargs=1, dest="inFormat", default=userSettings["default_inputFormat"], type=str, help="Source file format" )
-PARSER.add_argument( "--out-format", "-of", nargs=1, dest="outFormat", default=userSettings["default_outputFormat"], type=str, help="Output file format" )
-PARSER.add_argument( "--title", "-t", nargs=1, dest="title", default=userSettings["default_title"], type=str, help="Set presentation title" )
-PARSER.add_argument( "--file-name", "-fn", nargs=1, dest="filename", type=str, help="Set custon names to out images" )
-PARSER.add_argument( "--quality", "-q", nargs=1, dest="quality", default=userSettings["default_quality"], type=int, help="Set jpg quality [1-100]" )
-PARSER.add_argument( "--overwrite", "-ow", dest="overwrite", action="store_true", help="Overwrite output files" )
-PARSER.add_argument( "--verbose", "-v", dest="verbose", action="store_true", help="Verbose mode" )
-PARSER.add_argument( "--full-path", "-fp", dest="fullpath", action="store_true", help="Show full path of files" )
-PARSER.add_argument( "--index-of-pages", "-index", dest="index", action="store_true", help="Create a index of pages" )
-PARSER.add_argument( "--only-image", "-image", dest="onlyimage", action="store_true", help="Create just image files" )
-PARSER.add_argument( "--mobile", "-m", dest="mobile", action="store_true", help="Mobile markup")
-PARSER.add_argument( "--slice", "-slc", nargs=1, dest="slice", default=userSettings["default_sliceSize"], type=int, help="Set height slice for mobile" )
-PARSER.add_argument( "--css-style", "-style", nargs=1, dest="css", default="", type=str, help="Add css style to all html files")
-PARSER.add_argument( "--zip", "-z", dest="zip", action="store_true", help="Create a zip file with results files" )
-PARSER.add_argument( "--flush", "-f", dest="flush", action="store_true", help="Delete all the content in the destination folder" )
-PARSER.add_argument( "--html-template", "-html", nargs=1, dest="html", default="", type=str, help="Use a custom html file")
-# PARSER.add_argument( "--log-file", "-l", dest="logfile", action="store_true", help="Create a log file" )
-# PARSER.add_argument( "--list-html-tags", "-tags", nargs=1, dest="html", default="", type=str, help="Show a list of pynav html tags")
-
-# Parse arguments
-DEBUG = False
-if DEBUG:
-    # DEBUG
-    pynav_args = ["--verbose", "--zip", "--flush", "-q", "1", "-ow", "-index", "E:\Dropbox\github\pynav\psd-project"]
-    args = PARSER.parse_args(pynav_args)
-else:
-    args = PARSER.parse_args()
-
-# Pynav internal settings
-settings = {
-    "convert_app": userSettings["convert_app"],
-    "customDestPath":False,
-    "onlyimage": False,
-    "date": time.strftime("%Y_%m_%d"),
-    "sourcePath": os.path.abspath("".join(args.sourcePath)),
-    "destinationPath": args.destinationPath,
-    "pynavDirName": "{0}{1}".format(userSettings["default_outputDirName"], time.strftime("%Y-%m-%d"))
-}
+    def version(self):
+        # Same convert commands as the external backend
+        return convert_version(self.convert_app)
 
-# Source Path (the only mandatory param)
-# Checks if the sourcePath exists (and is a directory) if not, Pynav stops
-if os.path.isdir(settings["sourcePath"]) == False:
-    print("El path origen {0} no existe o no es un directorio".format(settings["sourcePath"], end="\n"))
-    sys.exit()
-
-# Destination Path (optional)
-# If destination path parameter doesnt exists pynav will create a custom directory
-if settings["destinationPath"] == None:
-    settings["destinationPath"] = "{0}/{1}".format(settings["sourcePath"], settings["pynavDirName"])
-# If destination param exists, then pynav will use it to create the directory
-else:
-    settings["destinationPath"] = "".join(settings["destinationPath"])
-    settings["customDestPath"] = True
-
-# If sourcePath and destPath are the same, pynav yield a warning, just for information.
-if settings["sourcePath"] == settings["destinationPath"]:
-    print("El directorio Origen y Destino son el mismo\nConitunamos de todas formas? [y][n]", end="\n")
-    while True:
-        answer = raw_input()
-        if answer[0].upper() == "Y":
-            break
-        if answer[0].upper() == "N":
-            sys.exit()
+    def convert(self, job, cancel=None):
+        # A page already sent inside a batch is not cancelled
+        if cancel is not None and cancel.is_set():
+            raise concurrent.futures.CancelledError()
+        # A page of flat bands only (--content-slices) has no slice to write
+        if not job["slices"]:
+            return
+        item = {"job": job, "done": threading.Event(), "error": None}
+        batch = None
+        with self._lock:
+            self._pending.append(item)
+            if len(self._pending) >= self.batch_size:
+                batch, self._pending = self._pending, []
+        if batch:
+            self._run(batch)
 
-# Grab the Argparse arguments into settnigs dic
-settings["quality"] = args.quality[0]
-settings["inputFormat"] = "".join(args.inFormat)
-settings["outputFormat"] = "".join(args.outFormat)
-settings["mobile"] = args.mobile
-settings["title"] = "".join(args.title)
-settings["overwrite"] = args.overwrite
-settings["verbose"] = args.verbose
-settings["fullPath"] = args.fullpath
-settings["index"] = args.index
-settings["zip"] = args.zip
-settings["onlyimage"] = args.onlyimage
-settings["flush"] = args.flush
-settings["sliceSize"] = args.slice[0]
-settings["css"] = "".join(args.css)
-settings["html"] = "".join(args.html)
-# settings["logfile"] = args.logfile
-
-if args.filename == None:
-    settings["fileName"] = None
-else:
-    settings["fileName"] = args.filename[0]
-
-# Html template
-settings["mobileSheet"] = mobileSheet
-settings["desktopSheet"] = desktopSheet
-#settings["index"] = indexSheet
-
-if settings["html"]:
-    settings["html"] = os.path.abspath(settings["html"])
-    if os.path.isfile(settings["html"]):
-        htmlSheet = load_html_template(settings["html"])
-        if htmlSheet:
-            settings["mobileSheet"] = htmlSheet
-            settings["desktopSheet"] = htmlSheet
-        else:
-            errprint("El archivo {0} no tiene un formato de etiquetas adecuado".format(settings["html"]))
-            sys.exit()
-    else:
-        errprint("No existe el archivo html {0}".format(settings["html"]))
-        sys.exit()
+        # Not full after linger seconds, the first waiter runs what there is
+        if not item["done"].wait(self.linger):
+            with self._lock:
+                if item in self._pending:
+                    batch, self._pending = self._pending, []
+            if batch:
+                self._run(batch)
+            item["done"].wait()
+
+        if item["error"] is not None:
+            raise item["error"]
+
+    def _command(self, jobs):
+        """Returns the convert command line for a list of jobs."""
+        command = [self.convert_app] + memory_limit_args(sum(job.get("memoryLimit") or 0 for job in jobs))
+        for n, job in enumerate(jobs):
+            command += ['-quality', job["quality"], '(', job["convertFile"]]
+            for slc in job["slices"]:
+                command += ['(', '+clone', '-crop', crop_geometry(slc), '-write', slc["file"]] + variant_args(slc) + ['+delete', ')']
+            # A written page leaves the list, but null: needs an image: the last one stays
+            command += [')'] if n == len(jobs) - 1 else ['+delete', ')']
+        command.append('null:')
+        return command
+
+    def _run_jobs(self, jobs):
+        """Runs the convert call of jobs, traced with the names of its sources."""
+        sources = ",".join(os.path.basename(job["source"]) for job in jobs)
+        slices = [os.path.basename(slc["file"]) for job in jobs for slc in job["slices"]]
+        with self.tracer.span(sources, "convert", pages=len(jobs), slices=slices) as args:
+            try:
+                # The timeout of every page of the batch
+                peak = run_command(self._command(jobs), timeout=self.timeout * len(jobs) if self.timeout else None)
+                args["exitCode"] = 0
+                args["peakRss"] = peak
+                # One process for all, each page gets the peak of the batch
+                for job in jobs:
+                    job["peakRss"] = peak
+            except subprocess.CalledProcessError as e:
+                args["exitCode"] = e.returncode
+                raise
+            except TimeoutError:
+                args["timeout"] = self.timeout * len(jobs)
+                raise
+
+    def _run(self, batch):
+        try:
+            try:
+                self._run_jobs([item["job"] for item in batch])
+            except (subprocess.CalledProcessError, OSError) as e:
+                if len(batch) == 1:
+                    batch[0]["error"] = e
+                    return
+                for item in batch:
+                    try:
+                        self._run_jobs([item["job"]])
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        item["error"] = e
+        finally:
+            for item in batch:
+                item["done"].set()
+
+class PythonConvertBackend(ConvertBackend):
+    """In-process conversion with Pillow, no convert process at all.
+
+    Reads png, jpg, gif, bmp, tiff and webp, and the composite image of psd
+    files saved with maximize compatibility. Every slice comes from one decode.
+    """
+    name = "python"
+    # Pillow rgb(a), the memory is that of this process so no peak RSS per job
+    pixelBytes = 4
+    decodes = True
+    searches = True
+
+    def __init__(self):
+        if Image is None:
+            raise ValueError("El backend python necesita Pillow (pip install Pillow)")
+
+    def version(self):
+        return "Pillow {0}".format(Image.__version__)
+
+    def open(self, job):
+        """Returns the decoded image of the job source."""
+        source = os.path.basename(job["source"])
+        image = Image.open(job["source"])
+        try:
+            with self.tracer.span(source, "decode", source=source):
+                image.load()
+        except Exception:
+            image.close()
+            raise
+        return image
+
+    def convert(self, job, cancel=None):
+        # A page of flat bands only has no slice to write, unless the slices are planned here
+        if not job["slices"] and not job.get("content"):
+            return
+        source = os.path.basename(job["source"])
+        started = time.time()
+        image = self.open(job)
+        try:
+            if job.get("tiles"):
+                job["tiles"] = write_tiles(image, job["slices"][0]["file"], job["format"], job["quality"],
+                    job["tiles"]["size"], self.tracer)
+                return
+            content = job.get("content")
+            if content:
+                with self.tracer.span(source, "analyse", source=source):
+                    plan = plan_content_slices(image, content["sliceSize"], content["collapse"])
+                job["slices"], job["blocks"] = content_slices(plan, content["outFile"], job["format"],
+                    image.size[0], content["widths"], content["webp"])
+                if job.get("search"):
+                    slice_budgets(job["slices"], job["search"])
+            search = job.get("search") if job["format"].lower() in QUALITY_FORMATS else None
+            # jpg has no alpha nor palette
+            if job["format"].lower() in ("jpg", "jpeg") and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            seen = {}
+            # --page-kb, what the slices written so far left (or took over) of their share
+            carry = 0
+            for slc in job["slices"]:
+                if cancel is not None and cancel.is_set():
+                    raise concurrent.futures.CancelledError()
+                # --timeout, a slice being encoded is not interrupted
+                if self.timeout is not None and time.time() - started > self.timeout:
+                    raise TimeoutError("{0} sin terminar tras {1} s".format(source, self.timeout))
+                with self.tracer.span(os.path.basename(slc["file"]), "convert", source=source, slices=[os.path.basename(slc["file"])]) as args:
+                    piece = image.crop((slc["x"], slc["y"], slc["x"] + slc["width"], slc["y"] + slc["height"]))
+                    if job.get("dedupe"):
+                        slc["raster"] = raster_key(piece, job, slc)
+                        slc["stored"] = stored_raster(job.get("rasters"), slc)
+                        slc["sameAs"] = seen.setdefault(slc["raster"], slc)
+                        if slc["stored"] or slc["sameAs"] is not slc:
+                            # Same pixels as a slice already stored or written, no encode
+                            args["reused"] = True
+                            continue
+                    quality = int(job["quality"])
+                    if search:
+                        budget = slc.get("budget")
+                        if budget and search.get("pageBytes"):
+                            budget = max(1, budget + carry)
+                            if search.get("sliceBytes"):
+                                budget = min(budget, search["sliceBytes"])
+                        quality, data, scores = search_quality(piece, job["format"], quality, budget,
+                            search.get("minPsnr"), search.get("minSsim"))
+                        if budget and search.get("pageBytes"):
+                            carry += slc["budget"] - len(data)
+                        with open(slc["file"], "wb") as f:
+                            f.write(data)
+                        slc.update(scores, quality=quality, bytes=len(data))
+                        args.update(scores, quality=quality, bytes=len(data))
+                    else:
+                        piece.save(slc["file"], quality=quality)
+                    for variant in slc.get("variants", ()):
+                        resized = piece
+                        if variant["width"] != slc["width"]:
+                            resized = piece.resize((variant["width"], variant["height"]), Image.LANCZOS)
+                        for f in variant["files"]:
+                            resized.save(f, quality=quality)
+        finally:
+            image.close()
+
+def slice_budgets(slices, search):
+    """Sets the "budget" bytes of every slice of a quality search.
+
+    The page budget is shared by the slices in proportion to their area,
+    and capped by the slice budget.
+    """
+    area = sum(slc["width"] * slc["height"] for slc in slices) or 1
+    for slc in slices:
+        budgets = []
+        if search.get("sliceBytes"):
+            budgets.append(search["sliceBytes"])
+        if search.get("pageBytes"):
+            budgets.append(search["pageBytes"] * slc["width"] * slc["height"] // area)
+        slc["budget"] = min(budgets) if budgets else None
+
+def psnr(image, other):
+    """Returns the PSNR in dB of other against image (same size), 100 if equal."""
+    rms = ImageStat.Stat(ImageChops.difference(image.convert("RGB"), other.convert("RGB"))).rms
+    mse = sum(r * r for r in rms) / len(rms)
+    if mse == 0:
+        return 100.0
+    return 10 * math.log10(255.0 * 255.0 / mse)
+
+def _window_means(values, side):
+    """Returns the means of every side x side window of a 2d array, from its summed area table."""
+    table = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    table[1:, 1:] = values.cumsum(0).cumsum(1)
+    return (table[side:, side:] - table[:-side, side:] - table[side:, :-side] + table[:-side, :-side]) / (side * side)
+
+def ssim(image, other):
+    """Returns the mean SSIM of the luminance of other against image (same size), over SSIM_WINDOW windows."""
+    x = numpy.asarray(image.convert("L"), dtype=numpy.float64)
+    y = numpy.asarray(other.convert("L"), dtype=numpy.float64)
+    side = max(1, min(SSIM_WINDOW, x.shape[0], x.shape[1]))
+    mx = _window_means(x, side)
+    my = _window_means(y, side)
+    vx = _window_means(x * x, side) - mx * mx
+    vy = _window_means(y * y, side) - my * my
+    cxy = _window_means(x * y, side) - mx * my
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    return float((((2 * mx * my + c1) * (2 * cxy + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))).mean())
+
+def search_quality(piece, image_format, quality, budget=None, minPsnr=None, minSsim=None):
+    """Binary-searches the encoder quality of piece and returns (quality, encoded bytes, scores).
+
+    budget is in bytes, minPsnr in dB and minSsim from 0 to 1, any of them
+    None. The quality is the highest one (up to quality) within
+    the budget, raised to the lowest one that keeps the scores if the budget
+    can't keep them, or just the lowest that keeps them without budget.
+    Every trial is encoded in memory and scored on its decoded raster.
+    """
+    pillowFormat = Image.registered_extensions()["." + image_format.lower()]
+    encoded = {}
+    scores = {}
+
+    def encode(q):
+        if q not in encoded:
+            data = io.BytesIO()
+            piece.save(data, format=pillowFormat, quality=q)
+            encoded[q] = data.getvalue()
+        return encoded[q]
+
+    def score(q):
+        if q not in scores:
+            decoded = Image.open(io.BytesIO(encode(q)))
+            decoded.load()
+            scores[q] = {}
+            if minPsnr is not None:
+                scores[q]["psnr"] = psnr(piece, decoded)
+            if minSsim is not None:
+                scores[q]["ssim"] = ssim(piece, decoded)
+        return scores[q]
+
+    def keeps(q):
+        found = score(q)
+        return found.get("psnr", 100.0) >= (minPsnr or 0) and found.get("ssim", 1.0) >= (minSsim or 0)
+
+    def lowest(low, high, test, default):
+        # Lowest q in low..high passing test, test goes from False to True
+        while low <= high:
+            mid = (low + high) // 2
+            if test(mid):
+                default = mid
+                high = mid - 1
+            else:
+                low = mid + 1
+        return default
+
+    quality = int(quality)
+    low = min(QUALITY_MIN, quality)
+    chosen = quality
+    if budget and len(encode(quality)) > budget:
+        # Highest quality within the budget, the lowest one when none is
+        over = lowest(low, quality, lambda q: len(encode(q)) > budget, quality + 1)
+        chosen = max(low, over - 1)
+    if minPsnr is not None or minSsim is not None:
+        if not budget:
+            chosen = lowest(low, quality, keeps, quality)
+        elif not keeps(chosen):
+            chosen = lowest(chosen + 1, quality, keeps, quality)
+        score(chosen)
+    # Compared unrounded, rounded for the manifest
+    found = scores.get(chosen, {})
+    return chosen, encode(chosen), dict((key, round(value, 2 if key == "psnr" else 4)) for key, value in found.items())
+
+class DraftConvertBackend(PythonConvertBackend):
+    """The python backend reading psd files itself, see read_psd_draft(). --draft
+
+    A review mockup in seconds: no convert process nor layers, just the
+    composite (or the thumbnail) Photoshop saved. The job "draft" says which.
+    """
+    name = "draft"
+
+    def version(self):
+        return "draft Pillow {0}".format(Image.__version__)
+
+    def open(self, job):
+        source = os.path.basename(job["source"])
+        info = probe_image(job["source"])
+        if info is None or info[0] not in ("psd", "psb"):
+            return PythonConvertBackend.open(self, job)
+        with self.tracer.span(source, "decode", source=source) as args:
+            try:
+                draft = read_psd_draft(job["source"])
+            except struct.error:
+                draft = None
+            if draft is None:
+                raise ValueError("{0} no tiene imagen compuesta ni miniatura".format(source))
+            job["draft"] = args["draft"] = draft[1]
+        return draft[0]
+
+def tile_levels(width, height):
+    """Returns the (width, height) of every deep zoom level, from 1x1 up to width x height."""
+    # ceil(log2(largest side)) halvings, a level is the next one halved and rounded up
+    count = (max(width, height) - 1).bit_length() + 1
+    return [(-(-width >> shift), -(-height >> shift)) for shift in range(count - 1, -1, -1)]
+
+def tile_files(tiles):
+    """Returns the names of the dzi and the tiles of a page, "name_files/level/column_row.format"."""
+    folder = os.path.splitext(tiles["dzi"])[0] + "_files"
+    size = tiles["size"]
+    names = [tiles["dzi"]]
+    for level, (width, height) in enumerate(tile_levels(tiles["width"], tiles["height"])):
+        for row in range(-(-height // size)):
+            for column in range(-(-width // size)):
+                names.append("{0}/{1}/{2}_{3}.{4}".format(folder, level, column, row, tiles["format"]))
+    return names
+
+def write_tiles(image, outFile, image_format, quality, size, tracer=NULL_TRACER):
+    """Writes the deep zoom pyramid of a decoded image next to outFile and returns its tiles dict.
+
+    Every level is the next one halved, from the decoded image down to 1x1,
+    cut in size x size tiles under outFile_files/ with an outFile.dzi
+    descriptor. outFile itself is the placeholder, the largest level that
+    fits in one tile. The dict has the "dzi" name, tile "size", "format",
+    "width", "height" and "levels". The dzi and then the placeholder are
+    written last, so a page with them has every tile.
+    """
+    stem = os.path.splitext(outFile)[0]
+    image_format = image_format.lower()
+    if image_format in ("jpg", "jpeg") and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    levels = tile_levels(image.size[0], image.size[1])
+    level = image
+    placeholder = None
+    for n in range(len(levels) - 1, -1, -1):
+        name = "{0}/{1}".format(os.path.basename(stem) + "_files", n)
+        with tracer.span(name, "convert", level=n, size=levels[n]):
+            if level.size != levels[n]:
+                level = level.resize(levels[n], Image.BOX)
+            folder = "{0}_files{1}{2}".format(stem, os.sep, n)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            for y in range(0, levels[n][1], size):
+                for x in range(0, levels[n][0], size):
+                    tile = level.crop((x, y, min(x + size, levels[n][0]), min(y + size, levels[n][1])))
+                    tile.save(os.path.join(folder, "{0}_{1}.{2}".format(x // size, y // size, image_format)), quality=int(quality))
+            if placeholder is None and max(levels[n]) <= size:
+                placeholder = n
+                level.save(temp_name(outFile), quality=int(quality))
+    tiles = {"dzi": os.path.basename(stem) + ".dzi", "size": size, "format": image_format,
+        "width": image.size[0], "height": image.size[1], "levels": len(levels), "placeholder": placeholder}
+    write_atomic(stem + ".dzi", DZI_XML.format(**tiles))
+    os.replace(temp_name(outFile), outFile)
+    return tiles
+
+def raster_key(piece, job, slc):
+    """Returns the digest of a decoded slice plus everything that changes its encoded files."""
+    digest = hashlib.sha1(piece.tobytes())
+    key = [piece.mode, piece.size, job["quality"], job["format"],
+        [[variant["width"], [os.path.splitext(f)[1] for f in variant["files"]]] for variant in slc.get("variants", ())]]
+    if job.get("search"):
+        key.append([job["search"], slc.get("budget")])
+    digest.update(json.dumps(key).encode("utf-8"))
+    return digest.hexdigest()
+
+def stored_raster(rasters, slc):
+    """Returns the stored files (slice first, then its variants) of the raster of slc, None if not stored."""
+    names = (rasters or {}).get(slc["raster"])
+    if not names:
+        return None
+    folder = os.path.dirname(slc["file"])
+    files = [os.path.join(folder, name) for name in names]
+    if len(files) != 1 + sum(len(variant["files"]) for variant in slc.get("variants", ())):
+        return None
+    if not all(os.path.isfile(f) for f in files):
+        return None
+    return files
+
+def content_address(fname):
+    """Moves fname to a file named after the digest of its content, in the same folder, and returns the new path.
+
+    A file with that content already there is kept and fname removed.
+    """
+    digest = file_hash(fname)
+    stored = os.path.join(os.path.dirname(fname), "{0}{1}".format(digest[:20], os.path.splitext(fname)[1].lower()))
+    if os.path.isfile(stored):
+        os.remove(fname)
+    else:
+        os.replace(fname, stored)
+    return stored
+
+def slice_files(slc):
+    """Returns the files of a slice, the slice first and then its variants."""
+    return [slc["file"]] + [f for variant in slc["variants"] for f in variant["files"]]
+
+def commit_slices(slices):
+    """Renames the slice and variant files written under temp_name() to their final names.
+
+    The first slice, the page image a build without --incremental looks for,
+    is renamed last.
+    """
+    for slc in reversed(slices):
+        for f in reversed(slice_files(slc)):
+            if f != final_name(f) and os.path.isfile(f):
+                os.replace(f, final_name(f))
+        slc["file"] = final_name(slc["file"])
+        for variant in slc["variants"]:
+            variant["files"] = [final_name(f) for f in variant["files"]]
+
+def discard_slices(slices):
+    """Removes the slice and variant files still under temp_name(), those of a failed conversion."""
+    for slc in slices:
+        for f in slice_files(slc):
+            if f != final_name(f) and os.path.isfile(f):
+                os.remove(f)
+
+def store_slices(slices, rasters=None):
+    """Gives every slice and variant file of slices its content addressed name, identical files are stored once."""
+    for slc in slices:
+        files = slc.get("stored")
+        same = slc.pop("sameAs", slc)
+        if not files and same is not slc:
+            files = slice_files(same)
+        if not files:
+            files = [content_address(f) for f in slice_files(slc)]
+            if rasters is not None and slc.get("raster"):
+                rasters[slc["raster"]] = [os.path.basename(f) for f in files]
+        slc["file"] = files[0]
+        n = 1
+        for variant in slc["variants"]:
+            variant["files"] = files[n:n + len(variant["files"])]
+            n += len(variant["files"])
+
+def settings_backend(settings, jobs=1):
+    """Returns the backend of a BuildSettings, a DistributedBackend with distributed."""
+    # --draft reads the psd files here, faster than sending them anywhere
+    if settings.draft:
+        return DraftConvertBackend()
+    if settings.distributed:
+        return DistributedBackend(get_job_queue(settings.distributed))
+    return get_backend(settings.backend, settings.convert_app, jobs)
+
+def get_backend(name, convert_app, jobs=1):
+    """Returns the conversion backend called name."""
+    if name == "external":
+        return ExternalConvertBackend(convert_app)
+    if name == "batch":
+        return BatchConvertBackend(convert_app, batch_size=max(1, jobs // 2))
+    if name == "python":
+        return PythonConvertBackend()
+    raise ValueError("Backend desconocido {0}, usa uno de {1}".format(name, ", ".join(CONVERT_BACKENDS)))
+
+def split_job(job):
+    """Splits a page job into the serializable jobs of the workers.
+
+    One job per slice, so many workers share a big page, or a single one
+    with singlePass (one decode). Jobs write the same files every time they
+    run, a retried or duplicated job is harmless. The slices are those of the
+    page job, see merge_job_result().
+    """
+    base = dict((key, value) for key, value in job.items() if key not in ("slices", "rasters", "peakRss"))
+    if job["singlePass"]:
+        return [dict(base, slices=job["slices"])]
+    return [dict(base, slices=[slc]) for slc in job["slices"]]
+
+def merge_job_result(job, result):
+    """Copies the dedupe keys and searched qualities a worker set on the slices back to the slices of job."""
+    for n, done in enumerate(result.get("slices") or ()):
+        slc = job["slices"][n]
+        for key in ("raster", "stored") + SEARCH_KEYS:
+            if done.get(key):
+                slc[key] = done[key]
+        if done.get("sameAs") is not None:
+            slc["sameAs"] = job["slices"][done["sameAs"]]
+
+def run_job(backend, job):
+    """Runs a job of a coordinator on backend and returns its result, failures included."""
+    # The rasters index of the build stays in the coordinator
+    job["rasters"] = {}
+    result = {"id": job["id"], "worker": "{0}:{1}".format(socket.gethostname(), os.getpid())}
+    if job.get("search") and not backend.searches:
+        return dict(result, ok=False, error="El backend {0} no busca la calidad, usa -b python".format(backend.name))
+    try:
+        backend.convert(job)
+    except (subprocess.CalledProcessError, IOError, OSError, ValueError) as e:
+        return dict(result, ok=False, error=str(e))
+    slices = []
+    for slc in job["slices"]:
+        done = dict((key, slc[key]) for key in ("raster", "stored") + SEARCH_KEYS if slc.get(key))
+        same = slc.get("sameAs")
+        if same is not None and same is not slc:
+            done["sameAs"] = job["slices"].index(same)
+        slices.append(done)
+    return dict(result, ok=True, slices=slices, peakRss=job.get("peakRss"))
+
+def parse_queue_address(address):
+    """Returns ("tcp", host, port) of a host:port address, ("dir", path) of a shared folder."""
+    match = QUEUE_TCP_RE.match(address)
+    if match is not None and not os.path.isdir(address):
+        return "tcp", match.group(1), int(match.group(2))
+    return "dir", os.path.abspath(address)
+
+def _write_json(path, data):
+    """Writes data into a json file, temp file + rename so readers never see it half written."""
+    tmpPath = "{0}.tmp".format(path)
+    with open(tmpPath, "w") as f:
+        json.dump(data, f)
+    os.replace(tmpPath, path)
+
+class JobQueue(object):
+    """Coordinator side of the queue the pynav workers take the jobs from.
+
+    submit() returns a Future of the job result. A job whose worker is lost
+    is queued again, up to JOB_RETRIES times.
+    """
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._ids = itertools.count(1)
+        self._closed = threading.Event()
+
+    def submit(self, job):
+        job = dict(job, id="{0}-{1:06d}".format(self.token, next(self._ids)), attempt=0)
+        future = concurrent.futures.Future()
+        future.jobId = job["id"]
+        with self._lock:
+            self._futures[job["id"]] = future
+        self._put(job)
+        return future
+
+    def cancel(self, future):
+        """Forgets the job of future, dropped if no worker took it yet."""
+        with self._lock:
+            self._futures.pop(future.jobId, None)
+        self._discard(future.jobId)
+
+    def _pending(self, jobId):
+        with self._lock:
+            return jobId in self._futures
+
+    def _resolve(self, result):
+        with self._lock:
+            future = self._futures.pop(result["id"], None)
+        if future is not None:
+            future.set_result(result)
+
+    def _lost(self, job):
+        job = dict(job, attempt=job["attempt"] + 1)
+        if job["attempt"] > JOB_RETRIES:
+            self._resolve({"id": job["id"], "ok": False, "error": "Worker perdido {0} veces".format(job["attempt"])})
+        elif self._pending(job["id"]):
+            self._put(job)
+
+    def _put(self, job):
+        raise NotImplementedError
+
+    def _discard(self, jobId):
+        pass
+
+    def close(self):
+        """Stops handing out jobs."""
+        self._closed.set()
+
+class TcpJobQueue(JobQueue):
+    """Hands the jobs out over tcp, one json line per job and result.
+
+    Every worker connection runs one job at a time, a connection dropped
+    with a job in flight loses the job, and so does a worker that sends
+    nothing, not even its blank heartbeat lines, for JOB_LEASE seconds.
+    """
+
+    def __init__(self, host, port):
+        JobQueue.__init__(self)
+        self._jobs = queue.Queue()
+        jobQueue = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            timeout = JOB_LEASE
+
+            def handle(self):
+                jobQueue._serve(self.rfile, self.wfile)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _put(self, job):
+        self._jobs.put(job)
+
+    def _serve(self, rfile, wfile):
+        while True:
+            try:
+                job = self._jobs.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                if self._closed.is_set():
+                    return
+                continue
+            if not self._pending(job["id"]):
+                continue
+            try:
+                wfile.write(json.dumps(job).encode("utf-8") + b"\n")
+                wfile.flush()
+                line = rfile.readline()
+                while line == b"\n":
+                    line = rfile.readline()
+            except (IOError, OSError):
+                # Dropped or timed out
+                line = b""
+            if not line:
+                self._lost(job)
+                return
+            self._resolve(json.loads(line.decode("utf-8")))
+
+    def close(self):
+        JobQueue.close(self)
+        self._server.shutdown()
+        self._server.server_close()
+
+class DirJobQueue(JobQueue):
+    """Hands the jobs out through a shared folder: todo, doing and done subfolders of json files.
+
+    A worker takes a job renaming it from todo to doing and keeps touching
+    it while it runs, a job in doing untouched for JOB_LEASE seconds is lost.
+    """
+
+    def __init__(self, path):
+        JobQueue.__init__(self)
+        self.path = path
+        for folder in ("todo", "doing", "done"):
+            if not os.path.isdir(os.path.join(path, folder)):
+                os.makedirs(os.path.join(path, folder))
+        self._thread = threading.Thread(target=self._poll)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, job):
+        _write_json(os.path.join(self.path, "todo", "{0}.json".format(job["id"])), job)
+
+    def _discard(self, jobId):
+        try:
+            os.remove(os.path.join(self.path, "todo", "{0}.json".format(jobId)))
+        except OSError:
+            pass
+
+    def _poll(self):
+        done = os.path.join(self.path, "done")
+        doing = os.path.join(self.path, "doing")
+        while not self._closed.wait(QUEUE_POLL_INTERVAL):
+            for name in os.listdir(done):
+                if name.startswith(self.token) and name.endswith(".json"):
+                    try:
+                        with open(os.path.join(done, name)) as f:
+                            result = json.load(f)
+                        os.remove(os.path.join(done, name))
+                    except (IOError, OSError, ValueError):
+                        continue
+                    self._resolve(result)
+            for name in os.listdir(doing):
+                if not (name.startswith(self.token) and name.endswith(".json")):
+                    continue
+                path = os.path.join(doing, name)
+                try:
+                    st = os.stat(path)
+                    if time.time() - max(st.st_mtime, st.st_ctime) < JOB_LEASE:
+                        continue
+                    with open(path) as f:
+                        job = json.load(f)
+                    os.remove(path)
+                except (IOError, OSError, ValueError):
+                    continue
+                self._lost(job)
+
+    def close(self):
+        JobQueue.close(self)
+        self._thread.join()
+        for name in os.listdir(os.path.join(self.path, "todo")):
+            if name.startswith(self.token):
+                self._discard(name[:-len(".json")])
+
+def get_job_queue(address):
+    """Returns the TcpJobQueue or DirJobQueue of address, see parse_queue_address()."""
+    kind = parse_queue_address(address)
+    if kind[0] == "tcp":
+        return TcpJobQueue(kind[1], kind[2])
+    return DirJobQueue(kind[1])
+
+class DistributedBackend(ConvertBackend):
+    """Converts in pynav worker processes, on this or other hosts, fed by a JobQueue.
+
+    The workers see the source and destination folders at the same paths
+    (a shared folder between hosts). A failed job is sent again, up to
+    JOB_RETRIES times.
+    """
+    name = "distributed"
+    # Workers with the python backend, see run_job()
+    searches = True
+
+    def __init__(self, jobQueue):
+        self.queue = jobQueue
+
+    def _wait(self, future, cancel, futures):
+        while True:
+            try:
+                return future.result(timeout=QUEUE_POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                if cancel is not None and cancel.is_set():
+                    for pending in futures:
+                        self.queue.cancel(pending)
+                    raise concurrent.futures.CancelledError()
+
+    def convert(self, job, cancel=None):
+        source = os.path.basename(job["source"])
+        jobs = split_job(job)
+        futures = [self.queue.submit(subjob) for subjob in jobs]
+        for n, subjob in enumerate(jobs):
+            attempt = 0
+            while True:
+                slices = [os.path.basename(slc["file"]) for slc in subjob["slices"]]
+                with self.tracer.span(source, "convert", source=source, slices=slices, attempt=attempt) as args:
+                    result = self._wait(futures[n], cancel, futures[n:])
+                    args["worker"] = result.get("worker")
+                    args["peakRss"] = result.get("peakRss")
+                if result["ok"]:
+                    break
+                attempt += 1
+                if attempt > JOB_RETRIES:
+                    raise OSError(result.get("error"))
+                futures[n] = self.queue.submit(subjob)
+            merge_job_result(subjob, result)
+            if result.get("peakRss") is not None:
+                job["peakRss"] = max(job.get("peakRss") or 0, result["peakRss"])
+
+    def close(self):
+        self.queue.close()
+
+def convert_image(backend, quality, input_format, output_format, slice_size, inFile, outFile, single_pass=False, cancel=None,
+    tracer=NULL_TRACER, widths=(), webp=False, dedupe=False, rasters=None, budget=None, content=False, collapse=False,
+    search=None, tiles=None, retries=0):
+    """Converts inFile into outFile (sliced by slice_size) and returns the page.
+
+    The page is a dict with the image "width" and "height", the "slices"
+    names, the "variants" of every slice, the "blocks" of content slicing
+    (None otherwise), the "memory" estimated and the peak RSS measured
+    ("peakRss", None where unknown) in bytes, the searched "qualities" and
+    the "draft" image read with DraftConvertBackend and the deep zoom
+    "tiles" of write_tiles() (None otherwise).
+
+    With single_pass the source is decoded once by a single convert call that
+    writes every slice, instead of one convert call (and decode) per slice.
+    widths and webp add the responsive variants of every slice, written from
+    the same decode as the slice. With dedupe the files are renamed after
+    the digest of their content (identical slices of any page stored once)
+    and rasters indexes the stored files by decoded raster, for backends
+    that can skip encoding a known raster. With a MemoryBudget budget the
+    conversion waits until its estimated memory fits, and convert is
+    limited to it. With content the slices follow the image content (see
+    plan_content_slices(), Pillow decodes it), and collapse leaves the flat
+    bands out of the images. With search ("sliceBytes" and "pageBytes"
+    budgets, "minPsnr", "minSsim") the quality of every slice is searched
+    by the backend (see search_quality()) and "qualities" has the quality,
+    bytes and scores of every slice, None otherwise. With tiles (the tile
+    size) the page is a deep zoom pyramid from one decode instead, and its
+    only slice is the placeholder outFile. A failed conversion is run again
+    up to retries times, see retry_job(), and "attempts" are those it took.
+    Slices are written under temp_name() and renamed once all of them are,
+    a failed or interrupted page leaves none. Setting the cancel event stops
+    the conversion with CancelledError.
+    """
+    if cancel is not None and cancel.is_set():
+        raise concurrent.futures.CancelledError()
+
+    with tracer.span(os.path.basename(inFile), "probe", source=os.path.basename(inFile)):
+        info = probe_image(inFile)
+    if info is None:
+        raise ValueError("No se puede leer el tamaño de la imagen {0}".format(inFile))
+
+    width = str(info[1])
+    height = str(info[2])
+
+    nSlices = int(math.ceil(float(height) / slice_size))
+
+    # convert
+    # hack adding [0] suffix to flat psd/psb when call to convert app
+    if input_format in ("psd", "psb") or info[0] in ("psd", "psb"):
+        convertFile = "{0}[0]".format(inFile)
+    else:
+        convertFile = inFile
+
+    # Renamed to the outFile names by commit_slices()
+    tmpFile = temp_name(outFile)
+    slices = []
+    for slcs in range(nSlices):
+        newSliceSize = slice_size
+
+        if int(slice_size) > float(height) - (slcs * slice_size):
+            newSliceSize = float(height) - (slcs * slice_size)
+
+        # change the output file name adding number for slice
+        ofile = tmpFile
+
+        if slcs > 0:
+            ofile = "{0}_slice_{1}.{2}".format(os.path.splitext(tmpFile)[0], str(slcs), output_format)
+
+        # generate output files
+        slc = {"file": ofile, "x": 0, "y": int(slcs * slice_size), "width": int(width), "height": int(newSliceSize)}
+        slc["variants"] = slice_variants(slc, widths, webp)
+        slices.append(slc)
+
+    memory = estimate_memory(backend, int(width), int(height), slice_size)
+    job = {
+        "source": inFile,
+        "convertFile": convertFile,
+        "quality": quality,
+        "format": output_format,
+        "singlePass": single_pass,
+        "slices": slices,
+        "dedupe": dedupe,
+        "rasters": rasters,
+        "memoryLimit": memory if budget is not None else None
+    }
+    if content and backend.decodes:
+        job["content"] = {"sliceSize": slice_size, "collapse": collapse, "outFile": tmpFile, "widths": widths, "webp": webp}
+    elif content:
+        with tracer.span(os.path.basename(inFile), "analyse", source=os.path.basename(inFile)):
+            image = Image.open(inFile)
+            try:
+                plan = plan_content_slices(image, slice_size, collapse)
+            finally:
+                image.close()
+        job["slices"], job["blocks"] = content_slices(plan, tmpFile, output_format, width, widths, webp)
+    if search:
+        job["search"] = search
+        slice_budgets(job["slices"], search)
+    if tiles:
+        job["slices"] = [{"file": outFile, "x": 0, "y": 0, "width": int(width), "height": int(height), "variants": []}]
+        job["tiles"] = {"size": tiles}
+    try:
+        if budget is None:
+            retry_job(backend, job, cancel, tracer, retries)
+        else:
+            with tracer.span(os.path.basename(inFile), "admit", source=os.path.basename(inFile), memory=memory):
+                budget.acquire(memory, cancel)
+            try:
+                retry_job(backend, job, cancel, tracer, retries)
+            finally:
+                budget.release(memory)
+        commit_slices(job["slices"])
+    finally:
+        discard_slices(job["slices"])
+
+    slices = job["slices"]
+    if dedupe:
+        with tracer.span(os.path.basename(inFile), "dedupe", source=os.path.basename(inFile)):
+            store_slices(slices, rasters)
+
+    # Generate html img tag to include into html file
+    slice_images = [os.path.basename(slc["file"]) for slc in slices]
+    variants = [[dict(variant, files=[os.path.basename(f) for f in variant["files"]]) for variant in slc["variants"]]
+        for slc in slices]
+    qualities = None
+    if search:
+        # --dedupe, a slice not encoded again has the quality of the one it is the same as
+        qualities = [dict((key, value) for key, value in (slc.get("sameAs") or slc).items() if key in SEARCH_KEYS)
+            for slc in slices]
+
+    return {
+        "width": width,
+        "height": height,
+        "slices": slice_images,
+        "variants": variants,
+        "blocks": job.get("blocks"),
+        "memory": memory,
+        "peakRss": job.get("peakRss"),
+        "qualities": qualities,
+        "draft": job.get("draft"),
+        "tiles": job.get("tiles"),
+        "attempts": job.get("attempts")
+    }
+
+def retry_job(backend, job, cancel=None, tracer=NULL_TRACER, retries=0):
+    """Runs job with convert_job(), again up to retries times if it fails, and sets its "attempts".
+
+    The nth retry waits RETRY_DELAY * 2 ** (n - 1) seconds first, traced as
+    a retry span. A job that keeps failing raises its last error.
+    """
+    source = os.path.basename(job["source"])
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            convert_job(backend, job, cancel, tracer)
+            job["attempts"] = attempt
+            return
+        except (subprocess.CalledProcessError, OSError) as e:
+            if attempt > retries:
+                raise
+            delay = RETRY_DELAY * 2 ** (attempt - 1)
+            with tracer.span(source, "retry", source=source, attempt=attempt, delay=delay, error=str(e)):
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    raise concurrent.futures.CancelledError()
+
+def convert_job(backend, job, cancel=None, tracer=NULL_TRACER):
+    """Runs job on backend. Pillow decodes the --tiles jobs of backends that don't decode."""
+    if not job.get("tiles") or backend.decodes:
+        backend.convert(job, cancel)
+        return
+    source = os.path.basename(job["source"])
+    image = Image.open(job["source"])
+    try:
+        with tracer.span(source, "decode", source=source):
+            image.load()
+        job["tiles"] = write_tiles(image, job["slices"][0]["file"], job["format"], job["quality"], job["tiles"]["size"], tracer)
+    finally:
+        image.close()
+
+def _compile_tags(text):
+    """Returns (parts, slots) of text: literal parts with a hole for every tag and its (index, tag, "[pynav-tag]") slot."""
+    parts = []
+    slots = []
+    pos = 0
+    for match in TEMPLATE_TAG_RE.finditer(text):
+        parts.append(text[pos:match.start()])
+        slots.append((len(parts), match.group(1), match.group()))
+        parts.append(None)
+        pos = match.end()
+    parts.append(text[pos:])
+    return parts, slots
+
+def _fill_tags(parts, slots, values):
+    """Returns the parts with the slots filled from values, unknown tags are left as they are."""
+    out = list(parts)
+    get = values.get
+    for index, name, tag in slots:
+        out[index] = get(name, tag)
+    return "".join(out)
+
+class HtmlTemplate(object):
+    """A pynav html template compiled once into literal parts and tag slots.
+
+    Tags: [pynav-title], [pynav-css], [pynav-img-width], [pynav-img-height],
+    [pynav-next-html], [pynav-img], [pynav-img-slice-N], the responsive
+    [pynav-img-srcset], [pynav-img-sources], [pynav-img-image-set], in the
+    index template [pynav-page-link] and in the tiles template
+    [pynav-tiles-json]. With repeat (mobile) the <img>
+    tag (or <picture> element) holding [pynav-img] is written once per
+    slice, unless the template places the slices with [pynav-img-slice-N]
+    tags. The tag of a [pynav-img-slice-N] is left out when the image has no
+    slice N, and if there are more slices than [pynav-img-slice-N] tags the
+    last one is repeated for the rest. Responsive tags take the values of
+    the slice of their block, of the first slice elsewhere. Flat bands of
+    content slicing are written between the repeated tags (repeatsImg).
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.single = self._compile(text, None)
+        self.lastSlice = max([int(a or b) for a, b in TEMPLATE_SLICE_BLOCK_RE.findall(text)] or [0])
+        self.responsive = any("[pynav-{0}]".format(tag) in text for tag in TEMPLATE_RESPONSIVE_TAGS)
+        # Templates with [pynav-img-slice-N] tags place the slices themselves
+        if self.lastSlice:
+            self.repeated = self.single
+        else:
+            self.repeated = self._compile(text, TEMPLATE_IMG_BLOCK_RE.search(text))
+        self.repeatsImg = any(block[1] is None for block in self.repeated[2])
+
+    def _compile(self, text, imgBlock):
+        """Returns (parts, slots, blocks), blocks are (index, slice number or None for the img block, parts, slots)."""
+        parts = []
+        slots = []
+        blocks = []
+        pos = 0
+        matches = list(TEMPLATE_SLICE_BLOCK_RE.finditer(text))
+        if imgBlock is not None:
+            matches.append(imgBlock)
+        for match in sorted(matches, key=lambda m: m.start()) + [None]:
+            end = len(text) if match is None else match.start()
+            if end < pos:
+                continue
+            textParts, textSlots = _compile_tags(text[pos:end])
+            slots += [(len(parts) + index, name, tag) for index, name, tag in textSlots]
+            parts += textParts
+            if match is None:
+                break
+            n = None if match is imgBlock else int(match.group(1) or match.group(2))
+            blocks.append((len(parts), n) + _compile_tags(match.group()))
+            parts.append("")
+            pos = match.end()
+        return parts, slots, blocks
+
+    def render(self, values, slices=(), repeat=False, sliceValues=None, pageBlocks=None):
+        """Returns the html with the tags replaced by values (tag name without brackets).
+
+        sliceValues(n) returns the values of slice n for the responsive tags,
+        called only for the slices the template shows. pageBlocks, the
+        blocks of content_slices(), places flat bands among repeated slices.
+        """
+        parts, slots, blocks = self.repeated if repeat else self.single
+        if slices:
+            values["img"] = slices[0]
+            if sliceValues:
+                values.update(sliceValues(0))
+        if self.lastSlice:
+            for n in range(1, len(slices)):
+                values["img-slice-{0}".format(n)] = slices[n]
+
+        out = list(parts)
+        get = values.get
+        for index, name, tag in slots:
+            out[index] = get(name, tag)
+
+        for index, n, blockParts, blockSlots in blocks:
+            rendered = []
+            if n is None and sliceValues:
+                for k, img in enumerate(slices):
+                    values["img"] = img
+                    values.update(sliceValues(k))
+                    rendered.append(_fill_tags(blockParts, blockSlots, values))
+            elif n is None:
+                # Only [pynav-img] changes from slice to slice
+                values["img"] = "[pynav-img]"
+                pieces = _fill_tags(blockParts, blockSlots, values).split("[pynav-img]")
+                for img in slices:
+                    rendered.append(img.join(pieces))
+            else:
+                if n < len(slices):
+                    if sliceValues:
+                        values.update(sliceValues(n))
+                    rendered.append(_fill_tags(blockParts, blockSlots, values))
+                # Slices beyond the last tag
+                if n == self.lastSlice:
+                    for extra in range(n + 1, len(slices)):
+                        values["img-slice-{0}".format(n)] = slices[extra]
+                        if sliceValues:
+                            values.update(sliceValues(extra))
+                        rendered.append(_fill_tags(blockParts, blockSlots, values))
+            if n is None and pageBlocks:
+                # Slices in page order, the flat bands in between
+                sliceBlocks = rendered
+                rendered = [sliceBlocks[block["slice"]] if "slice" in block else
+                    FLAT_BLOCK_HTML.format(color=block["color"], width=values.get("img-width"), height=block["height"])
+                    for block in pageBlocks]
+            out[index] = "".join(rendered)
+        return "".join(out)
+
+_compiled_templates = {}
+
+def compile_template(text):
+    """Returns the HtmlTemplate of text, compiled once per process."""
+    template = _compiled_templates.get(text)
+    if template is None:
+        template = _compiled_templates[text] = HtmlTemplate(text)
+    return template
+
+IMAGE_MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+
+def slice_srcsets(image, variants, width):
+    """Returns the srcset of a slice image of width pixels and its variants of the same format,
+    the srcset of its webp variants and its own size webp (None without webp)."""
+    ext = os.path.splitext(image)[1].lower()
+    srcset = []
+    webpset = []
+    webpImage = None
+    for variant in variants or ():
+        for f in variant["files"]:
+            if os.path.splitext(f)[1].lower() == ext:
+                srcset.append("{0} {1}w".format(f, variant["width"]))
+            else:
+                webpset.append("{0} {1}w".format(f, variant["width"]))
+                if str(variant["width"]) == str(width):
+                    webpImage = f
+    srcset.append("{0} {1}w".format(image, width))
+    return ", ".join(srcset), ", ".join(webpset), webpImage
+
+def responsive_values(image, variants, width):
+    """Returns the responsive tag values of a slice image of width pixels and its variants.
+
+    [pynav-img-srcset] lists the image and its narrower copies of the same
+    format, [pynav-img-sources] is the webp <source> of a <picture> (empty
+    without webp) and [pynav-img-image-set] the css image-set() candidates.
+    """
+    ext = os.path.splitext(image)[1].lower()
+    mime = IMAGE_MIME_TYPES.get(ext) or "image/" + ext.lstrip(".")
+    if not variants:
+        return {
+            "img-srcset": "{0} {1}w".format(image, width),
+            "img-sources": "",
+            "img-image-set": "url('{0}') type('{1}')".format(image, mime)
+        }
+
+    srcset, webpset, webpImage = slice_srcsets(image, variants, width)
+    imageSet = ["url('{0}') type('{1}')".format(image, mime)]
+    if webpImage:
+        imageSet.insert(0, "url('{0}') type('image/webp')".format(webpImage))
+    return {
+        "img-srcset": srcset,
+        "img-sources": "<source type='image/webp' srcset='{0}'>".format(webpset) if webpset else "",
+        "img-image-set": ", ".join(imageSet)
+    }
+
+def render_html_page(template, mobile, title, css, width, height, nextHtmlFile, slice_images, slice_variants=None, blocks=None,
+    tiles=None):
+    """Returns the html of a page from a compiled template, blocks are those of content_slices() and tiles of write_tiles()."""
+    sliceValues = None
+    if template.responsive:
+        sliceValues = lambda n: responsive_values(slice_images[n], slice_variants[n] if slice_variants else None, width)
+    values = {
+        "title": title,
+        "css": css,
+        "img-width": width,
+        "img-height": height,
+        "next-html": nextHtmlFile
+    }
+    if tiles:
+        values["tiles-json"] = json.dumps(dict(tiles, folder=os.path.splitext(tiles["dzi"])[0] + "_files")).replace("</", "<\\/")
+    return template.render(values, slice_images, repeat=mobile, sliceValues=sliceValues, pageBlocks=blocks)
+
+def viewer_page(entry, slice_size):
+    """Returns the viewer manifest item of a manifest page entry: its name, html and slices (and flat bands)."""
+    width = int(entry["width"])
+    height = int(entry["height"])
+    variants = entry.get("variants") or [None] * len(entry["slices"])
+    blocks = entry.get("blocks") or [{"slice": n, "height": int(min(slice_size, height - n * slice_size))}
+        for n in range(len(entry["slices"]))]
+    slices = []
+    for block in blocks:
+        # Flat band, a block of color
+        if "slice" not in block:
+            slices.append({"color": block["color"], "width": width, "height": block["height"]})
+            continue
+        n = block["slice"]
+        image = entry["slices"][n]
+        slc = {"src": image, "width": width, "height": block["height"]}
+        if variants[n]:
+            srcset, webpset, webpImage = slice_srcsets(image, variants[n], width)
+            slc["srcset"] = srcset
+            if webpset:
+                slc["webp"] = webpset
+        slices.append(slc)
+    return {
+        "name": os.path.splitext(entry["image"])[0],
+        "html": entry.get("html"),
+        "width": width,
+        "height": height,
+        "slices": slices
+    }
+
+def traced_file_hash(tracer, fname):
+    """file_hash traced as a hash span."""
+    with tracer.span(os.path.basename(fname), "hash", source=os.path.basename(fname)):
+        return file_hash(fname)
+
+def file_hash(fname):
+    """Returns the sha1 hex digest of the content of fname."""
+    digest = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def settings_fingerprint(values):
+    """Returns a digest of the settings values that affect an output."""
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_manifest(dest):
+    """Returns the build manifest of dest, an empty one if there is none or it is unreadable."""
+    empty = {"version": MANIFEST_VERSION, "image": None, "html": None, "pages": {}}
+    try:
+        with open(os.path.join(dest, MANIFEST_FILE_NAME), "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return empty
+        return manifest
+    except (IOError, OSError, ValueError):
+        return empty
+
+def save_manifest(dest, manifest):
+    """Writes the build manifest into dest (temp file + rename, never half written)."""
+    path = os.path.join(dest, MANIFEST_FILE_NAME)
+    tmpPath = "{0}.tmp".format(path)
+    with open(tmpPath, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmpPath, path)
+
+def page_entry(converted, stat, sourceHash, outFile):
+    """Returns the manifest entry of a page convert_image() converted, with no html yet.
+
+    stat is the os.stat of its source and sourceHash its digest.
+    """
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "hash": sourceHash,
+        "image": os.path.basename(outFile),
+        "slices": converted["slices"],
+        "variants": converted["variants"],
+        "blocks": converted["blocks"],
+        "qualities": converted["qualities"],
+        "draft": converted["draft"],
+        "tiles": converted["tiles"],
+        "width": converted["width"],
+        "height": converted["height"],
+        "html": None,
+        "next": None
+    }
+
+class BuildJournal(object):
+    """The pages a build has converted so far, so --resume goes on where an interrupted build stopped.
+
+    A json lines file in the destination folder, a first line with the
+    image settings fingerprint and then the manifest entry of every page
+    as soon as it is converted, flushed to disk so a crash loses at most
+    the line being written. The build removes it once its manifest is saved.
+    """
+
+    def __init__(self, dest, fingerprint):
+        self.path = os.path.join(dest, JOURNAL_FILE_NAME)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        """Returns source name -> manifest entry of the pages journaled with the same image settings."""
+        pages = {}
+        try:
+            with open(self.path, "r") as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            return pages
+        for n, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Half written when the build died
+                break
+            if n == 0:
+                if record.get("image") != self.fingerprint:
+                    return pages
+                continue
+            pages[record["source"]] = record["page"]
+        return pages
+
+    def open(self, pages=None):
+        """Starts the journal of this build with pages, the ones it resumes."""
+        tmpPath = "{0}.tmp".format(self.path)
+        with open(tmpPath, "w") as f:
+            f.write(json.dumps({"image": self.fingerprint}) + "\n")
+            for source, page in (pages or {}).items():
+                f.write(json.dumps({"source": source, "page": page}) + "\n")
+        os.replace(tmpPath, self.path)
+        self._file = open(self.path, "a")
+
+    def record(self, source, page):
+        """Appends a converted page, from any thread. Nothing once closed."""
+        line = json.dumps({"source": source, "page": page}) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self, finished=False):
+        """Stops journaling, removing the journal of a finished build."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if finished and os.path.isfile(self.path):
+            os.remove(self.path)
+
+def when_done(futures, fn):
+    """Calls fn, from the thread that finishes it, once every future of futures (None ignored) is done."""
+    pending = [future for future in futures if future is not None]
+    lock = threading.Lock()
+    left = [len(pending)]
+
+    def done(future):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            fn()
+
+    for future in pending:
+        future.add_done_callback(done)
+
+def get_page_images(entry):
+    """Returns the names of the slices, slice variants and --tiles of a manifest page entry."""
+    images = list(entry.get("slices", []))
+    for variants in entry.get("variants") or ():
+        for variant in variants:
+            images += variant["files"]
+    if entry.get("tiles"):
+        images += tile_files(entry["tiles"])
+    return images
+
+def get_page_outputs(dest, entry):
+    """Returns the full paths of the files generated for a manifest page entry."""
+    outputs = [os.path.join(dest, img) for img in get_page_images(entry)]
+    if entry.get("html"):
+        outputs.append(os.path.join(dest, entry["html"]))
+    return outputs
+
+def convert_version(convert_app):
+    """Returns the first line of convert -version, convert_app if it has none."""
+    with _convert_versions_lock:
+        if convert_app in _convert_versions:
+            return _convert_versions[convert_app]
+
+    try:
+        output = subprocess.check_output([convert_app, "-version"], stderr=subprocess.STDOUT)
+        version = output.decode("utf-8", "replace").strip().splitlines()[0]
+    except (subprocess.CalledProcessError, OSError, IndexError):
+        version = convert_app
+
+    with _convert_versions_lock:
+        _convert_versions[convert_app] = version
+    return version
+
+def _place(src, dst):
+    """Hard links (or copies, across devices) src to dst, replacing dst without writing into its old inode."""
+    if not os.path.isdir(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmpPath = "{0}.{1}.tmp".format(dst, uuid.uuid4().hex[:8])
+    try:
+        os.link(src, tmpPath)
+    except OSError:
+        shutil.copy2(src, tmpPath)
+    try:
+        os.replace(tmpPath, dst)
+    except OSError:
+        os.remove(tmpPath)
+        raise
+
+class ConversionCache(object):
+    """Converted pages shared by every build of the machine, see cached_convert_image().
+
+    An entry is a folder named after the key of the conversion (source hash,
+    image settings and backend version) with the page files and a page.json
+    describing them. Entries are built in a scratch folder and renamed into
+    place, so parallel builds (or processes) see whole entries or none. Hits
+    hard link the files (copy across devices) and touch page.json, the least
+    recently used entries go when the cache grows over size bytes. A file
+    written in place since it was stored (a build without --cache over a
+    linked destination) fails the size and mtime check and its entry goes.
+    hits, misses, stores and evictions count what this process did.
+    """
+
+    def __init__(self, root=CACHE_DIR, size=CACHE_SIZE << 20):
+        self.root = os.path.abspath(root)
+        self.size = size
+        self.scratch = os.path.join(self.root, "tmp")
+        for folder in (self.root, self.scratch):
+            if not os.path.isdir(folder):
+                os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # Bytes in the cache, scanned at the first store
+        self.used = None
+
+    def key(self, sourceHash, fingerprint, version):
+        return settings_fingerprint([CACHE_VERSION, sourceHash, fingerprint, version])
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _count(self, name, n=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def fetch(self, key, outFile):
+        """Places the files of the cached page of key as those of outFile and returns the page, None on a miss."""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, CACHE_PAGE_NAME)) as f:
+                stored = json.load(f)
+            for name, (size, mtime) in stored["files"].items():
+                st = os.stat(os.path.join(entry, name))
+                if st.st_size != size or st.st_mtime_ns != mtime:
+                    # Written in place since it was stored
+                    self._evict(entry)
+                    self._count("misses")
+                    return None
+            stem = os.path.splitext(os.path.basename(outFile))[0]
+            names = page_names(stored["page"], stored["stem"], stem)
+            folder = os.path.dirname(outFile)
+            for name in stored["files"]:
+                _place(os.path.join(entry, name), os.path.join(folder, names.get(name, name)))
+            os.utime(os.path.join(entry, CACHE_PAGE_NAME))
+        except (IOError, OSError, ValueError, KeyError):
+            # Not there, or evicted while linking it
+            self._count("misses")
+            return None
+        self._count("hits")
+        return rename_page(stored["page"], names)
+
+    def store(self, key, outFile, page):
+        """Adds the files of page, converted as outFile, to the cache under key."""
+        folder = os.path.dirname(outFile)
+        building = os.path.join(self.scratch, uuid.uuid4().hex)
+        os.mkdir(building)
+        try:
+            files = {}
+            for name in get_page_images(page):
+                _place(os.path.join(folder, name), os.path.join(building, name))
+                st = os.stat(os.path.join(building, name))
+                files[name] = [st.st_size, st.st_mtime_ns]
+            stored = {"stem": os.path.splitext(os.path.basename(outFile))[0], "page": page, "files": files}
+            with open(os.path.join(building, CACHE_PAGE_NAME), "w") as f:
+                json.dump(stored, f)
+            entry = self._entry(key)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            try:
+                os.rename(building, entry)
+            except OSError:
+                # Stored by another build meanwhile
+                return
+        finally:
+            if os.path.isdir(building):
+                shutil.rmtree(building, ignore_errors=True)
+        self._count("stores")
+        self._grow(sum(size for size, mtime in files.values()))
+
+    def _evict(self, entry):
+        """Removes an entry, renamed out of place first so no reader sees half of it."""
+        doomed = os.path.join(self.scratch, uuid.uuid4().hex)
+        try:
+            os.rename(entry, doomed)
+        except OSError:
+            # Evicted by someone else
+            return False
+        shutil.rmtree(doomed, ignore_errors=True)
+        self._count("evictions")
+        return True
+
+    def entries(self):
+        """Returns (last use, bytes, folder) of every entry."""
+        found = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or len(shard.name) != 2:
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    with open(os.path.join(entry.path, CACHE_PAGE_NAME)) as f:
+                        stored = json.load(f)
+                    used = os.stat(os.path.join(entry.path, CACHE_PAGE_NAME)).st_mtime
+                except (IOError, OSError, ValueError):
+                    continue
+                found.append((used, sum(size for size, mtime in stored["files"].values()), entry.path))
+        return found
+
+    def _grow(self, amount):
+        with self.lock:
+            if self.used is not None:
+                self.used += amount
+                if self.used <= self.size:
+                    return
+        # First store, or over the size: look at the whole cache and evict the least recently used
+        found = sorted(self.entries())
+        used = sum(size for last, size, path in found)
+        for last, size, path in found:
+            if used <= self.size:
+                break
+            if self._evict(path):
+                used -= size
+        now = time.time()
+        for leftover in os.scandir(self.scratch):
+            if now - leftover.stat().st_mtime > CACHE_STALE:
+                shutil.rmtree(leftover.path, ignore_errors=True)
+        with self.lock:
+            self.used = used
+
+    def stats(self):
+        """Returns the hits, misses, stores and evictions of this process."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+def page_names(page, stem, newStem):
+    """Returns the names of the images of page, converted as stem, converted as newStem instead.
+
+    Slices and variants start with the image name, dedupe names are digests and stay.
+    """
+    return dict((name, newStem + name[len(stem):]) for name in get_page_images(page) if name.startswith(stem))
+
+def rename_page(page, names):
+    """Returns page with its images renamed by names."""
+    if page.get("tiles"):
+        page = dict(page, tiles=dict(page["tiles"], dzi=names.get(page["tiles"]["dzi"], page["tiles"]["dzi"])))
+    return dict(page,
+        slices=[names.get(name, name) for name in page["slices"]],
+        variants=[[dict(variant, files=[names.get(f, f) for f in variant["files"]]) for variant in variants]
+            for variants in page["variants"]])
+
+def cached_convert_image(cache, fingerprint, version, inFile, outFile, tracer=NULL_TRACER, **options):
+    """convert_image() through a ConversionCache, the page also has the source "hash".
+
+    fingerprint has the image settings and version is that of the backend,
+    options are the other keyword arguments of convert_image().
+    A miss converts in a scratch folder next to outFile and moves the files
+    into place, so no file linked to the cache is ever written in place.
+    """
+    source = os.path.basename(inFile)
+    with tracer.span(source, "hash", source=source):
+        sourceHash = file_hash(inFile)
+    key = cache.key(sourceHash, fingerprint, version)
+    with tracer.span(source, "cache", source=source) as spanArgs:
+        page = cache.fetch(key, outFile)
+        spanArgs["hit"] = page is not None
+    if page is not None:
+        return dict(page, hash=sourceHash, memory=0, peakRss=None, cached=True)
+
+    folder = os.path.dirname(outFile)
+    scratch = os.path.join(folder, ".pynav-cache-{0}".format(uuid.uuid4().hex))
+    os.mkdir(scratch)
+    try:
+        page = convert_image(inFile=inFile, outFile=os.path.join(scratch, os.path.basename(outFile)), tracer=tracer, **options)
+        stored = dict((name, value) for name, value in page.items() if name not in ("memory", "peakRss", "attempts"))
+        with tracer.span(source, "cache", source=source, store=True) as spanArgs:
+            try:
+                cache.store(key, os.path.join(scratch, os.path.basename(outFile)), stored)
+            except (IOError, OSError) as e:
+                # A full or read only cache still builds
+                spanArgs["error"] = str(e)
+        # The page image last, see commit_slices()
+        for name in reversed(get_page_images(page)):
+            if not os.path.isdir(os.path.dirname(os.path.join(folder, name))):
+                os.makedirs(os.path.dirname(os.path.join(folder, name)))
+            os.replace(os.path.join(scratch, name), os.path.join(folder, name))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return dict(page, hash=sourceHash, cached=False)
+
+class PynavError(Exception):
+    """A build that cannot run (no source files, bad settings)."""
+
+
+@dataclasses.dataclass
+class BuildSettings(object):
+    """Settings of a build. The field names are the keys of the pynav() settings dictionary.
+
+    Templates left as None are the ones of pynav-conf, see default_sheets().
+    """
+    sourcePath: str
+    destinationPath: str
+    convert_app: str = "convert"
+    backend: str = "external"
+    quality: int = 100
+    inputFormat: str = "psd"
+    outputFormat: str = "jpg"
+    mobile: bool = False
+    title: str = "Pynav"
+    overwrite: bool = False
+    verbose: bool = False
+    fullPath: bool = False
+    index: bool = False
+    zip: bool = False
+    onlyimage: bool = False
+    flush: bool = False
+    sliceSize: int = 1034
+    css: str = ""
+    mobileSheet: str = None
+    desktopSheet: str = None
+    indexSheet: str = None
+    fileName: str = None
+    jobs: int = dataclasses.field(default_factory=lambda: os.cpu_count() or 1)
+    singlePass: bool = False
+    incremental: bool = False
+    trace: str = None
+    profile: bool = False
+    # Responsive variants: narrower copies of every slice and webp copies
+    widths: list = None
+    webp: bool = False
+    # Identical slices stored once under the digest of their content
+    dedupe: bool = False
+    # One viewer page navigating every page without reloads
+    viewer: bool = False
+    viewerSheet: str = None
+    # Sources in subfolders too (index sections), glob patterns of the paths
+    recursive: bool = False
+    include: list = None
+    exclude: list = None
+    # MiB of estimated convert memory admitted at once, None unlimited
+    memoryBudget: int = None
+    # Mobile slices cut in blank rows, flat bands as css blocks (Pillow)
+    contentSlices: bool = False
+    # host:port or shared folder of the pynav workers that convert, see DistributedBackend
+    distributed: str = None
+    # Quality search of every slice (python backend): KiB per slice and
+    # per page, lowest PSNR (dB) and SSIM (numpy) of the chosen quality
+    sliceBytes: int = None
+    pageBytes: int = None
+    minPsnr: float = None
+    minSsim: float = None
+    # Folder of the ConversionCache shared by the builds of the machine, MiB it may take
+    cache: str = None
+    cacheSize: int = None
+    # Psd composite or thumbnail read without ImageMagick, replaced by the next full build
+    draft: bool = False
+    # Deep zoom tile size, pages as tile pyramids shown by tilesSheet (Pillow)
+    tiles: int = None
+    tilesSheet: str = None
+    # Go on with the build interrupted in the destination, see BuildJournal
+    resume: bool = False
+    # Seconds a conversion may take, times it is run again when it fails
+    timeout: float = None
+    retries: int = 0
+
+    @classmethod
+    def from_dict(cls, settings):
+        """Returns the BuildSettings of a settings dictionary, keys that are not settings are ignored."""
+        names = set(field.name for field in dataclasses.fields(cls))
+        return cls(**dict((key, value) for key, value in settings.items() if key in names))
+
+
+class BuildResult(object):
+    """What a build did.
+
+    pages: one dict per source file in order, with its source, image, html,
+    slices, slice variants, width, height and status (Converted, Skip, Html, Cancelled or Failed).
+    Converted pages also have the estimated "memory" and measured "peakRss" bytes,
+    and the "qualities" of the quality search (see convert_image()),
+    "cached" with --cache if the images came from the cache and the
+    conversion "attempts" (--retries).
+    Failed and Cancelled pages built before keep the entry (and files) of that build.
+    errors: (source, message) of the failed conversions.
+    timings: total seconds of each build stage, see Tracer.
+    cache: hits, misses, stores and evictions of the ConversionCache, None without it.
+    """
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.pages = []
+        self.errors = []
+        self.timings = {}
+        self.elapsed = 0.0
+        self.converted = 0
+        self.index = None
+        self.viewer = None
+        self.zip = None
+        self.trace = None
+        self.interrupted = False
+        self.tracer = NULL_TRACER
+        self.cache = None
+
+    @property
+    def failed(self):
+        return [source for source, message in self.errors]
+
+
+def _silent(*args, **kwargs):
+    pass
+
+def cancel_build(executor, futures):
+    """Drops the queued conversions of a build, shutting its executor down if it owns one."""
+    for future in futures:
+        if future is not None:
+            future.cancel()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def build(settings, backend=None, log=None, error=None, executor=None, budget=None, _inflight=None):
+    """Converts the files and generates the htmls, returns a BuildResult.
+
+    settings is a BuildSettings or a pynav() settings dictionary. Nothing is
+    printed unless log (a print like function) and error are given, and
+    PynavError is raised instead of exiting. A backend passed in is used
+    instead of a new one and left open, so a long lived process can reuse
+    it (and the template and probe caches) across builds. So is a
+    PriorityExecutor, the worker pool shared by the builds of a batch, and a
+    MemoryBudget (else one of settings.memoryBudget MiB is made).
+    _inflight is the source -> cancel Event dict of the conversions in
+    flight, kept by watch().
+    """
+    if isinstance(settings, dict):
+        settings = BuildSettings.from_dict(settings)
+    log = log or _silent
+    error = error or _silent
+    sheets = default_sheets()
+
+    # Settings into vars.
+    pynav_convert_app = settings.convert_app
+    pynav_backend = settings.backend
+    pynav_quality = str(settings.quality)
+    pynav_input_format = str(settings.inputFormat)
+    pynav_output_format = str(settings.outputFormat)
+    pynav_mobile = settings.mobile
+    pynav_title = str(settings.title)
+    pynav_overwrite = settings.overwrite
+    pynav_verbose = settings.verbose
+    pynav_fullPath = settings.fullPath
+    pynav_index = settings.index
+    pynav_zip = settings.zip
+    pynav_only_image = settings.onlyimage
+    pynav_flush = settings.flush
+    pynav_slice_size = float(settings.sliceSize)
+    pynav_css = str(settings.css)
+    pynav_mobl_tpl = str(settings.mobileSheet or sheets["mobile"])
+    pynav_desk_tpl = str(settings.desktopSheet or sheets["desktop"])
+    pynav_index_tpl = str(settings.indexSheet or sheets["index"])
+    pynav_dest = os.path.abspath(settings.destinationPath)
+    pynav_src = os.path.abspath(settings.sourcePath)
+    pynav_file_name = settings.fileName
+    pynav_jobs = max(1, int(settings.jobs))
+    pynav_recursive = settings.recursive
+    pynav_include = settings.include
+    pynav_exclude = settings.exclude
+    pynav_single_pass = settings.singlePass
+    # --resume, an incremental build that also takes the pages of the journal
+    pynav_incremental = settings.incremental or settings.resume
+    pynav_inflight = _inflight
+    pynav_trace = settings.trace
+    pynav_widths = sorted(set(int(w) for w in settings.widths or ()))
+    pynav_webp = settings.webp
+    pynav_dedupe = settings.dedupe
+    pynav_viewer = settings.viewer
+    # --content-slices, mobile slices only
+    pynav_content = settings.contentSlices and pynav_mobile
+    if pynav_content and Image is None:
+        raise PynavError("--content-slices necesita Pillow (pip install Pillow)")
+    # --tiles, a pyramid per page instead of slices
+    pynav_tiles = int(settings.tiles) if settings.tiles else None
+    pynav_tiles_tpl = str(settings.tilesSheet or sheets["tiles"])
+    if pynav_tiles:
+        if Image is None:
+            raise PynavError("--tiles necesita Pillow (pip install Pillow)")
+        if pynav_viewer:
+            raise PynavError("--tiles no funciona con --viewer, cada página ya es un visor")
+        pynav_widths = []
+        pynav_webp = False
+        pynav_dedupe = False
+        pynav_content = False
+    # --slice-kb, --page-kb, --min-psnr and --min-ssim
+    pynav_search = None
+    if settings.sliceBytes or settings.pageBytes or settings.minPsnr is not None or settings.minSsim is not None:
+        pynav_search = {
+            "sliceBytes": int(settings.sliceBytes) << 10 if settings.sliceBytes else None,
+            "pageBytes": int(settings.pageBytes) << 10 if settings.pageBytes else None,
+            "minPsnr": float(settings.minPsnr) if settings.minPsnr is not None else None,
+            "minSsim": float(settings.minSsim) if settings.minSsim is not None else None
+        }
+        if pynav_output_format.lower() not in QUALITY_FORMATS:
+            raise PynavError("La búsqueda de calidad solo vale para {0}".format(", ".join(QUALITY_FORMATS)))
+        if Image is None or (pynav_search["minSsim"] is not None and numpy is None):
+            raise PynavError("La búsqueda de calidad necesita Pillow, y numpy con --min-ssim (pip install Pillow numpy)")
+    pynav_viewer_tpl = str(settings.viewerSheet or sheets["viewer"])
+    # --cache
+    pynav_cache = None
+    if settings.cache:
+        pynav_cache = ConversionCache(settings.cache, int(settings.cacheSize or CACHE_SIZE) << 20)
+    if budget is None and settings.memoryBudget:
+        budget = MemoryBudget(int(settings.memoryBudget) << 20)
+    # --timeout and --retries
+    pynav_timeout = float(settings.timeout) if settings.timeout else None
+    pynav_retries = max(0, int(settings.retries or 0))
+
+    # Spans of every build stage, BuildResult.timings and --trace / --profile
+    tracer = Tracer()
+
+    # Timing! Wall time, conversions run in parallel
+    start = time.time()
+
+    # Get source files.
+    if not os.path.isdir(pynav_src):
+        raise PynavError("El path origen {0} no existe o no es un directorio".format(pynav_src))
+    with tracer.span(pynav_src, "scan") as args:
+        sourceEntries = [entry for entry in scan_sources(pynav_src, pynav_input_format,
+            pynav_recursive, pynav_include, pynav_exclude) if not entry.path.startswith(pynav_dest + os.sep)]
+        sourceFiles = [entry.path for entry in sourceEntries]
+        args["files"] = len(sourceFiles)
+    # Manifest keys, the paths relative to the source folder (--recursive)
+    sourceNames = [source_name(f, pynav_src) for f in sourceFiles]
+    # Output names, subfolder_name with --recursive
+    sourceStems = [os.path.splitext(name)[0].replace("/", "_") for name in sourceNames]
+    if not sourceFiles:
+        raise PynavError("No existen archivos tipo {0} en el directorio {1}".format(pynav_input_format, pynav_src))
+
+    # Directory creation.
+    # If the destination directory exists and not --ovwerwrite args,
+    # Pynav will createa a directory_name(n) directory.
+
+    # Destination path exists and not --overwrite or --incremental
+    if os.path.exists(pynav_dest) == True and pynav_overwrite == False and pynav_incremental == False:
+        trailNumber = resolve_conflict(os.path.basename(pynav_dest), pynav_dest.split(os.path.basename(pynav_dest))[0])
+        pynav_dest = "{0}({1})".format(pynav_dest, trailNumber)
+        os.makedirs(pynav_dest)
+
+    # Destination path doesn't exists
+    if not os.path.exists(pynav_dest):
+        os.makedirs(pynav_dest)
+
+    # Command user custon names
+    if pynav_file_name != None:
+        # dest\user_custom_file_name.jpg
+        imgsFullPath = [os.path.abspath("{}/{}_{:02d}.{}".format(pynav_dest, pynav_file_name, n, pynav_output_format))\
+            for n in range(len(sourceFiles))]
+
+        # dest\user_custom_file_name.html
+        htmlsFullPath = [os.path.abspath("{}/{}_{:02d}.html".format(pynav_dest, pynav_file_name, n))\
+            for n in range(len(sourceFiles))]
+    else:
+        # dest\original_name.jpg
+        imgsFullPath = [os.path.abspath("{0}/{1}.{2}".format(pynav_dest, f, pynav_output_format))\
+            for f in sourceStems]
+
+        # dest\original_name.html
+        htmlsFullPath = [os.path.abspath("{0}/{1}.html".format(pynav_dest, f)) for f in sourceStems]
+
+    # Pynav <a href> target htmls
+    tarHtmlsFullPath = shift(htmlsFullPath, 1)
+
+    index_anchor_tag = ""
+
+    result = BuildResult(pynav_dest)
+    result.tracer = tracer
+
+    # Starts convert process
+    log("\nPynav. Francis Vega 2014", end="\n")
+    log("Simple Navigation html+image from image files", end="\n\n")
+
+    # Verbose
+    if pynav_verbose:
+        log("Convert formats: {0} to {1}".format(pynav_input_format, pynav_output_format), end="\n")
+        log("Source Path {0}".format(pynav_src), end="\n")
+        log("Destination Path {0}".format(pynav_dest), end="\n\n")
+
+    zipStreamer = None
+    ownBackend = backend is None
+    ownExecutor = executor is None
+    futures = []
+    indexHTML = None
+    viewerHTML = None
+    journal = None
+
+    try:
+        fileConverted = 0
+        filesToConvert = len(sourceFiles)
+
+        # --css-style
+        customCss = ""
+        if len(pynav_css) > 0:
+            customCss = "/* CSS Style Command Inline*/\n{0}".format(pynav_css)
+
+        # --flush
+        if pynav_flush:
+            for content in os.listdir(pynav_dest):
+                content = os.path.join(pynav_dest, content)
+                if os.path.isdir(content):
+                    shutil.rmtree(content)
+                else:
+                    os.remove(content)
+
+        # Half written files of a build that died
+        remove_temp_files(pynav_dest)
+
+        # --zip, images and htmls go into the archive as soon as they are written
+        if pynav_zip:
+            zip_file_name = "{0}.zip".format(os.path.basename(pynav_dest))
+            zip_path_name = os.path.join(pynav_dest, zip_file_name)
+            zipStreamer = ZipStreamer(zip_path_name, tracer)
+
+        # Select correct HTML Sheet
+        if pynav_tiles:
+            Convert_HTML_template = pynav_tiles_tpl
+        elif pynav_mobile == True:
+            Convert_HTML_template = pynav_mobl_tpl
+        else:
+            Convert_HTML_template = pynav_desk_tpl
+
+        # Build manifest, settings that change the images or just the htmls
+        manifest = load_manifest(pynav_dest)
+        imageSettings = [pynav_quality, pynav_input_format, pynav_output_format, pynav_slice_size]
+        if pynav_widths or pynav_webp:
+            imageSettings.append([pynav_widths, pynav_webp])
+        if pynav_dedupe:
+            imageSettings.append("dedupe")
+        htmlFingerprint = settings_fingerprint([Convert_HTML_template, pynav_title, customCss, pynav_mobile])
+        Convert_HTML_template = compile_template(Convert_HTML_template)
+        # Flat bands become css blocks where the template repeats the slices, else images
+        pynav_collapse = pynav_content and Convert_HTML_template.repeatsImg
+        if pynav_content:
+            imageSettings.append(["content", pynav_collapse])
+        if pynav_search:
+            imageSettings.append(["search", pynav_search])
+        if settings.draft:
+            imageSettings.append("draft")
+        if pynav_tiles:
+            imageSettings.append(["tiles", pynav_tiles])
+        imageFingerprint = settings_fingerprint(imageSettings)
+        # --resume, the pages an interrupted build converted count as built with the manifest
+        journal = BuildJournal(pynav_dest, imageFingerprint)
+        resumed = journal.load() if settings.resume else {}
+        if resumed:
+            if manifest["image"] != imageFingerprint:
+                manifest = dict(manifest, image=imageFingerprint, pages={}, rasters={})
+            manifest["pages"] = dict(manifest["pages"])
+            manifest["pages"].update(resumed)
+            log("Resuming {0} converted files".format(len(resumed)), end="\n")
+        journal.open(resumed)
+        oldPages = manifest["pages"]
+        sameImageSettings = manifest["image"] == imageFingerprint
+        sameHtmlSettings = manifest["html"] == htmlFingerprint
+        newPages = {}
+        keepOldHtml = False
+        # --dedupe, decoded raster digest -> stored files, see convert_image()
+        rasters = dict(manifest.get("rasters", {})) if pynav_dedupe and sameImageSettings else {}
+
+        if ownExecutor:
+            # --distributed, the threads just wait for the workers
+            executor = PriorityExecutor(DISTRIBUTED_THREADS if settings.distributed else pynav_jobs)
+        if ownBackend:
+            backend = settings_backend(settings, pynav_jobs)
+        if settings.distributed:
+            log("Jobs for pynav worker at {0}".format(settings.distributed), end="\n")
+        if pynav_search and not backend.searches:
+            raise PynavError("La búsqueda de calidad necesita el backend python (-b python)")
+        backend.tracer = tracer
+        backend.timeout = pynav_timeout
+        backendVersion = backend.version() if pynav_cache is not None else None
+
+        # --incremental, a page is up to date when its source and image settings
+        # did not change and all its images are still there. Touched files
+        # (same size, new mtime) are hashed to tell real edits apart.
+        sourceStats = [entry.stat() for entry in sourceEntries]
+        upToDate = [False] * filesToConvert
+        hashes = [None] * filesToConvert
+        # --overwrite converts them all again, but the pages this build already did (--resume)
+        if pynav_incremental and sameImageSettings:
+            toHash = []
+            for i in range(filesToConvert):
+                if pynav_overwrite and sourceNames[i] not in resumed:
+                    continue
+                entry = oldPages.get(sourceNames[i])
+                if entry is None or entry["image"] != os.path.basename(imgsFullPath[i]):
+                    continue
+                if not all(os.path.isfile(os.path.join(pynav_dest, img)) for img in get_page_images(entry)):
+                    continue
+                if entry["size"] != sourceStats[i].st_size:
+                    continue
+                if entry["mtime"] == sourceStats[i].st_mtime:
+                    upToDate[i] = True
+                    hashes[i] = entry["hash"]
+                else:
+                    toHash.append(i)
+            digests = list(executor.map(lambda f: traced_file_hash(tracer, f), [sourceFiles[i] for i in toHash]))
+            for n, i in enumerate(toHash):
+                hashes[i] = digests[n]
+                upToDate[i] = hashes[i] == oldPages[sourceNames[i]]["hash"]
+
+        def journal_page(i):
+            # A failed or cancelled page is converted again by --resume
+            for future in (futures[i], hashFutures[i]):
+                if future is not None and (future.cancelled() or future.exception() is not None):
+                    return
+            converted = futures[i].result()
+            sourceHash = hashFutures[i].result() if hashFutures[i] is not None else converted.get("hash", hashes[i])
+            journal.record(sourceNames[i], page_entry(converted, sourceStats[i], sourceHash, imgsFullPath[i]))
+
+        # Submit the conversions to the worker pool, largest pixel area first.
+        # Skipped files get no job, results are collected below in source order.
+        hashFutures = []
+        for i in range(filesToConvert):
+            if pynav_incremental:
+                skip = upToDate[i]
+            else:
+                # If file exists and overwrite == False, skip
+                skip = os.path.isfile(imgsFullPath[i]) and pynav_overwrite == False
+            if skip:
+                futures.append(None)
+                hashFutures.append(None)
+            else:
+                # --watch, lets the watcher cancel the conversion of a source saved again
+                cancel = None
+                if pynav_inflight is not None:
+                    cancel = threading.Event()
+                    pynav_inflight[sourceFiles[i]] = cancel
+                info = probe_image(sourceFiles[i])
+                priority = -info[1] * info[2] if info else 0
+                convertArgs = dict(backend=backend, quality=pynav_quality, input_format=pynav_input_format,
+                    output_format=pynav_output_format, slice_size=pynav_slice_size, inFile=sourceFiles[i],
+                    outFile=imgsFullPath[i], single_pass=pynav_single_pass, cancel=cancel, tracer=tracer,
+                    widths=pynav_widths, webp=pynav_webp, dedupe=pynav_dedupe, rasters=rasters, budget=budget,
+                    content=pynav_content, collapse=pynav_collapse, search=pynav_search, tiles=pynav_tiles, retries=pynav_retries)
+                if pynav_cache is not None:
+                    # The cache hashes the source for its key
+                    futures.append(executor.submit(cached_convert_image, pynav_cache, imageFingerprint, backendVersion,
+                        priority=priority, **convertArgs))
+                    hashFutures.append(None)
+                else:
+                    futures.append(executor.submit(convert_image, priority=priority, **convertArgs))
+                    hashFutures.append(executor.submit(traced_file_hash, tracer, sourceFiles[i], priority=priority)
+                        if hashes[i] is None else None)
+                # Into the journal as soon as its images and hash are done
+                when_done([futures[i], hashFutures[i]], lambda i=i: journal_page(i))
+
+        # File by file
+        for i in range(filesToConvert):
+
+            inFile = sourceFiles[i]
+            outFile = imgsFullPath[i]
+            sourceName = sourceNames[i]
+            htmlFile = htmlsFullPath[i]
+            nextHtmlFile = os.path.basename(tarHtmlsFullPath[i])
+
+            converted = None
+            status = "Skip"
+            if futures[i] is not None:
+                try:
+                    converted = futures[i].result()
+                    if hashFutures[i] is not None:
+                        hashes[i] = hashFutures[i].result()
+                    elif "hash" in converted:
+                        hashes[i] = converted["hash"]
+                except concurrent.futures.CancelledError:
+                    # Saved again while converting, the next build takes it
+                    status = "Cancelled"
+                except (subprocess.CalledProcessError, IOError, OSError, ValueError) as e:
+                    error("No se pudo convertir {0} ({1})".format(inFile, e))
+                    result.errors.append((inFile, str(e)))
+                    status = "Failed"
+                finally:
+                    if pynav_inflight is not None:
+                        pynav_inflight.pop(inFile, None)
+                # A page with no earlier build is left out, else its last good build stays (not removed below)
+                if converted is None and oldPages.get(sourceName) is None:
+                    if status == "Cancelled":
+                        log("{:03d}% ... {} (Cancelled)".format(int((100.0 / filesToConvert) * (i + 1)), os.path.basename(inFile)))
+                    result.pages.append({"source": sourceName, "status": status})
+                    continue
+
+            if converted is None:
+                path = os.path.basename(inFile)
+                pct = int(100.0 / filesToConvert) * (i + 1)
+
+                if pynav_fullPath:
+                    path = inFile
+
+                entry = oldPages.get(sourceName)
+
+                # --incremental, rewrite the html if its next page or the html settings changed
+                if pynav_incremental and pynav_only_image == False:
+                    if not sameHtmlSettings or entry.get("next") != nextHtmlFile\
+                        or entry.get("html") != os.path.basename(htmlFile) or not os.path.isfile(htmlFile):
+                        with tracer.span(sourceName, "render", source=sourceName):
+                            page = render_html_page(Convert_HTML_template, pynav_mobile, pynav_title, customCss,
+                                entry["width"], entry["height"], nextHtmlFile, entry["slices"], entry.get("variants"), entry.get("blocks"),
+                                entry.get("tiles"))
+                        with tracer.span(os.path.basename(htmlFile), "write", source=sourceName):
+                            write_atomic(htmlFile, page)
+                        entry["html"] = os.path.basename(htmlFile)
+                        entry["next"] = nextHtmlFile
+                        if status == "Skip":
+                            status = "Html"
+
+                if entry is not None:
+                    newPages[sourceName] = entry
+                    result.pages.append(dict(entry, source=sourceName, status=status))
+                    if zipStreamer is not None:
+                        for output in get_page_outputs(pynav_dest, entry):
+                            if os.path.isfile(output):
+                                zipStreamer.add(output, os.path.relpath(output, pynav_dest).replace(os.sep, "/"))
+                    # Skipped html outside --incremental is left as it was
+                    if not pynav_incremental and entry.get("html") and not sameHtmlSettings:
+                        keepOldHtml = True
+
+                log("{:03d}% ... {} ({})".format(pct, path, status), end="\n")
+
+            else:
+                entry = page_entry(converted, sourceStats[i], hashes[i], outFile)
+                newPages[sourceName] = entry
+
+                # --only-image false
+                if pynav_only_image == False:
+
+                    # Creates html file
+                    with tracer.span(sourceName, "render", source=sourceName):
+                        page = render_html_page(Convert_HTML_template, pynav_mobile, pynav_title, customCss,
+                            entry["width"], entry["height"], nextHtmlFile, entry["slices"], entry["variants"], entry["blocks"], entry["tiles"])
+                    with tracer.span(os.path.basename(htmlFile), "write", source=sourceName):
+                        write_atomic(htmlFile, page)
+                    entry["html"] = os.path.basename(htmlFile)
+                    entry["next"] = nextHtmlFile
+                result.pages.append(dict(entry, source=sourceName, status="Converted",
+                    memory=converted["memory"], peakRss=converted["peakRss"], cached=converted.get("cached"),
+                    attempts=converted.get("attempts")))
+
+                if zipStreamer is not None:
+                    for output in get_page_outputs(pynav_dest, entry):
+                        zipStreamer.add(output, os.path.relpath(output, pynav_dest).replace(os.sep, "/"))
+
+                # --full-path
+                if pynav_fullPath:
+                    outFile = outFile
+                else:
+                    inFile = os.path.basename(inFile)
+                    outFile = os.path.basename(outFile)
+
+                # Print info into terminal, with the searched qualities and bytes
+                searched = ""
+                if converted["qualities"]:
+                    found = [q["quality"] for q in converted["qualities"] if "quality" in q]
+                    if found:
+                        searched = " (q {0}-{1}, {2} KB)".format(min(found), max(found),
+                            sum(q.get("bytes", 0) for q in converted["qualities"]) >> 10)
+                if converted.get("cached"):
+                    searched += " (Cached)"
+                if converted.get("draft"):
+                    searched += " (Draft {0})".format(converted["draft"])
+                if (converted.get("attempts") or 1) > 1:
+                    searched += " (Attempts {0})".format(converted["attempts"])
+                log("{:03d}% ... {}{}".format(int((100.0 / filesToConvert) * (i + 1)), inFile, searched))
+
+                fileConverted = fileConverted + 1
+
+            # --recursive, every subfolder is a section of the index
+            section, sep, name = sourceNames[i].rpartition("/")
+            if section and (i == 0 or section != sourceNames[i - 1].rpartition("/")[0]):
+                index_anchor_tag += "<li class='pynav-section'><b>{0}</b></li>\n".format(section)
+            if pynav_file_name is None:
+                name = os.path.splitext(name)[0]
+            else:
+                name = os.path.splitext(os.path.basename(outFile))[0]
+
+            index_anchor_tag += "<li><a href='{0}'>{1}</a></li>\n".format(\
+                os.path.basename(htmlsFullPath[i]), name\
+            )
+
+        # --incremental, removes the files of the pages whose source is gone
+        # and the ones a rebuilt page no longer has (slices, variants)
+        if pynav_incremental:
+            keep = set()
+            for entry in newPages.values():
+                keep.update(get_page_outputs(pynav_dest, entry))
+            for sourceName, entry in oldPages.items():
+                for output in get_page_outputs(pynav_dest, entry):
+                    if output not in keep and os.path.isfile(output):
+                        os.remove(output)
+
+        # --dedupe, only the rasters whose files are still used
+        images = set()
+        for entry in newPages.values():
+            images.update(get_page_images(entry))
+        save_manifest(pynav_dest, {
+            "version": MANIFEST_VERSION,
+            "image": imageFingerprint,
+            "html": manifest["html"] if keepOldHtml else htmlFingerprint,
+            "pages": newPages,
+            "rasters": dict((key, names) for key, names in rasters.items() if images.issuperset(names))
+        })
+        journal.close(finished=True)
+
+        if ownExecutor:
+            executor.shutdown()
+        if ownBackend:
+            backend.close()
+
+        with tracer.span(INDEX_PAGE_NAME, "index"):
+            indexHTML = compile_template(pynav_index_tpl).render({
+                "title": pynav_title,
+                "css": customCss,
+                "page-link": index_anchor_tag
+            })
+
+        # --viewer, the pages in source order
+        if pynav_viewer:
+            with tracer.span(VIEWER_PAGE_NAME, "viewer"):
+                viewerData = {
+                    "title": pynav_title,
+                    "mobile": pynav_mobile,
+                    "pages": [viewer_page(newPages[name], pynav_slice_size) for name in sourceNames
+                        if name in newPages]
+                }
+                firstHtml = viewerData["pages"][0]["html"] if viewerData["pages"] else None
+                viewerHTML = compile_template(pynav_viewer_tpl).render({
+                    "title": pynav_title,
+                    "css": customCss,
+                    "first-html": firstHtml or "#1",
+                    # Inline too, fetch() of a json file fails in htmls opened from disk
+                    "pages-json": json.dumps(viewerData).replace("</", "<\\/")
+                })
+
+    except KeyboardInterrupt:
+        # Drop the queued conversions, the running ones get the signal too
+        cancel_build(executor if ownExecutor else None, futures)
+        if zipStreamer is not None:
+            zipStreamer.abort()
+            zipStreamer = None
+        result.interrupted = True
+        log("", end="\n")
+        log("\nInterrupted by a user", end="\n")
+        if journal is not None:
+            journal.close()
+            log("Run it again with --resume into {0} to go on from here".format(pynav_dest), end="\n")
+
+    except Exception:
+        # Leave no workers, archive or backend behind in a long lived process
+        cancel_build(executor if ownExecutor else None, futures)
+        if zipStreamer is not None:
+            zipStreamer.abort()
+        if ownBackend and backend is not None:
+            backend.close()
+        # Kept for --resume
+        if journal is not None:
+            journal.close()
+        raise
+
+    result.converted = fileConverted
+
+    # --index-of-pages
+    if pynav_index and indexHTML is not None:
+        result.index = os.path.join(pynav_dest, INDEX_PAGE_NAME)
+        with tracer.span(INDEX_PAGE_NAME, "write"):
+            write_atomic(result.index, indexHTML)
+
+    # --viewer
+    if viewerHTML is not None:
+        result.viewer = os.path.join(pynav_dest, VIEWER_PAGE_NAME)
+        with tracer.span(VIEWER_PAGE_NAME, "write"):
+            write_atomic(result.viewer, viewerHTML)
+            write_atomic(os.path.join(pynav_dest, VIEWER_PAGES_NAME), json.dumps(viewerData, indent=1))
+
+    # --zip, adds the index and any other file of the destination and closes the archive
+    if zipStreamer is not None:
+        for f in get_file_list(pynav_dest):
+            if f not in (zip_file_name, os.path.basename(zipStreamer.tmp), MANIFEST_FILE_NAME):
+                zipStreamer.add(os.path.join(pynav_dest, f))
+        zipStreamer.close()
+        result.zip = zip_path_name
+
+    result.elapsed = time.time() - start
+    result.timings = tracer.stage_times()
+    if pynav_cache is not None:
+        result.cache = pynav_cache.stats()
+
+    # --trace
+    if pynav_trace:
+        tracer.write(pynav_trace)
+        result.trace = os.path.abspath(pynav_trace)
+
+    return result
+
+def pynav(settings, _inflight=None):
+    """Builds printing the progress, exits on a build that cannot run. Returns the BuildResult."""
+    if isinstance(settings, dict):
+        settings = BuildSettings.from_dict(settings)
+    try:
+        result = build(settings, log=print, error=errprint, _inflight=_inflight)
+    except PynavError as e:
+        errprint(e)
+        sys.exit()
+
+    print("", end="\n")
+    print("{0} files converted in {1} seconds".format(str(result.converted), str(round(result.elapsed,2))), end="\n\n")
+
+    # --cache
+    if result.cache is not None:
+        print("Cache: {hits} hits, {misses} misses, {stores} stored, {evictions} evicted".format(**result.cache), end="\n\n")
+
+    # Failed conversions
+    if result.errors:
+        errprint("{0} archivos no se pudieron convertir:\n{1}".format(len(result.errors),
+            "\n".join("{0} ({1})".format(source, message) for source, message in result.errors)))
+    print("Mockup finished at {0}".format(result.destination), end="\n\n")
+
+    if result.zip:
+        print("Mockup zipped at {0}".format(result.zip), end="\n\n")
+
+    # --trace
+    if result.trace:
+        print("Trace written at {0}".format(result.trace), end="\n\n")
+
+    # --profile
+    if settings.profile:
+        print(result.tracer.summary(), end="\n\n")
+
+    return result
+
+class BatchResult(object):
+    """What a batch did: the BuildResult of every project that ran, the errors
+    (source, message) of the ones that could not, and the batch totals."""
+
+    def __init__(self):
+        self.results = []
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def converted(self):
+        return sum(result.converted for result in self.results)
+
+    @property
+    def pixels(self):
+        return sum(int(page["width"]) * int(page["height"]) for result in self.results
+            for page in result.pages if page["status"] == "Converted")
+
+    def throughput(self):
+        """Returns the converted pages per second and megapixels per second of the batch."""
+        if not self.elapsed:
+            return 0.0, 0.0
+        return self.converted / self.elapsed, self.pixels / 1e6 / self.elapsed
+
+def load_batch_file(fname):
+    """Returns the projects of a batch file, a json list of projects or {"projects": [...]}.
+
+    A project has a "source", an optional "destination" and any other
+    BuildSettings field. Relative paths are relative to the batch file.
+    """
+    with open(fname, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["projects"]
+    base = os.path.dirname(os.path.abspath(fname))
+    projects = []
+    for entry in data:
+        project = dict(entry)
+        project["sourcePath"] = os.path.join(base, project.pop("source"))
+        if project.get("destination"):
+            project["destinationPath"] = os.path.join(base, project.pop("destination"))
+        projects.append(project)
+    return projects
+
+def batch_build(projects, jobs=None, backend=None, log=None, error=None):
+    """Builds many projects feeding all their pages into one shared worker pool, returns a BatchResult.
+
+    projects are BuildSettings or settings dictionaries. Pages of every
+    project are queued largest first. When all the projects use the same
+    backend and convert app, a single backend is shared by them too. The
+    largest memoryBudget of the projects is shared by all of them.
+    """
+    projects = [BuildSettings.from_dict(p) if isinstance(p, dict) else p for p in projects]
+    log = log or _silent
+    error = error or _silent
+    jobs = jobs or max(p.jobs for p in projects)
+    batch = BatchResult()
+    start = time.time()
+
+    ownBackend = backend is None and len(set((p.backend, p.convert_app, p.distributed) for p in projects)) == 1
+    if ownBackend:
+        backend = settings_backend(projects[0], jobs)
+    executor = PriorityExecutor(DISTRIBUTED_THREADS if projects[0].distributed and ownBackend else jobs)
+    budgets = [int(p.memoryBudget) for p in projects if p.memoryBudget]
+    budget = MemoryBudget(max(budgets) << 20) if budgets else None
+    lock = threading.Lock()
+
+    def run(settings):
+        try:
+            result = build(settings, backend=backend, error=error, executor=executor, budget=budget)
+        except PynavError as e:
+            error(e)
+            with lock:
+                batch.errors.append((settings.sourcePath, str(e)))
+            return None
+        log("{0}: {1} files converted, {2} failed, {3} seconds".format(result.destination,
+            result.converted, len(result.errors), round(result.elapsed, 2)), end="\n")
+        return result
+
+    # One thread per project assembles its htmls, index and zip
+    threads = concurrent.futures.ThreadPoolExecutor(max_workers=len(projects))
+    try:
+        results = list(threads.map(run, projects))
+    finally:
+        threads.shutdown()
+        executor.shutdown()
+        if ownBackend:
+            backend.close()
+
+    batch.results = [result for result in results if result is not None]
+    batch.elapsed = time.time() - start
+    return batch
+
+def pynav_batch(projects, jobs=None):
+    """Runs batch_build() printing each project summary and the batch totals."""
+    print("\nPynav. Francis Vega 2014", end="\n")
+    print("Batch of {0} projects".format(len(projects)), end="\n\n")
+
+    batch = batch_build(projects, jobs, log=print, error=errprint)
+    pagesPerSecond, megapixelsPerSecond = batch.throughput()
+
+    print("", end="\n")
+    print("{0} files converted in {1} projects in {2} seconds".format(batch.converted, len(batch.results),
+        round(batch.elapsed, 2)), end="\n")
+    print("{0:.2f} files/s, {1:.2f} megapixels/s".format(pagesPerSecond, megapixelsPerSecond), end="\n\n")
+
+    failed = [source for result in batch.results for source in result.failed]
+    if failed:
+        errprint("{0} archivos no se pudieron convertir:\n{1}".format(len(failed), "\n".join(failed)))
+    if batch.errors:
+        errprint("{0} proyectos no se pudieron hacer:\n{1}".format(len(batch.errors),
+            "\n".join(source for source, message in batch.errors)))
+    return batch
+
+
+class PollingWatcher(object):
+    """Reports the files of a folder (and its subfolders with recursive) that were created, modified or removed, by polling."""
+
+    def __init__(self, folder, interval=WATCH_POLL_INTERVAL, recursive=False):
+        self.folder = folder
+        self.interval = interval
+        self.recursive = recursive
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        folders = [("", self.folder)]
+        while folders:
+            prefix, folder = folders.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                # Removed while scanning
+                continue
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[prefix + entry.name] = (stat.st_size, stat.st_mtime)
+                elif self.recursive and entry.is_dir(follow_symlinks=False):
+                    folders.append((prefix + entry.name + "/", entry.path))
+        return snapshot
+
+    def wait(self, timeout=None):
+        """Returns the set of changed file names ("/" separated paths below the folder), empty if nothing changed in timeout seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = set(name for name in set(snapshot) | set(self._snapshot)
+                if snapshot.get(name) != self._snapshot.get(name))
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.time())))
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    """Reports the files of a folder (and its subfolders with recursive) that were written, moved or removed, with Linux inotify."""
+
+    # Saved (closed after writing), renamed in/out, deleted
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    # Watch removed (its folder is gone), event about a folder
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, folder, recursive=False):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init")
+        self.folder = folder
+        self.recursive = recursive
+        # Watch descriptor -> "/" ended prefix of its folder below folder
+        self._prefixes = {}
+        try:
+            self._add(folder, "")
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _add(self, folder, prefix):
+        """Watches folder, and with recursive its subfolders, returns the names of the files in them."""
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        if self.recursive:
+            mask |= self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch {0}".format(folder))
+        self._prefixes[wd] = prefix
+        names = set()
+        if self.recursive:
+            for entry in os.scandir(folder):
+                if entry.is_dir(follow_symlinks=False):
+                    names |= self._add(entry.path, prefix + entry.name + "/")
+                else:
+                    names.add(prefix + entry.name)
+        return names
+
+    def wait(self, timeout=None):
+        """Returns the set of changed file names ("/" separated paths below the folder), empty if nothing changed in timeout seconds.
+
+        A subfolder moved out of the folder is reported as its name and a "/".
+        """
+        ready = select.select([self._fd], [], [], timeout)[0]
+        if not ready:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_IGNORED:
+                self._prefixes.pop(wd, None)
+                continue
+            if not name or wd not in self._prefixes:
+                continue
+            name = self._prefixes[wd] + os.fsdecode(name)
+            if mask & self.IN_ISDIR:
+                # A new or moved in subfolder is watched too, the files it came with are changes
+                if self.recursive and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        changed |= self._add(os.path.join(self.folder, *name.split("/")), name + "/")
+                    except OSError:
+                        pass
+                # A moved out subfolder is no longer watched, its files are gone: "name/" changed
+                elif self.recursive and mask & self.IN_MOVED_FROM:
+                    for subwd, prefix in list(self._prefixes.items()):
+                        if prefix.startswith(name + "/"):
+                            self._libc.inotify_rm_watch(self._fd, subwd)
+                    changed.add(name + "/")
+                continue
+            changed.add(name)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+def get_watcher(folder, recursive=False):
+    """Returns an inotify watcher on Linux, a polling one elsewhere or if inotify fails."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder, recursive=recursive)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(folder, recursive=recursive)
+
+def watch(settings, debounce=WATCH_DEBOUNCE):
+    """Builds and then rebuilds incrementally every time a source file is saved, added or removed.
+
+    Saves are debounced, a new build starts when the folder has been quiet for
+    debounce seconds. A source saved while it is converting is cancelled and
+    converted again by the next build.
+    """
+    settings = dataclasses.asdict(settings) if isinstance(settings, BuildSettings) else dict(settings)
+    settings["incremental"] = True
+    settings["overwrite"] = False
+    inflight = {}
+    source = os.path.abspath(settings["sourcePath"])
+    dest = os.path.abspath(settings["destinationPath"])
+    input_format = str(settings["inputFormat"])
+
+    def start_build():
+        def run():
+            try:
+                pynav(settings, _inflight=inflight)
+            except SystemExit:
+                # No source files left, keep watching
+                pass
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    # --recursive, the sources of the subfolders too
+    watcher = get_watcher(source, settings.get("recursive", False))
+    build = start_build()
+    pending = False
+    try:
+        while True:
+            # Not the outputs of a destination inside the source folder
+            changed = [name for name in watcher.wait(debounce if (pending or build.is_alive()) else None)
+                if (is_source_file(name, input_format) or name.endswith("/")) and not os.path.join(source, *name.split("/")).startswith(dest + os.sep)]
+            if changed:
+                # Stale versions in flight are cancelled
+                for name in changed:
+                    cancel = inflight.get(os.path.join(source, *name.split("/")))
+                    if cancel is not None:
+                        cancel.set()
+                pending = True
+                continue
+            # Quiet for debounce seconds
+            if pending and not build.is_alive():
+                print("Changes in {0}, rebuilding".format(source), end="\n")
+                build = start_build()
+                pending = False
+    except KeyboardInterrupt:
+        for cancel in list(inflight.values()):
+            cancel.set()
+        build.join()
+        print("\nStopped watching {0}".format(source), end="\n")
+    finally:
+        watcher.close()
+
+
+class SiteFile(object):
+    """A file of a served build: size, mtime, etag and read(start, end) chunks.
+
+    close() is called once the request is done with it.
+    """
+
+    def __init__(self, name, size, mtime, etag, read, release=None):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+        self.read = read
+        self._release = release
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+def _read_chunks(fhandle, start, end):
+    """Yields the bytes start..end (inclusive) of an open file, closing it at the end."""
+    try:
+        fhandle.seek(start)
+        left = end - start + 1
+        while left > 0:
+            chunk = fhandle.read(min(SERVE_CHUNK_SIZE, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+    finally:
+        fhandle.close()
+
+class FolderSite(object):
+    """Serves the files of a destination folder, as they are on disk on every request."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def get(self, name):
+        """Returns the SiteFile of name, a "/" separated relative path, or None."""
+        path = os.path.join(self.root, *name.split("/"))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return SiteFile(name, st.st_size, st.st_mtime, '"{0:x}-{1:x}"'.format(st.st_mtime_ns, st.st_size),
+            lambda start, end: _read_chunks(open(path, "rb"), start, end))
+
+    def names(self):
+        return sorted(os.listdir(self.root))
+
+    def close(self):
+        pass
+
+class _ZipArchive(object):
+    """An open build zip and the number of requests using it."""
+
+    def __init__(self, path, key):
+        self.zf = zipfile.ZipFile(path, "r")
+        self.key = key
+        self.infos = dict((info.filename, info) for info in self.zf.infolist() if not info.is_dir())
+        self.users = 0
+        self.stale = False
+
+class ZipSite(object):
+    """Serves the files of a build zip without extracting it.
+
+    The archive is opened again when the zip file changes (a build renames
+    the new one over it), requests in flight finish with the old one, which
+    is closed when the last of them is done.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._archive = None
+        with self._lock:
+            self._reopen()
+
+    def _reopen(self):
+        """Swaps in the zip file if it changed, called with the lock held."""
+        try:
+            st = os.stat(self.path)
+            key = (st.st_mtime_ns, st.st_size)
+            if self._archive is not None and key == self._archive.key:
+                return
+            archive = _ZipArchive(self.path, key)
+        except (IOError, OSError, zipfile.BadZipfile):
+            # Missing or half copied, keep serving the last good one
+            return
+        if self._archive is not None:
+            self._retire(self._archive)
+        self._archive = archive
+
+    def _retire(self, archive):
+        """Closes archive now if no request uses it, else when the last one is done. Called with the lock held."""
+        archive.stale = True
+        if archive.users == 0:
+            archive.zf.close()
+
+    def _acquire(self):
+        """Returns the current archive with one more user, None if there is none."""
+        with self._lock:
+            self._reopen()
+            archive = self._archive
+            if archive is not None:
+                archive.users += 1
+            return archive
+
+    def _release(self, archive):
+        with self._lock:
+            archive.users -= 1
+            if archive.stale and archive.users == 0:
+                archive.zf.close()
+
+    def get(self, name):
+        """Returns the SiteFile of name or None. The archive stays open until the SiteFile is closed."""
+        archive = self._acquire()
+        if archive is None:
+            return None
+        info = archive.infos.get(name)
+        if info is None:
+            self._release(archive)
+            return None
+        return SiteFile(name, info.file_size, time.mktime(info.date_time + (0, 0, -1)),
+            '"{0:08x}-{1:x}"'.format(info.CRC, info.file_size),
+            lambda start, end: _read_chunks(archive.zf.open(info), start, end),
+            lambda: self._release(archive))
+
+    def names(self):
+        archive = self._acquire()
+        if archive is None:
+            return []
+        try:
+            return sorted(archive.infos)
+        finally:
+            self._release(archive)
+
+    def close(self):
+        """Closes the archive, once the requests in flight are done."""
+        with self._lock:
+            if self._archive is not None:
+                self._retire(self._archive)
+                self._archive = None
+
+def get_site(path):
+    """Returns the ZipSite of a .zip file or the FolderSite of a folder."""
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        return ZipSite(path)
+    if os.path.isdir(path):
+        return FolderSite(path)
+    raise PynavError("{0} no es una carpeta ni un zip de pynav".format(path))
+
+def serve_cache_control(name):
+    """Returns the Cache-Control of a served file.
+
+    Images named after their content (--dedupe) never change and are cached
+    for a year, everything else is revalidated with its ETag on every use
+    so a rebuild shows up on reload.
+    """
+    if os.path.splitext(name)[1].lower() in IMAGE_MIME_TYPES and CONTENT_ADDRESS_RE.match(name):
+        return "public, max-age=31536000, immutable"
+    return "no-cache"
+
+def parse_range(header, size):
+    """Returns (start, end) of a single bytes range header, None for the whole file, ValueError if unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError(header)
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+class PreviewHandler(http.server.BaseHTTPRequestHandler):
+    """Answers GET and HEAD from the site of its PreviewServer."""
+
+    server_version = "Pynav"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        site = self.server.site
+        name = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/")
+        if not name:
+            names = site.names()
+            name = next((page for page in (INDEX_PAGE_NAME, VIEWER_PAGE_NAME) if page in names), "")
+            if not name:
+                return self._send_listing(site, body)
+        # Relative paths below the site (--tiles subfolders), no parent, absolute or dot file (the manifest) segments
+        if "\\" in name or os.path.splitdrive(name)[0] or any(not part or part.startswith(".") for part in name.split("/")):
+            return self._send_status(404, body)
+        sf = site.get(name)
+        if sf is None:
+            return self._send_status(404, body)
+        try:
+            self._send_file(sf, name, body)
+        finally:
+            sf.close()
+
+    def _send_file(self, sf, name, body):
+        lastModified = email.utils.formatdate(sf.mtime, usegmt=True)
+        if self._not_modified(sf):
+            self.send_response(304)
+            self.send_header("ETag", sf.etag)
+            self.send_header("Cache-Control", serve_cache_control(name))
+            self.end_headers()
+            return
+
+        ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        compressible = ctype in SERVE_GZIP_TYPES
+        byteRange = None
+        if self.headers.get("Range") and self.headers.get("If-Range", sf.etag) in (sf.etag, lastModified):
+            try:
+                byteRange = parse_range(self.headers["Range"], sf.size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{0}".format(sf.size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        if compressible and byteRange is None and "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(b"".join(sf.read(0, sf.size - 1)), SERVE_GZIP_LEVEL)
+            self.send_response(200)
+            self._send_file_headers(sf, name, ctype, lastModified, compressible)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if body:
+                self.wfile.write(data)
+            return
+
+        start, end = byteRange or (0, sf.size - 1)
+        self.send_response(206 if byteRange else 200)
+        self._send_file_headers(sf, name, ctype, lastModified, compressible)
+        if byteRange:
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, sf.size))
+        self.send_header("Content-Length", str(max(0, end - start + 1)))
+        self.end_headers()
+        if body and sf.size:
+            for chunk in sf.read(start, end):
+                self.wfile.write(chunk)
+
+    def _not_modified(self, sf):
+        ifNoneMatch = self.headers.get("If-None-Match")
+        if ifNoneMatch is not None:
+            tags = [tag.strip() for tag in ifNoneMatch.split(",")]
+            return "*" in tags or sf.etag in tags or sf.etag[:-1] + '-gz"' in tags
+        ifModifiedSince = self.headers.get("If-Modified-Since")
+        if ifModifiedSince:
+            try:
+                return int(sf.mtime) <= email.utils.parsedate_to_datetime(ifModifiedSince).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_file_headers(self, sf, name, ctype, lastModified, compressible):
+        self.send_header("Content-Type", ctype)
+        self.send_header("Last-Modified", lastModified)
+        self.send_header("Cache-Control", serve_cache_control(name))
+        self.send_header("Accept-Ranges", "bytes")
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
+            # The gzipped copy is a different representation, another tag
+            if "gzip" in self.headers.get("Accept-Encoding", "") and not self.headers.get("Range"):
+                self.send_header("ETag", sf.etag[:-1] + '-gz"')
+                return
+        self.send_header("ETag", sf.etag)
+
+    def _send_listing(self, site, body):
+        links = "".join("<li><a href='{0}'>{0}</a></li>".format(name)
+            for name in site.names() if name.endswith(".html"))
+        self._send_status(200, body, "<!DOCTYPE html><html><head><title>Pynav</title></head><body><ul>{0}</ul></body></html>".format(links))
+
+    def _send_status(self, code, body, text=None):
+        data = (text or "{0} {1}".format(code, self.responses[code][0])).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+class PreviewServer(http.server.ThreadingHTTPServer):
+    """Local http server of a build folder or zip, see get_site()."""
+
+    daemon_threads = True
+
+    def __init__(self, path, host="127.0.0.1", port=SERVE_PORT, verbose=False):
+        self.site = get_site(path)
+        self.verbose = verbose
+        http.server.ThreadingHTTPServer.__init__(self, (host, port), PreviewHandler)
+
+    def server_close(self):
+        http.server.ThreadingHTTPServer.server_close(self)
+        self.site.close()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{0}:{1}/".format(host, port)
+
+def serve_in_background(path, host="127.0.0.1", port=SERVE_PORT, verbose=False):
+    """Starts a PreviewServer of path in a daemon thread and returns it, shutdown() stops it."""
+    server = PreviewServer(path, host, port, verbose)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print("Serving {0} at {1}".format(path, server.url), end="\n")
+    return server
+
+def serve(path, host="127.0.0.1", port=SERVE_PORT, verbose=False):
+    """Serves a build folder or zip until Ctrl+C."""
+    server = PreviewServer(path, host, port, verbose)
+    print("Serving {0} at {1}".format(path, server.url), end="\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped serving {0}".format(path), end="\n")
+    finally:
+        server.server_close()
+
+def _tcp_worker(host, port, backend, stop):
+    """Runs the jobs of a TcpJobQueue, connecting again when the coordinator goes away."""
+    while not stop.is_set():
+        try:
+            sock = socket.create_connection((host, port))
+        except (IOError, OSError):
+            stop.wait(WORKER_RETRY_INTERVAL)
+            continue
+        try:
+            stream = sock.makefile("rwb")
+            for line in stream:
+                job = json.loads(line.decode("utf-8"))
+                # Blank lines while the job runs, the coordinator takes it as lost otherwise
+                running = threading.Event()
+                def heartbeat():
+                    while not running.wait(JOB_LEASE / 4.0):
+                        try:
+                            stream.write(b"\n")
+                            stream.flush()
+                        except (IOError, OSError):
+                            return
+                thread = threading.Thread(target=heartbeat)
+                thread.daemon = True
+                thread.start()
+                try:
+                    result = run_job(backend, job)
+                finally:
+                    running.set()
+                    thread.join()
+                stream.write(json.dumps(result).encode("utf-8") + b"\n")
+                stream.flush()
+        except (IOError, OSError):
+            pass
+        finally:
+            sock.close()
+        # Build finished, wait for the next one
+        stop.wait(WORKER_RETRY_INTERVAL)
+
+def _dir_worker(path, backend, stop):
+    """Runs the jobs of a DirJobQueue folder."""
+    todo = os.path.join(path, "todo")
+    while not stop.is_set():
+        claimed = None
+        try:
+            names = sorted(name for name in os.listdir(todo) if name.endswith(".json"))
+        except OSError:
+            names = []
+        for name in names:
+            doing = os.path.join(path, "doing", name)
+            try:
+                os.rename(os.path.join(todo, name), doing)
+                os.utime(doing, None)
+            except OSError:
+                # Taken by another worker
+                continue
+            claimed = name
+            break
+        if claimed is None:
+            stop.wait(QUEUE_POLL_INTERVAL)
+            continue
+
+        # Touch the job while it runs, the coordinator takes it as lost otherwise
+        running = threading.Event()
+        def heartbeat():
+            while not running.wait(JOB_LEASE / 4.0):
+                try:
+                    os.utime(doing, None)
+                except OSError:
+                    return
+        thread = threading.Thread(target=heartbeat)
+        thread.daemon = True
+        thread.start()
+        try:
+            with open(doing) as f:
+                job = json.load(f)
+            result = run_job(backend, job)
+            _write_json(os.path.join(path, "done", claimed), result)
+        except (IOError, OSError, ValueError):
+            pass
+        finally:
+            running.set()
+            try:
+                os.remove(doing)
+            except OSError:
+                pass
+
+def worker(address, backend, jobs=1):
+    """Takes jobs from the coordinator at address with jobs threads until Ctrl+C, see get_job_queue()."""
+    kind = parse_queue_address(address)
+    stop = threading.Event()
+    threads = []
+    for n in range(jobs):
+        if kind[0] == "tcp":
+            thread = threading.Thread(target=_tcp_worker, args=(kind[1] or "127.0.0.1", kind[2], backend, stop))
+        else:
+            thread = threading.Thread(target=_dir_worker, args=(kind[1], backend, stop))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    print("Worker of {0} with {1} jobs ({2} backend)".format(address, jobs, backend.name), end="\n")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(WORKER_RETRY_INTERVAL)
+    except KeyboardInterrupt:
+        print("\nStopped worker of {0}".format(address), end="\n")
+    finally:
+        stop.set()
+        backend.close()
+
+def worker_main(argv):
+    """Parses the command line of pynav worker and runs the worker."""
+    PARSER = argparse.ArgumentParser( prog="pynav worker", description="Converts the jobs of a pynav --distributed build", formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=60) )
+    PARSER.add_argument( "address", metavar="Address", type=str, help="host:port of the coordinator or the shared queue folder" )
+    PARSER.add_argument( "--jobs", "-j", nargs=1, dest="jobs", default=[os.cpu_count() or 1], type=int, help="Number of parallel conversions [CPU count]" )
+    PARSER.add_argument( "--backend", "-b", nargs=1, dest="backend", default=[userSettings["convert_backend"]], choices=CONVERT_BACKENDS, type=str, help="Conversion backend [external|batch|python]" )
+    args = PARSER.parse_args(argv)
+    try:
+        backend = get_backend(args.backend[0], userSettings["convert_app"], args.jobs[0])
+    except ValueError as e:
+        errprint(e)
+        sys.exit()
+    worker(args.address, backend, max(1, args.jobs[0]))
+
+def serve_main(argv):
+    """Parses the command line of pynav serve and serves."""
+    PARSER = argparse.ArgumentParser( prog="pynav serve", description="Serves a pynav destination folder or zip over http", formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=60) )
+    PARSER.add_argument( "path", metavar="Path", type=str, help="Destination folder or zip file of a build" )
+    PARSER.add_argument( "--port", "-port", nargs=1, dest="port", default=[SERVE_PORT], type=int, help="Port [{0}]".format(SERVE_PORT) )
+    PARSER.add_argument( "--host", "-host", nargs=1, dest="host", default=["127.0.0.1"], type=str, help="Address to listen on [127.0.0.1]" )
+    PARSER.add_argument( "--verbose", "-v", dest="verbose", action="store_true", help="Log every request" )
+    args = PARSER.parse_args(argv)
+    try:
+        serve(os.path.abspath(args.path), args.host[0], args.port[0], args.verbose)
+    except (PynavError, OSError) as e:
+        errprint(e)
+        sys.exit()
+
+
+# Html templates, built in ones. default_sheets() returns the ones of pynav-conf
+
+desktopSheet ="\
+\n<!DOCTYPE html>\
+\n<html>\
+\n    <head>\
+\n    <title>[pynav-title]</title>\
+\n    <style>\
+\n        /* Pynav default style */\
+\n        * { padding: 0; margin: 0; }\
+\n        div { margin: 0 auto; background: url('[pynav-img]') top center no-repeat; height: [pynav-img-height]px; width: [pynav-img-width]px; }\
+\n        div { background-image: image-set([pynav-img-image-set]); }\
+\n        [pynav-css]\
+\n    </style>\
+\n    </head>\
+\n    <body>\
+\n        <a href='[pynav-next-html]'><div></div></a>\
+\n    </body>\
+\n</html>"
+
+mobileSheet = "\
+\n<!DOCTYPE html>\
+\n<html>\
+\n    <head>\
+\n    <title>[pynav-title]</title>\
+\n    <style>\
+\n        /* Pynav default style */\
+\n        * { padding: 0; margin: 0; }\
+\n        img { width: 100%; height: auto; display: block;}\
+\n        [pynav-css]\
+\n    </style>\
+\n    </head>\
+\n    <body>\
+\n        <a href='[pynav-next-html]'>\
+\n            <picture>[pynav-img-sources]<img src='[pynav-img]' srcset='[pynav-img-srcset]'></picture>\
+\n            <picture>[pynav-img-sources]<img src='[pynav-img-slice-1]' srcset='[pynav-img-srcset]'></picture>\
+\n            <picture>[pynav-img-sources]<img src='[pynav-img-slice-2]' srcset='[pynav-img-srcset]'></picture>\
+\n            <picture>[pynav-img-sources]<img src='[pynav-img-slice-3]' srcset='[pynav-img-srcset]'></picture>\
+\n            <picture>[pynav-img-sources]<img src='[pynav-img-slice-4]' srcset='[pynav-img-srcset]'></picture>\
+\n            <picture>[pynav-img-sources]<img src='[pynav-img-slice-5]' srcset='[pynav-img-srcset]'></picture>\
+\n        </a>\
+\n    </body>\
+\n</html>"
+
+indexSheet = "<!--\
+\n\
+\n    Pynav 2014\
+\n    Francis Vega\
+\n\
+\n    hisco@inartx.com\
+\n-->\
+\n\
+\n<!DOCTYPE html>\
+\n<html>\
+\n    <head>\
+\n    <title>Index of [pynav-title]</title>\
+\n    <style>\
+\n        * { font-family: Arial; border: 0; margin: 0; padding: 0; }\
+\n        a { color: black; text-decoration: none; }\
+\n        a:visited { color: inherit; }\
+\n        a:hover { color: black; font-weight: bold; }\
+\n        h1 { margin: 20px 0 0 20px; }\
+\n        li { line-height: 1.6; }\
+\n        ul { list-style: none; margin: 20px 0 0 20px; }\
+\n        [pynav-css]\
+\n    </style>\
+\n    </head>\
+\n    <body>\
+\n    <h1>Index of [pynav-title]</h1>\
+\n    <ul>\
+\n        [pynav-page-link]\
+\n    </ul>\
+\n    </body>\
+\n</html>"
+
+viewerSheet = "\
+\n<!DOCTYPE html>\
+\n<html>\
+\n    <head>\
+\n    <meta charset='utf-8'>\
+\n    <meta name='viewport' content='width=device-width, initial-scale=1'>\
+\n    <title>[pynav-title]</title>\
+\n    <style>\
+\n        /* Pynav viewer default style */\
+\n        * {\
+\n            padding:0;\
+\n            margin:0;\
+\n        }\
+\n        img {\
+\n            display:block;\
+\n            margin:0 auto;\
+\n        }\
+\n        .pynav-mobile img {\
+\n            width:100%;\
+\n            height:auto;\
+\n        }\
+\n        [pynav-css]\
+\n    </style>\
+\n    </head>\
+\n    <body>\
+\n        <a id='pynav-page' href='[pynav-first-html]'></a>\
+\n        <noscript><a href='[pynav-first-html]'>[pynav-title]</a></noscript>\
+\n        <script id='pynav-pages' type='application/json'>[pynav-pages-json]</script>\
+\n        <script>\
+\n        (function () {\
+\n            var data = JSON.parse(document.getElementById('pynav-pages').textContent);\
+\n            var pages = data.pages;\
+\n            var link = document.getElementById('pynav-page');\
+\n            var built = {};\
+\n            var current = -1;\
+\n\
+\n            if (data.mobile) {\
+\n                document.body.className = 'pynav-mobile';\
+\n            }\
+\n\
+\n            // The slices of page n, the first one loads at once and the rest when scrolled near\
+\n            function build(n) {\
+\n                if (built[n]) {\
+\n                    return built[n];\
+\n                }\
+\n                var holder = document.createElement('div');\
+\n                var eager = true;\
+\n                pages[n].slices.forEach(function (slice) {\
+\n                    if (slice.color) {\
+\n                        // Flat band, a block of color\
+\n                        var band = document.createElement('div');\
+\n                        band.style.background = slice.color;\
+\n                        band.style.aspectRatio = slice.width + ' / ' + slice.height;\
+\n                        holder.appendChild(band);\
+\n                        return;\
+\n                    }\
+\n                    var img = document.createElement('img');\
+\n                    img.width = slice.width;\
+\n                    img.height = slice.height;\
+\n                    if (!eager) {\
+\n                        img.loading = 'lazy';\
+\n                    }\
+\n                    eager = false;\
+\n                    if (slice.srcset) {\
+\n                        img.srcset = slice.srcset;\
+\n                    }\
+\n                    img.src = slice.src;\
+\n                    if (slice.webp) {\
+\n                        var picture = document.createElement('picture');\
+\n                        var source = document.createElement('source');\
+\n                        source.type = 'image/webp';\
+\n                        source.srcset = slice.webp;\
+\n                        picture.appendChild(source);\
+\n                        picture.appendChild(img);\
+\n                        img = picture;\
+\n                    }\
+\n                    holder.appendChild(img);\
+\n                });\
+\n                built[n] = holder;\
+\n                return holder;\
+\n            }\
+\n\
+\n            function show(n) {\
+\n                n = (n + pages.length) % pages.length;\
+\n                if (n === current) {\
+\n                    return;\
+\n                }\
+\n                current = n;\
+\n                link.replaceChildren(build(n));\
+\n                link.href = pages[(n + 1) % pages.length].html || '#' + ((n + 1) % pages.length + 1);\
+\n                document.title = data.title + ' - ' + pages[n].name;\
+\n                window.scrollTo(0, 0);\
+\n\
+\n                // Prefetch the next and previous pages, drop the others\
+\n                var keep = {};\
+\n                [n - 1, n, n + 1].forEach(function (m) {\
+\n                    m = (m + pages.length) % pages.length;\
+\n                    keep[m] = build(m);\
+\n                });\
+\n                built = keep;\
+\n            }\
+\n\
+\n            function go(n) {\
+\n                n = (n + pages.length) % pages.length;\
+\n                history.pushState(null, '', '#' + (n + 1));\
+\n                show(n);\
+\n            }\
+\n\
+\n            function fromHash() {\
+\n                var n = parseInt(location.hash.slice(1), 10);\
+\n                return n > 0 && n <= pages.length ? n - 1 : 0;\
+\n            }\
+\n\
+\n            link.addEventListener('click', function (e) {\
+\n                if (e.button === 0 && !e.ctrlKey && !e.metaKey && !e.shiftKey) {\
+\n                    e.preventDefault();\
+\n                    go(current + 1);\
+\n                }\
+\n            });\
+\n            document.addEventListener('keydown', function (e) {\
+\n                if (e.key === 'ArrowRight') {\
+\n                    go(current + 1);\
+\n                } else if (e.key === 'ArrowLeft') {\
+\n                    go(current - 1);\
+\n                }\
+\n            });\
+\n            window.addEventListener('popstate', function () {\
+\n                show(fromHash());\
+\n            });\
+\n            show(fromHash());\
+\n        })();\
+\n        </script>\
+\n    </body>\
+\n</html>"
+
+tilesSheet = "\
+\n<!DOCTYPE html>\
+\n<html>\
+\n    <head>\
+\n    <meta charset='utf-8'>\
+\n    <meta name='viewport' content='width=device-width, initial-scale=1'>\
+\n    <title>[pynav-title]</title>\
+\n    <style>\
+\n        /* Pynav tiles default style */\
+\n        * {\
+\n            padding:0;\
+\n            margin:0;\
+\n        }\
+\n        #pynav-board {\
+\n            position:relative;\
+\n            margin:0 auto;\
+\n            overflow:hidden;\
+\n        }\
+\n        #pynav-board img {\
+\n            position:absolute;\
+\n            left:0;\
+\n            top:0;\
+\n            display:block;\
+\n        }\
+\n        [pynav-css]\
+\n    </style>\
+\n    </head>\
+\n    <body>\
+\n        <a href='[pynav-next-html]'><div id='pynav-board'><img id='pynav-placeholder' src='[pynav-img]' alt=''></div></a>\
+\n        <script id='pynav-tiles' type='application/json'>[pynav-tiles-json]</script>\
+\n        <script>\
+\n        (function () {\
+\n            var tiles = JSON.parse(document.getElementById('pynav-tiles').textContent);\
+\n            var board = document.getElementById('pynav-board');\
+\n            var placeholder = document.getElementById('pynav-placeholder');\
+\n            var last = tiles.levels - 1;\
+\n            var shown = {};\
+\n            var level = -1;\
+\n            var shownScale = 0;\
+\n            // 0 fits the window width (never over 1:1), else the scale set with + and -\
+\n            var zoom = 0;\
+\n            var pending = false;\
+\n\
+\n            function fit() {\
+\n                return Math.min(1, document.documentElement.clientWidth / tiles.width);\
+\n            }\
+\n\
+\n            function scale() {\
+\n                return zoom || fit();\
+\n            }\
+\n\
+\n            // Size of level n, every level is the next one halved and rounded up\
+\n            function levelSize(n) {\
+\n                var f = Math.pow(2, last - n);\
+\n                return [Math.ceil(tiles.width / f), Math.ceil(tiles.height / f)];\
+\n            }\
+\n\
+\n            // Only the tiles of the viewport (and a tile around) are in the page, over the placeholder\
+\n            function update() {\
+\n                pending = false;\
+\n                var s = scale();\
+\n                var width = Math.round(tiles.width * s);\
+\n                var height = Math.round(tiles.height * s);\
+\n                board.style.width = placeholder.style.width = width + 'px';\
+\n                board.style.height = placeholder.style.height = height + 'px';\
+\n\
+\n                // The smallest level with a pixel per screen pixel\
+\n                var n = Math.max(0, Math.min(last, Math.ceil(last + Math.log(s * (window.devicePixelRatio || 1)) / Math.LN2 - 1e-9)));\
+\n                if (n !== level || s !== shownScale) {\
+\n                    Object.keys(shown).forEach(function (key) {\
+\n                        board.removeChild(shown[key]);\
+\n                    });\
+\n                    shown = {};\
+\n                    level = n;\
+\n                    shownScale = s;\
+\n                }\
+\n                var size = levelSize(n);\
+\n                var f = width / size[0];\
+\n                var step = tiles.size * f;\
+\n                var box = board.getBoundingClientRect();\
+\n                var left = Math.max(0, -box.left - step);\
+\n                var top = Math.max(0, -box.top - step);\
+\n                var right = Math.min(width, window.innerWidth - box.left + step);\
+\n                var bottom = Math.min(height, window.innerHeight - box.top + step);\
+\n                var wanted = {};\
+\n                for (var row = Math.floor(top / step); row * step < bottom && row * tiles.size < size[1]; row++) {\
+\n                    for (var column = Math.floor(left / step); column * step < right && column * tiles.size < size[0]; column++) {\
+\n                        var key = column + '_' + row;\
+\n                        wanted[key] = true;\
+\n                        if (shown[key]) {\
+\n                            continue;\
+\n                        }\
+\n                        var img = document.createElement('img');\
+\n                        var x = Math.round(column * step);\
+\n                        var y = Math.round(row * step);\
+\n                        img.alt = '';\
+\n                        img.style.left = x + 'px';\
+\n                        img.style.top = y + 'px';\
+\n                        img.style.width = Math.round(Math.min(size[0], (column + 1) * tiles.size) * f) - x + 'px';\
+\n                        img.style.height = Math.round(Math.min(size[1], (row + 1) * tiles.size) * f) - y + 'px';\
+\n                        img.src = tiles.folder + '/' + n + '/' + key + '.' + tiles.format;\
+\n                        board.appendChild(img);\
+\n                        shown[key] = img;\
+\n                    }\
+\n                }\
+\n                Object.keys(shown).forEach(function (key) {\
+\n                    if (!wanted[key]) {\
+\n                        board.removeChild(shown[key]);\
+\n                        delete shown[key];\
+\n                    }\
+\n                });\
+\n            }\
+\n\
+\n            function schedule() {\
+\n                if (!pending) {\
+\n                    pending = true;\
+\n                    window.requestAnimationFrame(update);\
+\n                }\
+\n            }\
+\n\
+\n            // + and - zoom by two around the middle of the window, 0 fits the width again\
+\n            function zoomTo(next) {\
+\n                var s = scale();\
+\n                var box = board.getBoundingClientRect();\
+\n                var x = (window.innerWidth / 2 - box.left) / s;\
+\n                var y = (window.innerHeight / 2 - box.top) / s;\
+\n                zoom = next;\
+\n                update();\
+\n                s = scale();\
+\n                box = board.getBoundingClientRect();\
+\n                window.scrollBy(box.left + x * s - window.innerWidth / 2, box.top + y * s - window.innerHeight / 2);\
+\n            }\
+\n\
+\n            document.addEventListener('keydown', function (e) {\
+\n                var smallest = Math.min(fit(), window.innerHeight / tiles.height);\
+\n                if (e.key === '+') {\
+\n                    zoomTo(Math.min(2, scale() * 2));\
+\n                } else if (e.key === '-') {\
+\n                    zoomTo(Math.max(smallest, scale() / 2));\
+\n                } else if (e.key === '0') {\
+\n                    zoomTo(0);\
+\n                }\
+\n            });\
+\n            window.addEventListener('scroll', schedule, {passive: true});\
+\n            window.addEventListener('resize', schedule);\
+\n            update();\
+\n        })();\
+\n        </script>\
+\n    </body>\
+\n</html>"
+
+# Pynav internal defatul settings
+userSettings = {
+        "convert_app": "C:/Program Files/Adobe/Adobe Photoshop CC (64 Bit)/convert.exe",
+        "default_title": "Pynav",
+        "default_inputFormat": "psd",
+        "default_outputFormat": "jpg",
+        "default_outputDirName": "Pynav_",
+        "default_quality": [100],
+        "default_sliceSize": [1034],
+        "convert_backend": "external"
+}
+
+_default_sheets = {}
+
+def default_sheets():
+    """Returns the desktop, mobile, index, viewer and tiles templates of pynav-conf, the built in ones if missing.
+
+    Read once, on first use.
+    """
+    if not _default_sheets:
+        _default_sheets["desktop"] = load_html_template(DESKTOP_HTML_SHEET) or desktopSheet
+        _default_sheets["mobile"] = load_html_template(MOBILE_HTML_SHEET) or mobileSheet
+        _default_sheets["index"] = load_html_template(INDEX_HTML_SHEET, "[pynav-page-link]") or indexSheet
+        _default_sheets["viewer"] = load_html_template(VIEWER_HTML_SHEET, "[pynav-pages-json]") or viewerSheet
+        _default_sheets["tiles"] = load_html_template(TILES_HTML_SHEET, "[pynav-tiles-json]") or tilesSheet
+    return _default_sheets
+
+def main():
+    """Parses the command line and runs pynav."""
+
+    # pynav serve folder|zip
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_main(sys.argv[2:])
+        return
+
+    # Load settings from pynav.conf
+    load_settings(userSettings)
+
+    # Checks if the convert app path is correct
+    # to do: En vez de mirar directamente el path, mirar que este en el sistema
+    # por ejemplo en la variable de entorno PATH
+    if not os.path.isfile(userSettings["convert_app"]):
+        errprint("No se encuentra el archivo {0}".format(userSettings["convert_app"]))
+        # Use imagemagick installed on osx / linux
+        if os.name == "posix":
+            userSettings["convert_app"] = "convert"
+        # sys.exit()
+
+    # pynav worker host:port|folder
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker_main(sys.argv[2:])
+        return
+
+    # ARGSPARSER
+    PARSER = argparse.ArgumentParser( prog="pynav", description="Creates html navigations from image files", epilog="Example of use: pynav.py --title \"Previz\" --mobile /project/psd", formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=60) )
+    PARSER.add_argument( "sourcePath", metavar="Source", type=str, nargs="?", help="Source Path of Images" )
+    PARSER.add_argument( "destinationPath", metavar="Destination", type=str, nargs="?", help="Destination Path of Mokcup" )
+    PARSER.add_argument( "--in-format", "-if", nargs=1, dest="inFormat", default=userSettings["default_inputFormat"], type=str, help="Source file format" )
+    PARSER.add_argument( "--out-format", "-of", nargs=1, dest="outFormat", default=userSettings["default_outputFormat"], type=str, help="Output file format" )
+    PARSER.add_argument( "--title", "-t", nargs=1, dest="title", default=userSettings["default_title"], type=str, help="Set presentation title" )
+    PARSER.add_argument( "--file-name", "-fn", nargs=1, dest="filename", type=str, help="Set custon names to out images" )
+    PARSER.add_argument( "--quality", "-q", nargs=1, dest="quality", default=userSettings["default_quality"], type=int, help="Set jpg quality [1-100]" )
+    PARSER.add_argument( "--overwrite", "-ow", dest="overwrite", action="store_true", help="Overwrite output files" )
+    PARSER.add_argument( "--verbose", "-v", dest="verbose", action="store_true", help="Verbose mode" )
+    PARSER.add_argument( "--full-path", "-fp", dest="fullpath", action="store_true", help="Show full path of files" )
+    PARSER.add_argument( "--index-of-pages", "-index", dest="index", action="store_true", help="Create a index of pages" )
+    PARSER.add_argument( "--only-image", "-image", dest="onlyimage", action="store_true", help="Create just image files" )
+    PARSER.add_argument( "--mobile", "-m", dest="mobile", action="store_true", help="Mobile markup")
+    PARSER.add_argument( "--slice", "-slc", nargs=1, dest="slice", default=userSettings["default_sliceSize"], type=int, help="Set height slice for mobile" )
+    PARSER.add_argument( "--single-pass", "-sp", dest="singlepass", action="store_true", help="Decode each image once and write all its slices" )
+    PARSER.add_argument( "--incremental", "-inc", dest="incremental", action="store_true", help="Reuse the destination and rebuild only the changed pages" )
+    PARSER.add_argument( "--resume", "-resume", dest="resume", action="store_true", help="Go on with the build interrupted in the destination, keeping the pages it converted" )
+    PARSER.add_argument( "--timeout", "-to", nargs=1, dest="timeout", type=float, metavar="SECONDS", help="Stop a conversion that takes longer, as failed" )
+    PARSER.add_argument( "--retries", "-rt", nargs=1, dest="retries", type=int, help="Convert a failed page again up to this many times, waiting longer every time" )
+    PARSER.add_argument( "--css-style", "-style", nargs=1, dest="css", default="", type=str, help="Add css style to all html files")
+    PARSER.add_argument( "--zip", "-z", dest="zip", action="store_true", help="Create a zip file with results files" )
+    PARSER.add_argument( "--flush", "-f", dest="flush", action="store_true", help="Delete all the content in the destination folder" )
+    PARSER.add_argument( "--jobs", "-j", nargs=1, dest="jobs", default=[os.cpu_count() or 1], type=int, help="Number of parallel conversions [CPU count]" )
+    PARSER.add_argument( "--backend", "-b", nargs=1, dest="backend", default=[userSettings["convert_backend"]], choices=CONVERT_BACKENDS, type=str, help="Conversion backend [external|batch|python]" )
+    PARSER.add_argument( "--watch", "-w", dest="watch", action="store_true", help="Rebuild the changed pages every time a source is saved" )
+    PARSER.add_argument( "--trace", "-tr", nargs=1, dest="trace", type=str, help="Write the timing of every build stage to a trace file (.json or .jsonl)" )
+    PARSER.add_argument( "--profile", "-prof", dest="profile", action="store_true", help="Print the time of each stage and the slowest sources" )
+    PARSER.add_argument( "--widths", "-wd", nargs="+", dest="widths", type=int, help="Also write every slice at these narrower widths (srcset)" )
+    PARSER.add_argument( "--webp", "-webp", dest="webp", action="store_true", help="Also write a webp copy of every image" )
+    PARSER.add_argument( "--dedupe", "-dd", dest="dedupe", action="store_true", help="Name images after their content, identical slices are stored once" )
+    PARSER.add_argument( "--viewer", "-viewer", dest="viewer", action="store_true", help="Also create a viewer page that navigates every page without reloads" )
+    PARSER.add_argument( "--recursive", "-r", dest="recursive", action="store_true", help="Also take the sources of the subfolders, a section of the index each" )
+    PARSER.add_argument( "--include", "-in", nargs="+", dest="include", type=str, help="Only the sources matching these glob patterns (name or relative path)" )
+    PARSER.add_argument( "--exclude", "-ex", nargs="+", dest="exclude", type=str, help="Skip the sources and subfolders matching these glob patterns" )
+    PARSER.add_argument( "--content-slices", "-cs", dest="contentslices", action="store_true", help="Cut the mobile slices in blank rows and write flat bands as css blocks (needs Pillow)" )
+    PARSER.add_argument( "--slice-kb", "-skb", nargs=1, dest="slicekb", type=int, help="Search the quality of every slice to fit in KiB (python backend)" )
+    PARSER.add_argument( "--page-kb", "-pkb", nargs=1, dest="pagekb", type=int, help="Search the quality of every slice for the page to fit in KiB (python backend)" )
+    PARSER.add_argument( "--min-psnr", "-psnr", nargs=1, dest="minpsnr", type=float, help="Lowest PSNR (dB) of the searched quality, over the size if needed" )
+    PARSER.add_argument( "--min-ssim", "-ssim", nargs=1, dest="minssim", type=float, help="Lowest SSIM (0-1) of the searched quality, over the size if needed (needs numpy)" )
+    PARSER.add_argument( "--distributed", "-dist", nargs=1, dest="distributed", type=str, metavar="ADDRESS", help="Queue the conversions for pynav worker processes at host:port or a shared folder" )
+    PARSER.add_argument( "--serve", "-serve", nargs="?", const=SERVE_PORT, dest="serve", type=int, metavar="PORT", help="Serve the destination over http after the build (or while --watch)" )
+    PARSER.add_argument( "--cache", "-cache", nargs="?", const=CACHE_DIR, dest="cache", type=str, metavar="FOLDER", help="Reuse the images converted by any build of this machine (default ~/.cache/pynav)" )
+    PARSER.add_argument( "--draft", "-draft", dest="draft", action="store_true", help="Quick review build from the composite (or thumbnail) saved in the psd, no ImageMagick (needs Pillow)" )
+    PARSER.add_argument( "--tiles", "-tiles", nargs="?", const=TILE_SIZE, dest="tiles", type=int, metavar="SIZE", help="Deep zoom tile pyramid per page, shown a viewport at a time (default {0}px tiles, needs Pillow)".format(TILE_SIZE) )
+    PARSER.add_argument( "--cache-size", "-csize", nargs=1, dest="cachesize", type=int, help="MiB the --cache may take, least recently used pages go first (default {0})".format(CACHE_SIZE) )
+    PARSER.add_argument( "--memory-budget", "-mem", nargs=1, dest="memory", type=int, help="MiB of estimated convert memory in use at once (largest pages wait)" )
+    PARSER.add_argument( "--batch", "-batch", nargs=1, dest="batch", type=str, help="Build the projects of a json batch file in one shared worker pool" )
+    PARSER.add_argument( "--project", "-p", nargs=2, dest="projects", action="append", metavar=("SOURCE", "DESTINATION"), help="Add a project to the batch (repeatable)" )
+    PARSER.add_argument( "--html-template", "-html", nargs=1, dest="html", default="", type=str, help="Use a custom html file")
+    # PARSER.add_argument( "--log-file", "-l", dest="logfile", action="store_true", help="Create a log file" )
+    # PARSER.add_argument( "--list-html-tags", "-tags", nargs=1, dest="html", default="", type=str, help="Show a list of pynav html tags")
+
+    # Parse arguments
+    DEBUG = False
+    if DEBUG:
+        # DEBUG
+        pynav_args = ["--verbose", "--zip", "--flush", "-q", "1", "-ow", "-index", "E:\Dropbox\github\pynav\psd-project"]
+        args = PARSER.parse_args(pynav_args)
+    else:
+        args = PARSER.parse_args()
+
+    # --batch and --project, many projects built in one shared worker pool
+    projects = []
+    if args.batch:
+        try:
+            projects += load_batch_file(args.batch[0])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            errprint("El archivo de proyectos {0} no existe o no tiene un formato adecuado ({1})".format(args.batch[0], e))
+            sys.exit()
+    for source, destination in args.projects or []:
+        projects.append({"sourcePath": os.path.abspath(source), "destinationPath": os.path.abspath(destination)})
+    if args.sourcePath is None and not projects:
+        PARSER.error("the Source path is required")
+
+    # Pynav internal settings
+    settings = {
+        "convert_app": userSettings["convert_app"],
+        "customDestPath":False,
+        "onlyimage": False,
+        "date": time.strftime("%Y_%m_%d"),
+        "sourcePath": os.path.abspath(args.sourcePath) if args.sourcePath else None,
+        "destinationPath": args.destinationPath,
+        "pynavDirName": "{0}{1}".format(userSettings["default_outputDirName"], time.strftime("%Y-%m-%d"))
+    }
+
+    if settings["sourcePath"] is not None and projects:
+        projects.insert(0, {"sourcePath": settings["sourcePath"], "destinationPath": settings["destinationPath"]})
+
+    # Batch projects without destination go to source/Pynav_date
+    for project in projects:
+        if not project.get("destinationPath"):
+            project["destinationPath"] = "{0}/{1}".format(project["sourcePath"], settings["pynavDirName"])
+        project["destinationPath"] = os.path.abspath(project["destinationPath"])
+
+    if not projects:
+        # Source Path (the only mandatory param)
+        # Checks if the sourcePath exists (and is a directory) if not, Pynav stops
+        if os.path.isdir(settings["sourcePath"]) == False:
+            print("El path origen {0} no existe o no es un directorio".format(settings["sourcePath"], end="\n"))
+            sys.exit()
+
+        # Destination Path (optional)
+        # If destination path parameter doesnt exists pynav will create a custom directory
+        if settings["destinationPath"] == None:
+            settings["destinationPath"] = "{0}/{1}".format(settings["sourcePath"], settings["pynavDirName"])
+        # If destination param exists, then pynav will use it to create the directory
+        else:
+            settings["destinationPath"] = "".join(settings["destinationPath"])
+            settings["customDestPath"] = True
+
+        # If sourcePath and destPath are the same, pynav yield a warning, just for information.
+        if settings["sourcePath"] == settings["destinationPath"]:
+            print("El directorio Origen y Destino son el mismo\nConitunamos de todas formas? [y][n]", end="\n")
+            while True:
+                answer = raw_input()
+                if answer[0].upper() == "Y":
+                    break
+                if answer[0].upper() == "N":
+                    sys.exit()
+
+    # Grab the Argparse arguments into settnigs dic
+    settings["quality"] = args.quality[0]
+    settings["inputFormat"] = "".join(args.inFormat)
+    settings["outputFormat"] = "".join(args.outFormat)
+    settings["mobile"] = args.mobile
+    settings["title"] = "".join(args.title)
+    settings["overwrite"] = args.overwrite
+    settings["verbose"] = args.verbose
+    settings["fullPath"] = args.fullpath
+    settings["index"] = args.index
+    settings["zip"] = args.zip
+    settings["onlyimage"] = args.onlyimage
+    settings["flush"] = args.flush
+    settings["sliceSize"] = args.slice[0]
+    settings["css"] = "".join(args.css)
+    settings["html"] = "".join(args.html)
+    settings["jobs"] = args.jobs[0]
+    settings["backend"] = args.backend[0]
+    settings["watch"] = args.watch
+    settings["singlePass"] = args.singlepass
+    settings["incremental"] = args.incremental
+    settings["resume"] = args.resume
+    settings["timeout"] = args.timeout[0] if args.timeout else None
+    settings["retries"] = args.retries[0] if args.retries else 0
+    settings["trace"] = args.trace[0] if args.trace else None
+    settings["profile"] = args.profile
+    settings["widths"] = args.widths
+    settings["webp"] = args.webp
+    settings["viewer"] = args.viewer
+    settings["dedupe"] = args.dedupe
+    settings["memoryBudget"] = args.memory[0] if args.memory else None
+    settings["cache"] = os.path.abspath(args.cache) if args.cache else None
+    settings["cacheSize"] = args.cachesize[0] if args.cachesize else None
+    settings["draft"] = args.draft
+    settings["tiles"] = args.tiles
+    settings["serve"] = args.serve
+    settings["distributed"] = args.distributed[0] if args.distributed else None
+    settings["contentSlices"] = args.contentslices
+    settings["sliceBytes"] = args.slicekb[0] if args.slicekb else None
+    settings["pageBytes"] = args.pagekb[0] if args.pagekb else None
+    settings["minPsnr"] = args.minpsnr[0] if args.minpsnr else None
+    settings["minSsim"] = args.minssim[0] if args.minssim else None
+    settings["recursive"] = args.recursive
+    settings["include"] = args.include
+    settings["exclude"] = args.exclude
+    # settings["logfile"] = args.logfile
+
+    if args.filename == None:
+        settings["fileName"] = None
+    else:
+        settings["fileName"] = args.filename[0]
+
+    # The python backend needs Pillow
+    try:
+        get_backend(settings["backend"], settings["convert_app"]).close()
+    except ValueError as e:
+        errprint(e)
+        sys.exit()
+    if settings["tiles"] and Image is None:
+        errprint("--tiles necesita Pillow (pip install Pillow)")
+        sys.exit()
+    if settings["draft"] and Image is None:
+        errprint("--draft necesita Pillow (pip install Pillow)")
+        sys.exit()
+    if settings["contentSlices"] and Image is None:
+        errprint("--content-slices necesita Pillow (pip install Pillow)")
+        sys.exit()
+    if (args.slicekb or args.pagekb or args.minpsnr or args.minssim) and settings["backend"] != "python" and not settings["distributed"] and not settings["draft"]:
+        errprint("La búsqueda de calidad necesita el backend python (-b python)")
+        sys.exit()
+
+    # Html template
+    sheets = default_sheets()
+    settings["mobileSheet"] = sheets["mobile"]
+    settings["desktopSheet"] = sheets["desktop"]
+    settings["indexSheet"] = sheets["index"]
+    settings["viewerSheet"] = sheets["viewer"]
+    settings["tilesSheet"] = sheets["tiles"]
+
+    if settings["html"]:
+        settings["html"] = os.path.abspath(settings["html"])
+        if os.path.isfile(settings["html"]):
+            htmlSheet = load_html_template(settings["html"])
+            if htmlSheet:
+                settings["mobileSheet"] = htmlSheet
+                settings["desktopSheet"] = htmlSheet
+            else:
+                errprint("El archivo {0} no tiene un formato de etiquetas adecuado".format(settings["html"]))
+                sys.exit()
+        else:
+            errprint("No existe el archivo html {0}".format(settings["html"]))
+            sys.exit()
+
+    # Go with the flow!!
+    if projects:
+        if settings["watch"] or settings["serve"] is not None:
+            errprint("--watch y --serve no se pueden usar con --batch o --project")
+            sys.exit()
+        pynav_batch([dict(settings, **project) for project in projects], settings["jobs"])
+    elif settings["watch"]:
+        # Every rebuild is served as soon as it is written
+        if settings["serve"] is not None:
+            if not os.path.isdir(settings["destinationPath"]):
+                os.makedirs(settings["destinationPath"])
+            serve_in_background(os.path.abspath(settings["destinationPath"]), port=settings["serve"])
+        watch(settings)
+    else:
+        result = pynav(settings)
+        if settings["serve"] is not None:
+            serve(result.destination, port=settings["serve"])
 
-# Go with the flow!!
-pynav(settings)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
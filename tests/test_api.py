@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""The importable build() API and its BuildResult."""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+from pynav import build, BuildSettings, BuildResult, PynavError
+import synthetic
+
+
+class BuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 3, 32, 250, "png")
+        self.env = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.tmp)
+
+    def settings(self, **overrides):
+        values = dict(sourcePath=self.src, destinationPath=self.dest, convert_app=FAKE_CONVERT, inputFormat="png",
+            mobile=True, sliceSize=100, jobs=2, index=True)
+        values.update(overrides)
+        return BuildSettings(**values)
+
+    def test_result(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            result = build(self.settings(zip=True))
+        # Silent without log and error
+        self.assertEqual(out.getvalue(), "")
+        self.assertIsInstance(result, BuildResult)
+        self.assertEqual(result.destination, self.dest)
+        self.assertEqual(result.converted, 3)
+        self.assertEqual((result.errors, result.failed), ([], []))
+        self.assertFalse(result.interrupted)
+        self.assertGreater(result.elapsed, 0)
+        self.assertEqual(result.index, os.path.join(self.dest, "index.html"))
+        self.assertEqual(result.zip, os.path.join(self.dest, "out.zip"))
+        self.assertTrue(os.path.isfile(result.zip))
+        self.assertIsNone(result.trace)
+        self.assertIn("convert", result.timings)
+        # One per source
+        self.assertEqual(sorted(page["source"] for page in result.pages), ["page_001.png", "page_002.png", "page_003.png"])
+        page = [page for page in result.pages if page["source"] == "page_001.png"][0]
+        self.assertEqual(page["status"], "Converted")
+        self.assertEqual((page["width"], page["height"]), ("32", "250"))
+        self.assertEqual(page["image"], "page_001.jpg")
+        self.assertEqual(page["slices"], ["page_001.jpg", "page_001_slice_1.jpg", "page_001_slice_2.jpg"])
+        self.assertEqual(page["html"], "page_001.html")
+        self.assertEqual([p["next"] for p in result.pages], [p["html"] for p in result.pages[1:] + result.pages[:1]])
+        for name in page["slices"] + [page["html"]]:
+            self.assertTrue(os.path.isfile(os.path.join(self.dest, name)), name)
+
+    def test_settings_dictionary_and_statuses(self):
+        build(self.settings())
+        settings = dict(vars(self.settings(incremental=True)), unknownKey=1)
+        synthetic.write_png(os.path.join(self.src, "page_002.png"), 32, 250, gray=0x20)
+        os.environ["PYNAV_FAKE_CONVERT_FAIL"] = "page_003.png"
+        synthetic.write_png(os.path.join(self.src, "page_003.png"), 32, 250, gray=0x30)
+        result = build(settings)
+        statuses = dict((page["source"], page["status"]) for page in result.pages)
+        # The failed page keeps its last build
+        self.assertEqual(statuses, {"page_001.png": "Skip", "page_002.png": "Converted", "page_003.png": "Failed"})
+        self.assertEqual(result.failed, [os.path.join(self.src, "page_003.png")])
+        self.assertEqual(result.converted, 1)
+
+    def test_log_and_error(self):
+        lines = []
+        errors = []
+        os.environ["PYNAV_FAKE_CONVERT_FAIL"] = "page_002.png"
+        build(self.settings(), log=lambda *args, **kwargs: lines.append(args[0]), error=errors.append)
+        self.assertEqual(len([line for line in lines if "..." in line]), 2)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("page_002.png", errors[0])
+
+    def test_build_that_cannot_run(self):
+        with self.assertRaises(PynavError):
+            build(self.settings(sourcePath=os.path.join(self.tmp, "missing")))
+        with self.assertRaises(PynavError):
+            build(self.settings(inputFormat="gif"))
+
+    def test_inflight_is_not_a_setting(self):
+        self.assertNotIn("inflight", vars(self.settings()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Conversion backends, against benchmarks/fake_convert.py (which fails like convert on an empty image list)."""
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+import subprocess
+import concurrent.futures
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+import fake_convert
+
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+
+
+def image_size(path):
+    """Returns the size of a png written by fake_convert, or of any image with Pillow."""
+    with open(path, "rb") as f:
+        head = f.read(24)
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">LL", head[16:24])
+    with pynav.Image.open(path) as image:
+        return image.size
+
+
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.sources = []
+        for n in range(4):
+            path = os.path.join(self.tmp, "page_{0}.png".format(n))
+            synthetic.write_png(path, 64, 250)
+            self.sources.append(path)
+        self.env = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.tmp)
+
+    def convert(self, name, single_pass=False):
+        """Converts every source with the backend name from 4 workers, returns (slices, error) of each."""
+        backend = pynav.get_backend(name, FAKE_CONVERT, 4)
+        dest = os.path.join(self.tmp, name + ("_sp" if single_pass else ""))
+        os.makedirs(dest)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [executor.submit(pynav.convert_image, backend, "90", "png", "jpg", 100.0, source,
+                    os.path.join(dest, os.path.basename(source)[:-4] + ".jpg"), single_pass) for source in self.sources]
+            results = []
+            for future in futures:
+                try:
+                    results.append(([os.path.join(dest, name) for name in future.result()["slices"]], None))
+                except subprocess.CalledProcessError as e:
+                    results.append((None, e))
+            return results
+        finally:
+            backend.close()
+
+    def test_batch_command_leaves_an_image_to_write(self):
+        job = {"quality": "90", "convertFile": "a.png", "slices": [{"file": "a.jpg", "x": 0, "y": 0, "width": 10, "height": 10}]}
+        for jobs in ([job], [job, dict(job, convertFile="b.png")]):
+            command = pynav.BatchConvertBackend("convert")._command(jobs)
+            self.assertEqual(command[-1], "null:")
+            self.assertGreater(fake_convert.count_images(command[1:]), 0)
+
+    def test_backends_write_every_slice(self):
+        backends = [("external", False), ("external", True), ("batch", False)]
+        if pynav.Image is not None:
+            backends.append(("python", False))
+        for name, single_pass in backends:
+            for slices, error in self.convert(name, single_pass):
+                self.assertIsNone(error, name)
+                self.assertEqual([os.path.basename(path)[6:] for path in slices], [".jpg", "_slice_1.jpg", "_slice_2.jpg"])
+                self.assertEqual([image_size(path) for path in slices], [(64, 100), (64, 100), (64, 50)], name)
+
+    def test_failed_page_of_a_batch(self):
+        # The batch fails, its pages are converted again one by one
+        os.environ["PYNAV_FAKE_CONVERT_FAIL"] = "page_2.png"
+        results = self.convert("batch")
+        self.assertEqual([error is None for slices, error in results], [True, True, False, True])
+        for slices, error in results:
+            for path in slices or []:
+                self.assertTrue(os.path.isfile(path), path)
+
+
+if __name__ == "__main__":
+    unittest.main()
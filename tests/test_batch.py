@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--batch: the shared PriorityExecutor, batch_build() and batch files."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class PriorityExecutorTest(unittest.TestCase):
+
+    def test_lowest_priority_first_then_submit_order(self):
+        executor = pynav.PriorityExecutor(1)
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+        def block():
+            started.set()
+            release.wait(5)
+        try:
+            executor.submit(block)
+            started.wait(5)
+            # Queued while the only worker is busy
+            for name, priority in (("a", 0), ("b", -10), ("c", 0), ("d", -10), ("e", 5)):
+                executor.submit(order.append, name, priority=priority)
+            release.set()
+        finally:
+            executor.shutdown()
+        self.assertEqual(order, ["b", "d", "a", "c", "e"])
+
+    def test_shutdown_cancels_the_queue(self):
+        executor = pynav.PriorityExecutor(1)
+        started = threading.Event()
+        release = threading.Event()
+        def block():
+            started.set()
+            return release.wait(5)
+        running = executor.submit(block)
+        started.wait(5)
+        queued = executor.submit(len, "abc")
+        executor.shutdown(wait=False, cancel_futures=True)
+        release.set()
+        self.assertTrue(running.result(5))
+        self.assertTrue(queued.cancelled())
+        with self.assertRaises(RuntimeError):
+            executor.submit(len, "abc")
+
+    def test_exceptions_go_to_the_future(self):
+        executor = pynav.PriorityExecutor(2)
+        try:
+            with self.assertRaises(ZeroDivisionError):
+                executor.submit(lambda: 1 / 0).result(5)
+        finally:
+            executor.shutdown()
+
+
+class BatchBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.projects = []
+        for n, count in enumerate((3, 2)):
+            source = os.path.join(self.tmp, "project_{0}".format(n))
+            synthetic.make_project(source, count, 40, 300, "png")
+            self.projects.append(pynav.BuildSettings(source, os.path.join(self.tmp, "out_{0}".format(n)),
+                convert_app=FAKE_CONVERT, inputFormat="png", sliceSize=100, index=True))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_projects_share_one_pool(self):
+        missing = {"sourcePath": os.path.join(self.tmp, "missing"), "destinationPath": os.path.join(self.tmp, "out_2"),
+            "convert_app": FAKE_CONVERT, "inputFormat": "png"}
+        lines = []
+        errors = []
+        batch = pynav.batch_build(self.projects + [missing], jobs=3,
+            log=lambda *args, **kwargs: lines.append(args[0]), error=errors.append)
+        self.assertEqual([result.destination for result in batch.results], [p.destinationPath for p in self.projects])
+        self.assertEqual([result.converted for result in batch.results], [3, 2])
+        self.assertEqual(batch.converted, 5)
+        self.assertEqual(batch.pixels, 5 * 40 * 300)
+        pagesPerSecond, megapixelsPerSecond = batch.throughput()
+        self.assertAlmostEqual(pagesPerSecond, 5 / batch.elapsed)
+        # The project that cannot run does not stop the others
+        self.assertEqual([source for source, message in batch.errors], [missing["sourcePath"]])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(lines), 2)
+        for project in self.projects:
+            names = os.listdir(project.destinationPath)
+            self.assertIn("index.html", names)
+            self.assertEqual(len([name for name in names if name.endswith(".jpg")]), 3 * len(os.listdir(project.sourcePath)))
+
+    def test_batch_file(self):
+        fname = os.path.join(self.tmp, "batch.json")
+        with open(fname, "w") as f:
+            json.dump({"projects": [{"source": "project_0", "destination": "out_0", "mobile": True},
+                {"source": "project_1"}]}, f)
+        projects = pynav.load_batch_file(fname)
+        self.assertEqual(projects, [
+            {"sourcePath": os.path.join(self.tmp, "project_0"), "destinationPath": os.path.join(self.tmp, "out_0"), "mobile": True},
+            {"sourcePath": os.path.join(self.tmp, "project_1")}])
+
+    def test_command_line_projects(self):
+        bin = os.path.join(self.tmp, "bin")
+        os.makedirs(bin)
+        os.symlink(FAKE_CONVERT, os.path.join(bin, "convert"))
+        args = [sys.executable, PYNAV, "-if", "png", "-j", "2"]
+        for project in self.projects:
+            args += ["-p", project.sourcePath, project.destinationPath]
+        result = subprocess.run(args, env=dict(os.environ, PATH=bin + os.pathsep + os.environ["PATH"]),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("5 files converted in 2 projects", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Benchmark helpers: synthetic images, the stub convert and a short run of the suite."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+import fake_convert
+
+
+class SyntheticTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_every_format_has_its_size(self):
+        kinds = {"png": "png", "jpg": "jpeg", "gif": "gif", "psd": "psd"}
+        for image_format, kind in kinds.items():
+            path = os.path.join(self.tmp, "page." + image_format)
+            synthetic.write_image(path, 300, 1200, image_format)
+            self.assertEqual(pynav.probe_image(path), (kind, 300, 1200))
+            if pynav.Image is not None and image_format != "psd":
+                with pynav.Image.open(path) as image:
+                    image.load()
+                    self.assertEqual(image.size, (300, 1200))
+        path = os.path.join(self.tmp, "page.psb")
+        synthetic.write_psd(path, 30, 40, version=2)
+        self.assertEqual(pynav.probe_image(path), ("psb", 30, 40))
+
+    def test_make_project(self):
+        paths = synthetic.make_project(os.path.join(self.tmp, "src"), 3, 20, 30, "png")
+        self.assertEqual([os.path.basename(path) for path in paths], ["page_001.png", "page_002.png", "page_003.png"])
+
+
+class FakeConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "page.png")
+        synthetic.write_png(self.source, 40, 250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def convert(self, *args):
+        return subprocess.call([sys.executable, FAKE_CONVERT] + list(args), stderr=subprocess.PIPE)
+
+    def test_single_pass_command(self):
+        first = os.path.join(self.tmp, "a.jpg")
+        second = os.path.join(self.tmp, "b.png")
+        self.assertEqual(self.convert(self.source, "(", "+clone", "-crop", "40x100+0+0", "-write", first, "+delete", ")",
+            "-crop", "40x50+0+200", "-write", second, "null:"), 0)
+        self.assertEqual(pynav.probe_image(first), ("jpeg", 40, 100))
+        self.assertEqual(pynav.probe_image(second), ("png", 40, 50))
+
+    def test_fails_without_images(self):
+        args = [self.source, "+delete", "null:"]
+        self.assertEqual(fake_convert.count_images(args), 0)
+        self.assertEqual(self.convert(*args), 1)
+
+    def test_injected_failure(self):
+        env = dict(os.environ, PYNAV_FAKE_CONVERT_FAIL="page.png")
+        self.assertEqual(subprocess.call([sys.executable, FAKE_CONVERT, self.source, os.path.join(self.tmp, "a.jpg")],
+            env=env), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "a.jpg")))
+
+
+class RunTest(unittest.TestCase):
+
+    def test_short_run_writes_json(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            results = os.path.join(tmp, "results.json")
+            subprocess.check_call([sys.executable, os.path.join(BENCH_DIR, "run.py"), "--repeat", "1", "--pages", "10",
+                "--probe-files", "2", "--scan-files", "10", "--pages-per-build", "2", "--height", "300",
+                "--latency", "0", "--json", results], stdout=subprocess.PIPE)
+            with open(results) as f:
+                report = json.load(f)
+            self.assertTrue(report["results"])
+            for r in report["results"]:
+                self.assertGreater(r["items"], 0, r["name"])
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--cache: the machine-wide ConversionCache, hits, LRU eviction and atomic entries."""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = pynav.ConversionCache(os.path.join(self.tmp, "cache"), 1 << 20)
+        self.out = os.path.join(self.tmp, "out")
+        os.makedirs(self.out)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def page(self, stem, size=100):
+        """Writes the two slices of a converted page of size bytes each and returns it."""
+        names = [stem + ".jpg", stem + "_slice_1.jpg"]
+        for name in names:
+            with open(os.path.join(self.out, name), "wb") as f:
+                f.write(name.encode("ascii").ljust(size, b"."))
+        return {"width": "10", "height": "20", "slices": names, "variants": [[], []]}
+
+    def store(self, key, stem, size=100):
+        self.cache.store(key, os.path.join(self.out, stem + ".jpg"), self.page(stem, size))
+
+    def entries(self):
+        return sorted(os.path.basename(path) for used, size, path in self.cache.entries())
+
+    def test_miss_store_and_hit(self):
+        key = self.cache.key("hash", "settings", "version")
+        self.assertIsNone(self.cache.fetch(key, os.path.join(self.out, "a.jpg")))
+        self.store(key, "a")
+        # Another destination, another page name
+        other = os.path.join(self.tmp, "other")
+        os.makedirs(other)
+        page = self.cache.fetch(key, os.path.join(other, "b.jpg"))
+        self.assertEqual(page["slices"], ["b.jpg", "b_slice_1.jpg"])
+        with open(os.path.join(other, "b_slice_1.jpg"), "rb") as f:
+            self.assertTrue(f.read().startswith(b"a_slice_1.jpg"))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "stores": 1, "evictions": 0})
+
+    def test_keys(self):
+        key = self.cache.key("hash", "settings", "version")
+        self.assertEqual(key, self.cache.key("hash", "settings", "version"))
+        self.assertEqual(len(set([key, self.cache.key("other", "settings", "version"),
+            self.cache.key("hash", "other", "version"), self.cache.key("hash", "settings", "other")])), 4)
+
+    def test_written_in_place_is_a_miss(self):
+        key = self.cache.key("hash", "settings", "version")
+        self.store(key, "a")
+        fetched = os.path.join(self.tmp, "fetched")
+        os.makedirs(fetched)
+        self.cache.fetch(key, os.path.join(fetched, "a.jpg"))
+        # A build without --cache writes into the linked file
+        with open(os.path.join(fetched, "a.jpg"), "wb") as f:
+            f.write(b"rewritten")
+        self.assertIsNone(self.cache.fetch(key, os.path.join(fetched, "a.jpg")))
+        self.assertEqual(self.entries(), [])
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_least_recently_used_go_first(self):
+        # Room for two entries of 2 x 200 KiB
+        keys = [self.cache.key(str(n), "settings", "version") for n in range(3)]
+        self.store(keys[0], "a", 200 << 10)
+        self.store(keys[1], "b", 200 << 10)
+        # Hits touch the entry, a later use than b
+        past = time.time() - 100
+        for key, used in ((keys[0], past), (keys[1], past - 10)):
+            os.utime(os.path.join(self.cache._entry(key), pynav.CACHE_PAGE_NAME), (used, used))
+        self.assertIsNotNone(self.cache.fetch(keys[0], os.path.join(self.out, "a.jpg")))
+        self.store(keys[2], "c", 200 << 10)
+        self.assertEqual(self.entries(), sorted([keys[0], keys[2]]))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertLessEqual(sum(size for used, size, path in self.cache.entries()), self.cache.size)
+
+    def test_entries_are_written_whole(self):
+        key = self.cache.key("hash", "settings", "version")
+        page = self.page("a")
+        os.remove(os.path.join(self.out, "a_slice_1.jpg"))
+        # A file missing halfway, no entry and no scratch left
+        with self.assertRaises(OSError):
+            self.cache.store(key, os.path.join(self.out, "a.jpg"), page)
+        self.assertFalse(os.path.exists(self.cache._entry(key)))
+        self.assertEqual(os.listdir(self.cache.scratch), [])
+        self.assertEqual(self.cache.stats()["stores"], 0)
+
+    def test_first_store_wins(self):
+        key = self.cache.key("hash", "settings", "version")
+        self.store(key, "a")
+        self.store(key, "b")
+        with open(os.path.join(self.cache._entry(key), pynav.CACHE_PAGE_NAME)) as f:
+            self.assertEqual(json.load(f)["stem"], "a")
+        self.assertEqual(os.listdir(self.cache.scratch), [])
+        self.assertEqual(self.cache.stats()["stores"], 1)
+
+    def test_evicted_entries_leave_their_place_first(self):
+        key = self.cache.key("hash", "settings", "version")
+        self.store(key, "a")
+        entry = self.cache._entry(key)
+        self.assertTrue(self.cache._evict(entry))
+        self.assertFalse(os.path.exists(entry))
+        # Already gone
+        self.assertFalse(self.cache._evict(entry))
+
+    def test_convert_version(self):
+        self.assertEqual(pynav.convert_version(os.path.join(self.tmp, "missing")), os.path.join(self.tmp, "missing"))
+        self.assertIn(os.path.join(self.tmp, "missing"), pynav._convert_versions)
+
+
+class CachedBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(self.src)
+        # Each page its own content, its own key
+        for n in range(3):
+            synthetic.write_png(os.path.join(self.src, "page_{0}.png".format(n)), 40, 250, gray=0x40 * n)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, name, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, os.path.join(self.tmp, name), convert_app=FAKE_CONVERT,
+            inputFormat="png", sliceSize=100, cache=os.path.join(self.tmp, "cache"), **settings))
+
+    def test_second_build_hits(self):
+        first = self.build("first")
+        self.assertEqual(first.cache, {"hits": 0, "misses": 3, "stores": 3, "evictions": 0})
+        self.assertEqual([page["cached"] for page in first.pages], [False] * 3)
+        second = self.build("second")
+        self.assertEqual(second.cache, {"hits": 3, "misses": 0, "stores": 0, "evictions": 0})
+        self.assertEqual([page["cached"] for page in second.pages], [True] * 3)
+        self.assertEqual([page["slices"] for page in second.pages], [page["slices"] for page in first.pages])
+        for page in second.pages:
+            for name in page["slices"]:
+                self.assertTrue(os.path.samefile(os.path.join(first.destination, name), os.path.join(second.destination, name)))
+        # No scratch folder left in the destination
+        self.assertEqual([name for name in os.listdir(second.destination) if name.startswith(".pynav-cache")], [])
+
+    def test_image_settings_are_part_of_the_key(self):
+        self.build("first")
+        other = self.build("second", quality=50)
+        self.assertEqual(other.cache["hits"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--content-slices: cuts in blank rows, flat bands as css blocks, pages with no image slice."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def page(width, height, rows, text=(), background=(255, 255, 255)):
+    """Returns an rgb image of background with the (top, bottom, color) row ranges painted
+    and the (top, bottom) ranges of text, black stripes no row of which is uniform."""
+    image = pynav.Image.new("RGB", (width, height), background)
+    for top, bottom, color in rows:
+        image.paste(color, (0, top, width, bottom))
+    for top, bottom in text:
+        for x in range(0, width, 4):
+            image.paste((0, 0, 0), (x, top, x + 2, bottom))
+    return image
+
+
+@unittest.skipIf(pynav.Image is None, "--content-slices needs Pillow")
+class PlanTest(unittest.TestCase):
+
+    def test_cuts_move_up_to_blank_rows(self):
+        # Text lines every 40 rows, blank rows between them
+        image = page(50, 300, [], [(y, y + 30) for y in range(5, 300, 40)])
+        plan = pynav.plan_content_slices(image, 100)
+        self.assertEqual(sum(height for y, height, color in plan), 300)
+        for y, height, color in plan:
+            self.assertIsNone(color)
+            self.assertLessEqual(height, 100)
+        for y, height, color in plan[1:]:
+            # Never through a text line
+            self.assertTrue(any(y in range(end, end + 10) for end in range(35, 300, 40)), y)
+
+    def test_no_blank_row_cuts_at_the_slice_size(self):
+        image = page(50, 250, [], [(0, 250)])
+        self.assertEqual(pynav.plan_content_slices(image, 100), [(0, 100, None), (100, 100, None), (200, 50, None)])
+
+    def test_flat_bands_with_collapse(self):
+        image = page(50, 400, [(0, 60, (0, 0, 0)), (260, 300, (0, 0, 0))], background=(255, 0, 0))
+        plan = pynav.plan_content_slices(image, 1000, collapse=True)
+        self.assertEqual(plan, [(0, 60, "#000000"), (60, 200, "#ff0000"), (260, 40, "#000000"), (300, 100, "#ff0000")])
+        # Without collapse it is all image
+        self.assertEqual(pynav.plan_content_slices(image, 1000), [(0, 400, None)])
+
+    def test_short_bands_stay_in_the_slice(self):
+        # A 40 row gap between two lines that fit in one slice
+        image = page(50, 200, [], [(0, 80), (120, 200)])
+        self.assertEqual(pynav.plan_content_slices(image, 1000, collapse=True), [(0, 200, None)])
+
+    def test_transparent_bands_are_images(self):
+        image = pynav.Image.new("RGBA", (50, 100), (255, 255, 255, 0))
+        self.assertEqual(pynav.plan_content_slices(image, 1000, collapse=True), [(0, 100, None)])
+
+    def test_uniform_page_is_one_band(self):
+        plan = pynav.plan_content_slices(page(50, 300, []), 100, collapse=True)
+        self.assertEqual(plan, [(0, 300, "#ffffff")])
+        self.assertEqual(pynav.content_slices(plan, "/out/page.jpg", "jpg", 50), ([], [{"color": "#ffffff", "height": 300}]))
+
+    def test_content_slices(self):
+        plan = [(0, 100, None), (100, 50, "#ffffff"), (150, 80, None)]
+        slices, blocks = pynav.content_slices(plan, "/out/page.jpg", "jpg", 50, widths=[25])
+        self.assertEqual([(slc["file"], slc["y"], slc["height"]) for slc in slices],
+            [("/out/page.jpg", 0, 100), ("/out/page_slice_1.jpg", 150, 80)])
+        self.assertEqual([variant["width"] for variant in slices[0]["variants"]], [25])
+        self.assertEqual(blocks, [{"slice": 0, "height": 100}, {"color": "#ffffff", "height": 50},
+            {"slice": 1, "height": 80}])
+
+
+@unittest.skipIf(pynav.Image is None, "--content-slices needs Pillow")
+class ContentBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(self.src)
+        page(40, 300, [(0, 100, (0, 0, 0)), (200, 300, (0, 0, 255))], [(100, 200)]).save(os.path.join(self.src, "page_0.png"))
+        # Flat all over, no image slice at all
+        synthetic.write_png(os.path.join(self.src, "page_1.png"), 40, 300, gray=0xee)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, name, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, os.path.join(self.tmp, name), convert_app=FAKE_CONVERT,
+            inputFormat="png", mobile=True, contentSlices=True, sliceSize=1000, **settings))
+
+    def test_uniform_page_on_every_backend(self):
+        for backend in pynav.CONVERT_BACKENDS:
+            for singlePass in (False, True):
+                name = "{0}_{1}".format(backend, singlePass)
+                result = self.build(name, backend=backend, singlePass=singlePass)
+                self.assertEqual(result.errors, [], name)
+                self.assertEqual([page["status"] for page in result.pages], ["Converted"] * 2, name)
+                first, uniform = result.pages
+                self.assertEqual(first["slices"], ["page_0.jpg"], name)
+                self.assertEqual(uniform["slices"], [], name)
+                self.assertEqual(sorted(name for name in os.listdir(result.destination) if not name.startswith(".")),
+                    ["page_0.html", "page_0.jpg", "page_1.html"], name)
+                with open(os.path.join(result.destination, "page_1.html")) as f:
+                    html = f.read()
+                self.assertIn(pynav.FLAT_BLOCK_HTML.format(color="#eeeeee", width=40, height=300), html)
+                self.assertNotIn("<img", html)
+
+    def test_bands_of_a_page_in_the_html(self):
+        result = self.build("out")
+        self.assertEqual(result.pages[0]["blocks"], [{"color": "#000000", "height": 100},
+            {"slice": 0, "height": 100}, {"color": "#0000ff", "height": 100}])
+        with open(os.path.join(result.destination, "page_0.html")) as f:
+            html = f.read()
+        black = html.index(pynav.FLAT_BLOCK_HTML.format(color="#000000", width=40, height=100))
+        blue = html.index(pynav.FLAT_BLOCK_HTML.format(color="#0000ff", width=40, height=100))
+        self.assertLess(black, html.index("page_0.jpg"))
+        self.assertLess(html.index("page_0.jpg"), blue)
+        # Incremental rebuilds keep the blocks
+        again = self.build("out", incremental=True)
+        self.assertEqual(again.pages[0]["status"], "Skip")
+        self.assertEqual(again.pages[0]["blocks"], result.pages[0]["blocks"])
+
+
+if __name__ == "__main__":
+    unittest.main()
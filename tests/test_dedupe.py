@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--dedupe: content addressed slices, stored once and shared by every page."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class ContentAddressTest(unittest.TestCase):
+
+    def test_identical_files_stored_once(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            paths = []
+            for name, content in (("a.JPG", b"same"), ("b.JPG", b"same"), ("c.JPG", b"other")):
+                with open(os.path.join(tmp, name), "wb") as f:
+                    f.write(content)
+                paths.append(pynav.content_address(os.path.join(tmp, name)))
+            self.assertEqual(paths[0], paths[1])
+            self.assertNotEqual(paths[0], paths[2])
+            self.assertEqual(os.path.basename(paths[0]), pynav.file_hash(paths[0])[:20] + ".jpg")
+            self.assertEqual(sorted(os.listdir(tmp)), sorted(set(os.path.basename(path) for path in paths)))
+        finally:
+            shutil.rmtree(tmp)
+
+
+class DedupeBuildTest(unittest.TestCase):
+    """Solid synthetic pages: every full slice is the same file, and so is every last slice of the same height."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 3, 64, 250, "png")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, **overrides):
+        values = dict(convert_app=FAKE_CONVERT, inputFormat="png", mobile=True, sliceSize=100, jobs=2, dedupe=True)
+        values.update(overrides)
+        result = pynav.build(pynav.BuildSettings(self.src, self.dest, **values))
+        self.assertEqual(result.errors, [])
+        return result
+
+    def images(self):
+        return sorted(name for name in os.listdir(self.dest) if name.endswith((".jpg", ".webp")))
+
+    def test_shared_names(self):
+        for backend in ("external", "batch", "python"):
+            if backend == "python" and pynav.Image is None:
+                continue
+            shutil.rmtree(self.dest, ignore_errors=True)
+            result = self.build(backend=backend)
+            full, last = result.pages[0]["slices"][0], result.pages[0]["slices"][2]
+            self.assertEqual(self.images(), sorted([full, last]), backend)
+            for page in result.pages:
+                self.assertEqual(page["slices"], [full, full, last])
+                with open(os.path.join(self.dest, page["html"])) as f:
+                    html = f.read()
+                self.assertEqual(html.count("src='{0}'".format(full)), 2)
+                self.assertEqual(html.count("src='{0}'".format(last)), 1)
+                self.assertNotIn("_slice_", html)
+
+    def test_variants_are_shared_too(self):
+        result = self.build(widths=[32], webp=True)
+        # Full and last slice and their 32w copies (the stub convert writes every webp alike)
+        self.assertEqual(len([name for name in self.images() if name.endswith(".jpg")]), 2 * 2)
+        self.assertEqual(result.pages[0]["variants"], result.pages[1]["variants"])
+
+    def test_incremental_keeps_the_shared_files(self):
+        result = self.build(incremental=True)
+        full, last = result.pages[0]["slices"][0], result.pages[0]["slices"][2]
+        # page_002 no longer has a 50 pixels slice, the other pages still use it
+        synthetic.write_png(os.path.join(self.src, "page_002.png"), 64, 220, gray=0x80)
+        result = self.build(incremental=True)
+        statuses = dict((page["source"], page["status"]) for page in result.pages)
+        self.assertEqual(statuses, {"page_001.png": "Skip", "page_002.png": "Converted", "page_003.png": "Skip"})
+        page = [page for page in result.pages if page["source"] == "page_002.png"][0]
+        self.assertEqual(page["slices"][:2], [full, full])
+        self.assertNotEqual(page["slices"][2], last)
+        self.assertEqual(self.images(), sorted([full, last, page["slices"][2]]))
+        # Used by no page, removed
+        for name in ("page_001.png", "page_003.png"):
+            synthetic.write_png(os.path.join(self.src, name), 64, 220, gray=0x80)
+        self.build(incremental=True)
+        self.assertEqual(self.images(), sorted([full, page["slices"][2]]))
+
+    @unittest.skipIf(pynav.Image is None, "Pillow")
+    def test_known_rasters_are_not_encoded_again(self):
+        self.build(backend="python", incremental=True)
+        with open(os.path.join(self.dest, pynav.MANIFEST_FILE_NAME)) as f:
+            self.assertEqual(len(json.load(f)["rasters"]), 2)
+        synthetic.write_png(os.path.join(self.src, "page_004.png"), 64, 250)
+        result = self.build(backend="python", incremental=True)
+        converts = [event for event in result.tracer.events if event["cat"] == "convert"]
+        self.assertEqual(len(converts), 3)
+        self.assertTrue(all(event["args"].get("reused") for event in converts))
+
+
+if __name__ == "__main__":
+    unittest.main()
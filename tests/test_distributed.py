@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--distributed builds: local workers on both job queues and lost workers."""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class DistributedBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        synthetic.make_project(self.src, 3, 40, 250, "png")
+        self.stop = threading.Event()
+        self.workers = []
+
+    def tearDown(self):
+        self.stop.set()
+        for thread in self.workers:
+            thread.join()
+        shutil.rmtree(self.tmp)
+
+    def start_workers(self, target, *args):
+        for n in range(2):
+            thread = threading.Thread(target=target, args=args + (pynav.ExternalConvertBackend(FAKE_CONVERT), self.stop))
+            thread.daemon = True
+            thread.start()
+            self.workers.append(thread)
+
+    def build(self, name, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, os.path.join(self.tmp, name), convert_app=FAKE_CONVERT,
+            inputFormat="png", sliceSize=100, **settings))
+
+    def check(self, address):
+        result = self.build("out", distributed=address)
+        local = self.build("local")
+        self.assertEqual(result.errors, [])
+        self.assertEqual([page["status"] for page in result.pages], ["Converted"] * 3)
+        self.assertEqual([page["slices"] for page in result.pages], [page["slices"] for page in local.pages])
+        self.assertEqual(sorted(os.listdir(result.destination)), sorted(os.listdir(local.destination)))
+        for page in result.pages:
+            self.assertEqual(len(page["slices"]), 3)
+            for name in page["slices"]:
+                self.assertEqual(pynav.get_image_size(os.path.join(result.destination, name)),
+                    pynav.get_image_size(os.path.join(local.destination, name)))
+
+    def test_tcp_queue(self):
+        port = free_port()
+        self.start_workers(pynav._tcp_worker, "127.0.0.1", port)
+        self.check("127.0.0.1:{0}".format(port))
+
+    def test_dir_queue(self):
+        folder = os.path.join(self.tmp, "queue")
+        os.makedirs(folder)
+        self.start_workers(pynav._dir_worker, folder)
+        self.check(folder)
+        # Nothing left behind
+        for name in ("todo", "doing", "done"):
+            self.assertEqual(os.listdir(os.path.join(folder, name)), [])
+
+
+class TcpLeaseTest(unittest.TestCase):
+    """A TcpJobQueue against hand written workers, with a short lease."""
+
+    def setUp(self):
+        self.lease = pynav.JOB_LEASE
+        pynav.JOB_LEASE = 0.5
+        self.queue = pynav.TcpJobQueue("127.0.0.1", 0)
+        self.addCleanup(self.queue.close)
+
+    def tearDown(self):
+        pynav.JOB_LEASE = self.lease
+
+    def connect(self):
+        sock = socket.create_connection(self.queue.address)
+        self.addCleanup(sock.close)
+        return sock, sock.makefile("rwb")
+
+    def test_silent_worker_loses_its_job(self):
+        future = self.queue.submit({"page": 1})
+        sock, stream = self.connect()
+        job = json.loads(stream.readline().decode("utf-8"))
+        self.assertEqual(job["attempt"], 0)
+        # The coordinator hangs up after the lease and hands the job out again
+        start = time.time()
+        self.assertEqual(stream.readline(), b"")
+        self.assertLess(time.time() - start, 5)
+        sock, stream = self.connect()
+        job = json.loads(stream.readline().decode("utf-8"))
+        self.assertEqual((job["page"], job["attempt"]), (1, 1))
+        stream.write(json.dumps({"id": job["id"], "ok": True}).encode("utf-8") + b"\n")
+        stream.flush()
+        self.assertEqual(future.result(5), {"id": job["id"], "ok": True})
+
+    def test_heartbeats_keep_the_job(self):
+        future = self.queue.submit({"page": 1})
+        sock, stream = self.connect()
+        job = json.loads(stream.readline().decode("utf-8"))
+        for n in range(8):
+            time.sleep(pynav.JOB_LEASE / 4.0)
+            stream.write(b"\n")
+            stream.flush()
+        stream.write(json.dumps({"id": job["id"], "ok": True}).encode("utf-8") + b"\n")
+        stream.flush()
+        self.assertEqual(future.result(5)["ok"], True)
+        self.assertTrue(self.queue._jobs.empty())
+
+    def test_slow_job_of_a_worker(self):
+        # Runs for 4 leases, the worker heartbeats keep it
+        runs = []
+        class SlowBackend(object):
+            name = "slow"
+            def convert(self, job, cancel=None):
+                runs.append(job["page"])
+                time.sleep(pynav.JOB_LEASE * 4)
+        stop = threading.Event()
+        thread = threading.Thread(target=pynav._tcp_worker, args=self.queue.address + (SlowBackend(), stop))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(stop.set)
+        future = self.queue.submit({"page": 1, "slices": []})
+        self.assertEqual(future.result(10)["ok"], True)
+        self.assertEqual(runs, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--draft: the psd composite or thumbnail read without ImageMagick."""
+
+import io
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def resource(number, data):
+    """Returns an image resource block with an empty name."""
+    return b"8BIM" + struct.pack(">HBxI", number, 0, len(data)) + data + b"\x00" * (len(data) % 2)
+
+
+def thumbnail(image, number=pynav.PSD_THUMBNAIL):
+    """Returns the thumbnail resource of image, stored bgr for the Photoshop 4 one."""
+    if number == pynav.PSD_THUMBNAIL_BGR:
+        red, green, blue = image.split()
+        image = pynav.Image.merge("RGB", (blue, green, red))
+    data = io.BytesIO()
+    image.save(data, format="JPEG", quality=95)
+    return resource(number, struct.pack(">IIIIIIHH", 1, image.width, image.height, 0, 0, len(data.getvalue()), 24, 1)
+        + data.getvalue())
+
+
+def packbits(row):
+    """Returns row as packbits literal runs."""
+    data = b""
+    for start in range(0, len(row), 128):
+        chunk = row[start:start + 128]
+        data += struct.pack(">B", len(chunk) - 1) + chunk
+    return data
+
+
+def write_psd(path, image, compression=1, resources=b"", composite=True, version=1):
+    """Writes image as an 8 bit psd (psb with version 2) with its composite raw or rle, or none at all."""
+    modes = dict((mode, number) for number, mode in pynav.PSD_MODES.items())
+    planes = image.split()
+    if image.mode == "CMYK":
+        planes = [pynav.ImageChops.invert(plane) for plane in planes]
+    with open(path, "wb") as f:
+        f.write(b"8BPS" + struct.pack(">H", version) + b"\x00" * 6)
+        f.write(struct.pack(">HIIHH", len(planes), image.height, image.width, 8, modes[image.mode]))
+        f.write(struct.pack(">I", 0) + struct.pack(">I", len(resources)) + resources)
+        f.write(struct.pack(">Q" if version == 2 else ">I", 0))
+        if not composite:
+            return
+        rows = [plane.tobytes()[y * image.width:(y + 1) * image.width] for plane in planes for y in range(image.height)]
+        if compression == 0:
+            f.write(struct.pack(">H", 0) + b"".join(rows))
+        else:
+            rows = [packbits(row) for row in rows]
+            count = ">I" if version == 2 else ">H"
+            f.write(struct.pack(">H", 1) + b"".join(struct.pack(count, len(row)) for row in rows) + b"".join(rows))
+
+
+def gradient(mode, width=40, height=30):
+    image = pynav.Image.new(mode, (width, height))
+    bands = len(mode)
+    image.putdata([tuple((x * 6 + y * 3 + band * 50) % 256 for band in range(bands)) if bands > 1 else (x * 6 + y * 3) % 256
+        for y in range(height) for x in range(width)])
+    return image
+
+
+@unittest.skipIf(pynav.Image is None, "--draft needs Pillow")
+class ReadDraftTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "page.psd")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_composite(self):
+        for mode in ("L", "RGB", "CMYK"):
+            for compression in (0, 1):
+                for version in (1, 2):
+                    image = gradient(mode)
+                    write_psd(self.path, image, compression, version=version)
+                    draft, kind = pynav.read_psd_draft(self.path)
+                    self.assertEqual(kind, "composite")
+                    self.assertEqual(draft.mode, mode)
+                    self.assertEqual(draft.tobytes(), image.tobytes(), (mode, compression, version))
+
+    def test_synthetic_psd(self):
+        synthetic.write_psd(self.path, 20, 10)
+        draft, kind = pynav.read_psd_draft(self.path)
+        self.assertEqual((kind, draft.size, draft.getpixel((5, 5))), ("composite", (20, 10), (0x80, 0x80, 0x80)))
+
+    def test_thumbnail_without_real_merged_data(self):
+        image = pynav.Image.new("RGB", (40, 30), (200, 40, 10))
+        # Version info with hasRealMergedData false, the composite is blank
+        resources = resource(pynav.PSD_VERSION_INFO, struct.pack(">IB", 1, 0)) + thumbnail(image.resize((20, 15)))
+        write_psd(self.path, pynav.Image.new("RGB", (40, 30), (255, 255, 255)), resources=resources)
+        draft, kind = pynav.read_psd_draft(self.path)
+        self.assertEqual((kind, draft.mode, draft.size), ("thumbnail", "RGB", (40, 30)))
+        for value, expected in zip(draft.getpixel((20, 15)), (200, 40, 10)):
+            self.assertAlmostEqual(value, expected, delta=8)
+
+    def test_bgr_thumbnail_without_composite(self):
+        image = pynav.Image.new("RGB", (40, 30), (200, 40, 10))
+        write_psd(self.path, image, resources=thumbnail(image, pynav.PSD_THUMBNAIL_BGR), composite=False)
+        # The section starts where the composite would, its compression is unknown
+        with open(self.path, "ab") as f:
+            f.write(struct.pack(">H", 3))
+        draft, kind = pynav.read_psd_draft(self.path)
+        self.assertEqual(kind, "thumbnail")
+        for value, expected in zip(draft.getpixel((20, 15)), (200, 40, 10)):
+            self.assertAlmostEqual(value, expected, delta=8)
+
+    def test_neither(self):
+        write_psd(self.path, gradient("RGB"), resources=resource(pynav.PSD_VERSION_INFO, struct.pack(">IB", 1, 0)))
+        self.assertIsNone(pynav.read_psd_draft(self.path))
+        synthetic.write_png(self.path, 8, 8)
+        self.assertIsNone(pynav.read_psd_draft(self.path))
+
+
+@unittest.skipIf(pynav.Image is None, "--draft needs Pillow")
+class DraftBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        synthetic.make_project(self.src, 2, 40, 250)
+        self.dest = os.path.join(self.tmp, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, convert_app=FAKE_CONVERT, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, self.dest, convert_app=convert_app, sliceSize=100, **settings))
+
+    def test_draft_build_without_convert(self):
+        result = self.build(os.path.join(self.tmp, "missing"), draft=True)
+        self.assertEqual(result.errors, [])
+        self.assertEqual([page["draft"] for page in result.pages], ["composite"] * 2)
+        for page in result.pages:
+            self.assertEqual(len(page["slices"]), 3)
+            self.assertEqual(pynav.get_image_size(os.path.join(self.dest, page["slices"][0])), (40, 100))
+        with open(os.path.join(self.dest, pynav.MANIFEST_FILE_NAME)) as f:
+            self.assertIn('"draft": "composite"', f.read())
+
+    def test_full_build_replaces_the_draft(self):
+        first = self.build(os.path.join(self.tmp, "missing"), draft=True)
+        # Another draft build keeps the drafts
+        skipped = self.build(os.path.join(self.tmp, "missing"), draft=True, incremental=True)
+        self.assertEqual([page["status"] for page in skipped.pages], ["Skip"] * 2)
+        again = self.build(incremental=True)
+        self.assertEqual([page["status"] for page in again.pages], ["Converted"] * 2)
+        self.assertEqual([page["draft"] for page in again.pages], [None] * 2)
+        self.assertEqual([page["slices"] for page in again.pages], [page["slices"] for page in first.pages])
+
+    def test_psd_without_composite_nor_thumbnail(self):
+        path = os.path.join(self.src, "page_003.psd")
+        write_psd(path, gradient("RGB", 40, 250), resources=resource(pynav.PSD_VERSION_INFO, struct.pack(">IB", 1, 0)))
+        result = self.build(os.path.join(self.tmp, "missing"), draft=True)
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn("page_003.psd", str(result.errors[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Build manifest and --incremental rebuilds, running pynav.py against benchmarks/fake_convert.py."""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, BENCH_DIR)
+import synthetic
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        os.makedirs(self.src)
+        for n in (1, 2, 3):
+            synthetic.write_png(os.path.join(self.src, "page_00{0}.png".format(n)), 64, 200)
+        self.bin = os.path.join(self.tmp, "bin")
+        os.makedirs(self.bin)
+        os.symlink(FAKE_CONVERT, os.path.join(self.bin, "convert"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, **env):
+        """Runs an incremental build and returns the status of every page of its progress lines."""
+        environ = dict(os.environ, PATH=self.bin + os.pathsep + os.environ["PATH"], **env)
+        result = subprocess.run([sys.executable, PYNAV, self.src, self.dest, "-if", "png", "-m", "-slc", "100",
+            "-j", "2", "-inc", "-index"], env=environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        self.stderr = result.stderr
+        return dict((name, status or "Converted") for name, status
+            in re.findall(r"\.\.\. (\S+\.png)(?: \((\w+)\))?$", result.stdout, re.M))
+
+    def manifest(self):
+        with open(os.path.join(self.dest, ".pynav-manifest.json")) as f:
+            return json.load(f)
+
+    def test_unchanged_pages_are_skipped(self):
+        self.assertEqual(set(self.build().values()), set(["Converted"]))
+        self.assertEqual(sorted(self.manifest()["pages"]), ["page_001.png", "page_002.png", "page_003.png"])
+        self.assertEqual(set(self.build().values()), set(["Skip"]))
+        # Touched but identical, told apart by the hash
+        os.utime(os.path.join(self.src, "page_001.png"), (1, 1))
+        self.assertEqual(self.build()["page_001.png"], "Skip")
+
+    def test_edited_page_is_converted_again(self):
+        self.build()
+        synthetic.write_png(os.path.join(self.src, "page_002.png"), 64, 200, gray=0x20)
+        self.assertEqual(self.build(), {"page_001.png": "Skip", "page_002.png": "Converted", "page_003.png": "Skip"})
+        with open(os.path.join(self.src, "page_002.png"), "rb") as f:
+            self.assertEqual(self.manifest()["pages"]["page_002.png"]["hash"], hashlib.sha1(f.read()).hexdigest())
+
+    def test_removed_page_files_are_deleted(self):
+        self.build()
+        os.remove(os.path.join(self.src, "page_003.png"))
+        # The html of the page before gets its new next page
+        self.assertEqual(self.build(), {"page_001.png": "Skip", "page_002.png": "Html"})
+        self.assertFalse([name for name in os.listdir(self.dest) if name.startswith("page_003")])
+        self.assertNotIn("page_003.png", self.manifest()["pages"])
+        with open(os.path.join(self.dest, "page_002.html")) as f:
+            self.assertIn("page_001.html", f.read())
+
+    def test_failed_page_keeps_its_last_build(self):
+        self.build()
+        before = self.manifest()["pages"]["page_002.png"]
+        synthetic.write_png(os.path.join(self.src, "page_002.png"), 64, 200, gray=0x20)
+        self.assertEqual(self.build(PYNAV_FAKE_CONVERT_FAIL="page_002.png")["page_002.png"], "Failed")
+        self.assertIn("page_002.png", self.stderr)
+        self.assertEqual(self.manifest()["pages"]["page_002.png"], before)
+        for name in before["slices"] + [before["html"]]:
+            self.assertTrue(os.path.isfile(os.path.join(self.dest, name)), name)
+        with open(os.path.join(self.dest, "index.html")) as f:
+            self.assertIn("page_002.html", f.read())
+        # Converted by the next build that works
+        self.assertEqual(self.build()["page_002.png"], "Converted")
+
+
+if __name__ == "__main__":
+    unittest.main()
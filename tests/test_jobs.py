@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--jobs worker pool, running pynav.py against benchmarks/fake_convert.py."""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, BENCH_DIR)
+import synthetic
+
+
+class JobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        os.makedirs(self.src)
+        # pynav falls back to the convert of the PATH
+        self.bin = os.path.join(self.tmp, "bin")
+        os.makedirs(self.bin)
+        os.symlink(FAKE_CONVERT, os.path.join(self.bin, "convert"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def pynav(self, *args, **env):
+        environ = dict(os.environ, PATH=self.bin + os.pathsep + os.environ["PATH"], **env)
+        return subprocess.run([sys.executable, PYNAV, self.src, self.dest, "-if", "png"] + list(args),
+            env=environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    def outputs(self):
+        # Leaves out the build manifest
+        return sorted(name for name in os.listdir(self.dest) if not name.startswith("."))
+
+    def sources(self):
+        # The order pynav takes the sources in, natural order
+        return ["page_{0}".format(n) for n in range(len(os.listdir(self.src)))]
+
+    def test_results_come_in_source_order(self):
+        # The first page has the most slices, so it is the last to finish
+        for n, height in enumerate((1000, 100, 100, 100, 100, 100)):
+            synthetic.write_png(os.path.join(self.src, "page_{0}.png".format(n)), 20, height)
+        result = self.pynav("-j", "6", "-slc", "100", "-index", PYNAV_FAKE_CONVERT_LATENCY="0.05")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        names = self.sources()
+        self.assertEqual(re.findall(r"\.\.\. (\w+)\.png", result.stdout), names)
+        with open(os.path.join(self.dest, "index.html")) as f:
+            self.assertEqual(re.findall(r"href='(\w+)\.html'", f.read()), names)
+        for n, name in enumerate(names):
+            with open(os.path.join(self.dest, name + ".html")) as f:
+                self.assertIn("{0}.html".format(names[(n + 1) % len(names)]), f.read())
+
+    def test_jobs_run_in_parallel(self):
+        for n in range(4):
+            synthetic.write_png(os.path.join(self.src, "page_{0}.png".format(n)), 20, 20)
+        start = time.time()
+        result = self.pynav("-j", "4", PYNAV_FAKE_CONVERT_LATENCY="0.6")
+        # 2.4 seconds one at a time
+        self.assertLess(time.time() - start, 1.8)
+        self.assertEqual(len(self.outputs()), 8, result.stderr)
+
+    def test_failed_page_does_not_stop_the_others(self):
+        for n in range(4):
+            synthetic.write_png(os.path.join(self.src, "page_{0}.png".format(n)), 20, 20)
+        result = self.pynav("-j", "2", PYNAV_FAKE_CONVERT_FAIL="page_1")
+        self.assertIn("page_1.png", result.stderr)
+        self.assertEqual(self.outputs(), ["page_0.html", "page_0.jpg", "page_2.html", "page_2.jpg",
+            "page_3.html", "page_3.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
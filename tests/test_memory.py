@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--memory-budget: MemoryBudget admission, the estimate and the convert -limit arguments."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import concurrent.futures
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def acquire_later(self, budget, amount, order, cancel=None):
+        """Starts a thread that acquires amount and appends it to order, returns the thread."""
+        def run():
+            try:
+                budget.acquire(amount, cancel)
+                order.append(amount)
+            except concurrent.futures.CancelledError:
+                order.append("cancelled")
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_admits_while_it_fits(self):
+        budget = pynav.MemoryBudget(100)
+        budget.acquire(60)
+        budget.acquire(40)
+        self.assertEqual(budget.used, 100)
+        order = []
+        thread = self.acquire_later(budget, 10, order)
+        thread.join(0.3)
+        self.assertEqual(order, [])
+        budget.release(40)
+        thread.join(5)
+        self.assertEqual((order, budget.used), ([10], 70))
+
+    def test_arrival_order(self):
+        budget = pynav.MemoryBudget(100)
+        budget.acquire(70)
+        order = []
+        # 50 waits at the head, 20 would fit but comes after it
+        first = self.acquire_later(budget, 50, order)
+        time.sleep(0.1)
+        second = self.acquire_later(budget, 20, order)
+        second.join(0.3)
+        self.assertEqual(order, [])
+        budget.release(70)
+        first.join(5)
+        second.join(5)
+        self.assertEqual(order, [50, 20])
+
+    def test_larger_than_the_budget_runs_alone(self):
+        budget = pynav.MemoryBudget(100)
+        budget.acquire(500)
+        order = []
+        thread = self.acquire_later(budget, 1, order)
+        thread.join(0.3)
+        self.assertEqual(order, [])
+        budget.release(500)
+        thread.join(5)
+        self.assertEqual(order, [1])
+
+    def test_cancel_at_the_head(self):
+        budget = pynav.MemoryBudget(100)
+        budget.acquire(100)
+        order = []
+        cancel = threading.Event()
+        first = self.acquire_later(budget, 50, order, cancel)
+        time.sleep(0.1)
+        second = self.acquire_later(budget, 50, order)
+        cancel.set()
+        first.join(5)
+        self.assertEqual(order, ["cancelled"])
+        budget.release(50)
+        second.join(5)
+        self.assertEqual((order, budget.used), (["cancelled", 50], 100))
+
+    def test_estimate_and_limit_arguments(self):
+        backend = pynav.ExternalConvertBackend("convert")
+        self.assertEqual(pynav.estimate_memory(backend, 1000, 5000, 1034),
+            pynav.MEMORY_BASE + (1000 * 5000 + 2 * 1000 * 1034) * backend.pixelBytes)
+        # A short image is a single slice
+        self.assertEqual(pynav.estimate_memory(backend, 1000, 500, 1034), pynav.MEMORY_BASE + 1000 * 1500 * backend.pixelBytes)
+        self.assertEqual(pynav.memory_limit_args(None), [])
+        self.assertEqual(pynav.memory_limit_args(300 << 20), ['-limit', 'memory', '300MiB', '-limit', 'map', '600MiB'])
+
+
+class BudgetBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 4, 64, 250, "png")
+        self.env = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.tmp)
+
+    def test_one_page_at_a_time(self):
+        os.environ["PYNAV_FAKE_CONVERT_LATENCY"] = "0.1"
+        # Each page needs a bit more than the 32 MiB base, a 40 MiB budget admits one
+        for backend in ("external", "batch"):
+            shutil.rmtree(self.dest, ignore_errors=True)
+            result = pynav.build(pynav.BuildSettings(self.src, self.dest, convert_app=FAKE_CONVERT, inputFormat="png",
+                sliceSize=100, jobs=4, backend=backend, singlePass=True, memoryBudget=40))
+            self.assertEqual(result.errors, [], backend)
+            for page in result.pages:
+                self.assertGreater(page["memory"], pynav.MEMORY_BASE)
+                self.assertGreater(page["peakRss"], 0)
+            events = result.tracer.events
+            self.assertEqual(len([event for event in events if event["cat"] == "admit"]), 4)
+            converts = sorted((event["ts"], event["ts"] + event["dur"]) for event in events if event["cat"] == "convert")
+            for (start, end), (nextStart, nextEnd) in zip(converts, converts[1:]):
+                self.assertLessEqual(end, nextStart, backend)
+
+
+if __name__ == "__main__":
+    unittest.main()
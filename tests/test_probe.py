@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Image header probe: magic-byte detection and the (path, size, mtime) cache."""
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def tiff_ifd(endian, width, height):
+    """Returns a tiff IFD with a SHORT ImageWidth and a LONG ImageLength."""
+    return (struct.pack(endian + "H", 2)
+        + struct.pack(endian + "HHLHH", 256, 3, 1, width, 0)
+        + struct.pack(endian + "HHLL", 257, 4, 1, height)
+        + struct.pack(endian + "L", 0))
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, data):
+        # Names without the real extension, the format comes from the content
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def assertProbe(self, data, expected):
+        self.assertEqual(pynav.probe_image(self.write("image.dat", data)), expected)
+
+    def test_psd_and_psb(self):
+        for version, kind in ((1, "psd"), (2, "psb")):
+            header = b"8BPS" + struct.pack(">H", version) + b"\x00" * 6 + struct.pack(">HLLHH", 3, 9000, 1280, 8, 3)
+            self.assertProbe(header, (kind, 1280, 9000))
+
+    def test_png(self):
+        path = os.path.join(self.tmp, "image.dat")
+        synthetic.write_png(path, 640, 48)
+        self.assertEqual(pynav.probe_image(path), ("png", 640, 48))
+
+    def test_gif(self):
+        self.assertProbe(b"GIF89a" + struct.pack("<HH", 320, 200) + b"\x00" * 20, ("gif", 320, 200))
+        self.assertProbe(b"GIF87a" + struct.pack("<HH", 1, 2) + b"\x00" * 20, ("gif", 1, 2))
+
+    def test_jpeg(self):
+        # APP0, then a DHT (c4, not a frame) before the SOF0
+        data = (b"\xff\xd8"
+            + b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+            + b"\xff\xc4" + struct.pack(">H", 5) + b"\x00\x01\x02"
+            + b"\xff\xff\xc0" + struct.pack(">HBHHB", 11, 8, 900, 1600, 3) + b"\x00" * 6
+            + b"\xff\xd9")
+        self.assertProbe(data, ("jpeg", 1600, 900))
+        # Cut before any frame
+        self.assertProbe(data[:30], None)
+
+    def test_webp(self):
+        def riff(chunk, data):
+            return b"RIFF" + struct.pack("<L", 4 + 8 + len(data)) + b"WEBP" + chunk + struct.pack("<L", len(data)) + data
+        self.assertProbe(riff(b"VP8 ", b"\x00\x00\x00\x9d\x01\x2a" + struct.pack("<HH", 800, 600) + b"\x00" * 8),
+            ("webp", 800, 600))
+        bits = (800 - 1) | ((600 - 1) << 14)
+        self.assertProbe(riff(b"VP8L", b"\x2f" + struct.pack("<L", bits) + b"\x00" * 8), ("webp", 800, 600))
+        self.assertProbe(riff(b"VP8X", b"\x00" * 4 + struct.pack("<L", 3999)[:3] + struct.pack("<L", 19999)[:3]
+            + b"\x00" * 8), ("webp", 4000, 20000))
+
+    def test_tiff(self):
+        self.assertProbe(b"II*\x00" + struct.pack("<L", 8) + tiff_ifd("<", 1024, 70000), ("tiff", 1024, 70000))
+        # IFD past the header buffer
+        offset = 2048
+        data = b"MM\x00*" + struct.pack(">L", offset) + b"\x00" * (offset - 8) + tiff_ifd(">", 300, 200)
+        self.assertProbe(data, ("tiff", 300, 200))
+
+    def test_bmp(self):
+        # BITMAPINFOHEADER, top-down (negative height)
+        self.assertProbe(b"BM" + b"\x00" * 12 + struct.pack("<Lll", 40, 500, -400) + b"\x00" * 30, ("bmp", 500, 400))
+        # OS/2 BITMAPCOREHEADER
+        self.assertProbe(b"BM" + b"\x00" * 12 + struct.pack("<LHH", 12, 64, 32) + b"\x00" * 30, ("bmp", 64, 32))
+
+    def test_unknown_and_missing(self):
+        self.assertProbe(b"not an image at all", None)
+        self.assertIsNone(pynav.probe_image(os.path.join(self.tmp, "missing.png")))
+        self.assertIsNone(pynav.get_image_size(os.path.join(self.tmp, "missing.png")))
+
+    def test_cache_follows_size_and_mtime(self):
+        path = os.path.join(self.tmp, "page.png")
+        synthetic.write_png(path, 10, 20)
+        stat = os.stat(path)
+        self.assertEqual(pynav.get_image_size(path), (10, 20))
+        # Same size and mtime, the cached header is used
+        with open(path, "r+b") as f:
+            f.seek(16)
+            f.write(struct.pack(">LL", 30, 40))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(pynav.get_image_size(path), (10, 20))
+        # A new mtime probes again
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(pynav.get_image_size(path), (30, 40))
+        # And so does a new size
+        synthetic.write_png(path, 50, 60, gray=0x10)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(pynav.get_image_size(path), (50, 60))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Quality search: PSNR/SSIM scores, --slice-kb/--page-kb budgets and --min-psnr/--min-ssim."""
+
+import io
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def noisy(width, height, seed=1):
+    """Returns a grayscale gradient with seeded noise, an image whose jpg size follows the quality."""
+    rand = random.Random(seed)
+    image = pynav.Image.new("RGB", (width, height))
+    image.putdata([(min(255, x * 4 + rand.randrange(48)),) * 3 for y in range(height) for x in range(width)])
+    return image
+
+
+def encoded(image, quality):
+    data = io.BytesIO()
+    image.save(data, format="JPEG", quality=quality)
+    return data.getvalue()
+
+
+def decoded(data):
+    image = pynav.Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+@unittest.skipIf(pynav.Image is None, "the quality search needs Pillow")
+class ScoreTest(unittest.TestCase):
+
+    def test_psnr(self):
+        image = pynav.Image.new("RGB", (16, 16), (100, 100, 100))
+        self.assertEqual(pynav.psnr(image, image.copy()), 100.0)
+        # Off by 16 everywhere, mse 256
+        self.assertAlmostEqual(pynav.psnr(image, pynav.Image.new("RGB", (16, 16), (116, 116, 116))), 24.048, 3)
+        # Grayscale against rgb
+        self.assertEqual(pynav.psnr(image.convert("L"), image), 100.0)
+
+    @unittest.skipIf(pynav.numpy is None, "SSIM needs numpy")
+    def test_ssim(self):
+        image = noisy(64, 64)
+        self.assertAlmostEqual(pynav.ssim(image, image.copy()), 1.0)
+        worse = pynav.ssim(image, decoded(encoded(image, 10)))
+        better = pynav.ssim(image, decoded(encoded(image, 90)))
+        self.assertLess(worse, better)
+        self.assertLess(better, 1.0)
+        # Smaller than a window
+        tiny = noisy(4, 3)
+        self.assertAlmostEqual(pynav.ssim(tiny, tiny.copy()), 1.0)
+
+
+@unittest.skipIf(pynav.Image is None, "the quality search needs Pillow")
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.piece = noisy(64, 64)
+
+    def test_no_limits_keeps_the_quality(self):
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 85)
+        self.assertEqual((quality, data, scores), (85, encoded(self.piece, 85), {}))
+
+    def test_budget_takes_the_highest_quality_within_it(self):
+        budget = len(encoded(self.piece, 60))
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 95, budget)
+        self.assertLessEqual(len(data), budget)
+        self.assertEqual(data, encoded(self.piece, quality))
+        self.assertGreater(len(encoded(self.piece, quality + 1)), budget)
+        self.assertGreaterEqual(quality, 60)
+        # Already within it
+        self.assertEqual(pynav.search_quality(self.piece, "jpg", 50, budget)[0], 50)
+
+    def test_budget_too_small_takes_the_lowest_quality(self):
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 90, 10)
+        self.assertEqual(quality, pynav.QUALITY_MIN)
+
+    def test_min_psnr_takes_the_lowest_passing_quality(self):
+        target = pynav.psnr(self.piece, decoded(encoded(self.piece, 70)))
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 95, minPsnr=target)
+        self.assertGreaterEqual(scores["psnr"], round(target, 2) - 0.01)
+        self.assertLess(pynav.psnr(self.piece, decoded(encoded(self.piece, quality - 1))), target)
+        self.assertLessEqual(quality, 70)
+        self.assertEqual(scores["psnr"], round(pynav.psnr(self.piece, decoded(data)), 2))
+        self.assertNotIn("ssim", scores)
+
+    def test_scores_win_over_the_budget(self):
+        budget = len(encoded(self.piece, 40))
+        target = pynav.psnr(self.piece, decoded(encoded(self.piece, 80)))
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 95, budget, minPsnr=target)
+        self.assertGreater(len(data), budget)
+        self.assertGreaterEqual(quality, 41)
+        self.assertGreaterEqual(scores["psnr"], round(target, 2) - 0.01)
+        self.assertLess(pynav.psnr(self.piece, decoded(encoded(self.piece, quality - 1))), target)
+
+    def test_unreachable_score_keeps_the_quality(self):
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 80, minPsnr=99)
+        self.assertEqual(quality, 80)
+
+    @unittest.skipIf(pynav.numpy is None, "SSIM needs numpy")
+    def test_min_ssim(self):
+        target = pynav.ssim(self.piece, decoded(encoded(self.piece, 60)))
+        quality, data, scores = pynav.search_quality(self.piece, "jpg", 95, minSsim=target)
+        self.assertGreaterEqual(scores["ssim"], round(target, 4) - 0.0001)
+        self.assertLess(pynav.ssim(self.piece, decoded(encoded(self.piece, quality - 1))), target)
+
+    def test_slice_budgets(self):
+        slices = [{"width": 10, "height": 30}, {"width": 10, "height": 10}]
+        pynav.slice_budgets(slices, {"pageBytes": 4000, "sliceBytes": 2000})
+        self.assertEqual([slc["budget"] for slc in slices], [2000, 1000])
+        pynav.slice_budgets(slices, {"pageBytes": None, "sliceBytes": None})
+        self.assertEqual([slc["budget"] for slc in slices], [None, None])
+
+
+@unittest.skipIf(pynav.Image is None, "the quality search needs Pillow")
+class SearchBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(self.src)
+        for n in range(2):
+            noisy(64, 250, seed=n).save(os.path.join(self.src, "page_{0}.png".format(n)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, name, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, os.path.join(self.tmp, name), convert_app=FAKE_CONVERT,
+            inputFormat="png", sliceSize=100, quality=95, backend="python", **settings))
+
+    def test_slice_budget(self):
+        result = self.build("out", sliceBytes=2)
+        for page in result.pages:
+            self.assertEqual(len(page["qualities"]), 3)
+            for name, found in zip(page["slices"], page["qualities"]):
+                self.assertEqual(os.path.getsize(os.path.join(result.destination, name)), found["bytes"])
+                self.assertTrue(found["bytes"] <= 2048 or found["quality"] == pynav.QUALITY_MIN, found)
+                self.assertLess(found["quality"], 95)
+
+    def test_page_budget(self):
+        plain = self.build("plain")
+        result = self.build("out", pageBytes=8)
+        for before, page in zip(plain.pages, result.pages):
+            total = sum(found["bytes"] for found in page["qualities"])
+            self.assertLessEqual(total, 8 << 10)
+            self.assertLess(total, sum(os.path.getsize(os.path.join(plain.destination, name)) for name in before["slices"]))
+
+    def test_min_psnr_in_the_manifest(self):
+        result = self.build("out", minPsnr=30)
+        for page in result.pages:
+            for found in page["qualities"]:
+                self.assertGreaterEqual(found["psnr"], 30)
+        again = self.build("out", minPsnr=30, incremental=True)
+        self.assertEqual([page["status"] for page in again.pages], ["Skip", "Skip"])
+        self.assertEqual([page["qualities"] for page in again.pages], [page["qualities"] for page in result.pages])
+
+    def test_needs_the_python_backend(self):
+        with self.assertRaises(pynav.PynavError):
+            pynav.build(pynav.BuildSettings(self.src, os.path.join(self.tmp, "out"), convert_app=FAKE_CONVERT,
+                inputFormat="png", sliceBytes=2, backend="external"))
+        with self.assertRaises(pynav.PynavError):
+            self.build("png", sliceBytes=2, outputFormat="png")
+
+
+if __name__ == "__main__":
+    unittest.main()
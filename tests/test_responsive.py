@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--widths and --webp: responsive variants of every slice."""
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+import fake_convert
+
+
+class VariantsTest(unittest.TestCase):
+
+    def test_names_and_sizes(self):
+        slc = {"file": "out/page_slice_1.jpg", "x": 0, "y": 100, "width": 1280, "height": 100}
+        self.assertEqual(pynav.slice_variants(slc, [1920, 640, 320, 640], True), [
+            {"width": 320, "height": 25, "files": ["out/page_slice_1_320w.jpg", "out/page_slice_1_320w.webp"]},
+            {"width": 640, "height": 50, "files": ["out/page_slice_1_640w.jpg", "out/page_slice_1_640w.webp"]},
+            {"width": 1280, "height": 100, "files": ["out/page_slice_1.webp"]}])
+        self.assertEqual(pynav.slice_variants(slc), [])
+        # A webp output has no webp copy
+        self.assertEqual(pynav.slice_variants(dict(slc, file="page.webp"), [], True), [])
+
+    def test_convert_arguments(self):
+        slc = {"file": "page.jpg", "x": 0, "y": 0, "width": 1280, "height": 100}
+        slc["variants"] = pynav.slice_variants(slc, [640], True)
+        args = pynav.variant_args(slc)
+        self.assertEqual(args, ['(', '+clone', '+repage', '-resize', '640x', '-write', 'page_640w.jpg', '-write', 'page_640w.webp',
+            '+delete', ')', '-write', 'page.webp'])
+        # Every file written at its size, from the crop
+        command = ["page.png", "-crop", pynav.crop_geometry(slc), "-write", slc["file"]] + args + ["null:"]
+        self.assertEqual(fake_convert.parse_outputs(command), [("page.jpg", 1280, 100), ("page_640w.jpg", 640, 50),
+            ("page_640w.webp", 640, 50), ("page.webp", 1280, 100)])
+
+
+class ResponsiveBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 2, 64, 250, "png")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, **overrides):
+        values = dict(convert_app=FAKE_CONVERT, inputFormat="png", mobile=True, sliceSize=100, jobs=2, overwrite=True)
+        values.update(overrides)
+        result = pynav.build(pynav.BuildSettings(self.src, self.dest, **values))
+        self.assertEqual(result.errors, [])
+        return result
+
+    def test_backends_write_every_variant(self):
+        backends = [("external", False), ("external", True), ("batch", False)]
+        if pynav.Image is not None:
+            backends.append(("python", False))
+        for backend, single_pass in backends:
+            shutil.rmtree(self.dest, ignore_errors=True)
+            result = self.build(backend=backend, singlePass=single_pass, widths=[32, 128], webp=True)
+            for page in result.pages:
+                base = page["image"][:-4]
+                self.assertEqual(len(page["variants"]), 3)
+                self.assertEqual(page["variants"][1], [{"width": 32, "height": 50, "files": [base + "_slice_1_32w.jpg",
+                    base + "_slice_1_32w.webp"]}, {"width": 64, "height": 100, "files": [base + "_slice_1.webp"]}])
+                for variants in page["variants"]:
+                    for variant in variants:
+                        for name in variant["files"]:
+                            path = os.path.join(self.dest, name)
+                            self.assertTrue(os.path.isfile(path), (backend, name))
+                            if name.endswith(".jpg"):
+                                self.assertEqual(pynav.get_image_size(path), (variant["width"], variant["height"]), backend)
+                with open(os.path.join(self.dest, page["html"])) as f:
+                    html = f.read()
+                self.assertIn("<source type='image/webp' srcset='{0}_slice_1_32w.webp 32w, {0}_slice_1.webp 64w'>".format(base), html)
+                self.assertIn("srcset='{0}_32w.jpg 32w, {0}.jpg 64w'".format(base), html)
+
+    def test_variants_are_cleaned_up_and_zipped(self):
+        self.build(widths=[32], webp=True, incremental=True)
+        variants = [name for name in os.listdir(self.dest) if "_32w" in name or name.endswith(".webp")]
+        self.assertEqual(len(variants), 2 * 3 * 3)
+        result = self.build(incremental=True, zip=True)
+        self.assertEqual([page["status"] for page in result.pages], ["Converted", "Converted"])
+        self.assertEqual([name for name in os.listdir(self.dest) if "_32w" in name or name.endswith(".webp")], [])
+        with open(os.path.join(self.dest, pynav.MANIFEST_FILE_NAME)) as f:
+            self.assertEqual(set(len(page["variants"][0]) for page in json.load(f)["pages"].values()), set([0]))
+
+        result = self.build(widths=[32], webp=True, incremental=True, zip=True)
+        with zipfile.ZipFile(result.zip) as zf:
+            names = zf.namelist()
+        for variants in result.pages[0]["variants"]:
+            for variant in variants:
+                for name in variant["files"]:
+                    self.assertIn(name, names)
+
+
+if __name__ == "__main__":
+    unittest.main()
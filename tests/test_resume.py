@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Build journal, --resume, --timeout and --retries, against benchmarks/fake_convert.py."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class InterruptingBackend(pynav.ExternalConvertBackend):
+    """Stops the build (Ctrl+C) at the conversion of source stop, fails the first attempt of the ones in flaky."""
+
+    def __init__(self, stop=None, flaky=()):
+        pynav.ExternalConvertBackend.__init__(self, FAKE_CONVERT)
+        self.stop = stop
+        self.flaky = set(flaky)
+
+    def convert(self, job, cancel=None):
+        source = os.path.basename(job["source"])
+        if source == self.stop:
+            raise KeyboardInterrupt()
+        if source in self.flaky:
+            self.flaky.discard(source)
+            raise OSError("flaky {0}".format(source))
+        pynav.ExternalConvertBackend.convert(self, job, cancel)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 6, 64, 200, "png")
+        self.env = dict(os.environ)
+        self.retryDelay = pynav.RETRY_DELAY
+        pynav.RETRY_DELAY = 0.01
+
+    def tearDown(self):
+        pynav.RETRY_DELAY = self.retryDelay
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.tmp)
+
+    def build(self, backend=None, **overrides):
+        # One worker, pages are converted in source order
+        settings = dict(convert_app=FAKE_CONVERT, inputFormat="png", mobile=True, sliceSize=100, jobs=1, index=True)
+        settings.update(overrides)
+        return pynav.build(pynav.BuildSettings(self.src, self.dest, **settings), backend=backend)
+
+    def statuses(self, result):
+        return dict((page["source"], page["status"]) for page in result.pages)
+
+    def journal(self):
+        return os.path.join(self.dest, pynav.JOURNAL_FILE_NAME)
+
+    def interrupted_build(self, **overrides):
+        result = self.build(InterruptingBackend(stop="page_004.png"), **overrides)
+        self.assertTrue(result.interrupted)
+        self.assertTrue(os.path.isfile(self.journal()))
+        self.assertFalse(os.path.isfile(os.path.join(self.dest, pynav.MANIFEST_FILE_NAME)))
+
+    def assertResumed(self, result):
+        statuses = self.statuses(result)
+        for n in (1, 2, 3):
+            self.assertEqual(statuses["page_00{0}.png".format(n)], "Html")
+        for n in (4, 5, 6):
+            self.assertEqual(statuses["page_00{0}.png".format(n)], "Converted")
+        self.assertEqual(result.converted, 3)
+        self.assertFalse(os.path.isfile(self.journal()))
+        for n in range(1, 7):
+            self.assertTrue(os.path.isfile(os.path.join(self.dest, "page_00{0}.html".format(n))))
+
+    def test_finished_build_removes_its_journal(self):
+        result = self.build()
+        self.assertEqual(result.converted, 6)
+        self.assertFalse(os.path.isfile(self.journal()))
+
+    def test_resume_converts_only_the_pages_left(self):
+        self.interrupted_build(incremental=True)
+        self.assertResumed(self.build(resume=True))
+
+    def test_resume_with_overwrite(self):
+        self.interrupted_build(overwrite=True)
+        self.assertResumed(self.build(resume=True, overwrite=True))
+
+    def test_without_resume_the_journal_is_not_used(self):
+        self.interrupted_build(incremental=True)
+        result = self.build(overwrite=True)
+        self.assertEqual(result.converted, 6)
+
+    def test_journal_load(self):
+        os.makedirs(self.dest)
+        journal = pynav.BuildJournal(self.dest, "settings")
+        journal.open({"a.png": {"image": "a.jpg"}})
+        journal.record("b.png", {"image": "b.jpg"})
+        journal.close()
+        self.assertEqual(sorted(pynav.BuildJournal(self.dest, "settings").load()), ["a.png", "b.png"])
+        # Other image settings, nothing to resume
+        self.assertEqual(pynav.BuildJournal(self.dest, "other").load(), {})
+        # A line half written when the build died is left out
+        with open(self.journal(), "a") as f:
+            f.write('{"source": "c.png", "pa')
+        self.assertEqual(sorted(pynav.BuildJournal(self.dest, "settings").load()), ["a.png", "b.png"])
+        journal.close(finished=True)
+        self.assertFalse(os.path.isfile(self.journal()))
+
+    def test_retries(self):
+        result = self.build(InterruptingBackend(flaky=["page_002.png"]), retries=1)
+        self.assertEqual(result.errors, [])
+        attempts = dict((page["source"], page["attempts"]) for page in result.pages)
+        self.assertEqual(attempts["page_002.png"], 2)
+        self.assertEqual(attempts["page_001.png"], 1)
+        result = self.build(InterruptingBackend(flaky=["page_002.png"]), overwrite=True)
+        self.assertEqual(result.failed, [os.path.join(self.src, "page_002.png")])
+
+    def test_timeout(self):
+        os.environ["PYNAV_FAKE_CONVERT_LATENCY"] = "5"
+        start = time.time()
+        result = self.build(timeout=0.3, jobs=6, singlePass=True)
+        self.assertLess(time.time() - start, 4)
+        self.assertEqual(len(result.errors), 6)
+        self.assertIn("sin terminar", result.errors[0][1])
+        # Nothing half written under the final names, no temp files left
+        self.assertEqual(sorted(name for name in os.listdir(self.dest) if name.endswith(".jpg")), [])
+        self.assertFalse([name for name in os.listdir(self.dest) if name.startswith(pynav.TEMP_PREFIX)])
+
+    def test_stale_temp_files_are_removed(self):
+        os.makedirs(self.dest)
+        stale = os.path.join(self.dest, pynav.temp_name("page_001.jpg"))
+        with open(stale, "w") as f:
+            f.write("half")
+        self.build(incremental=True)
+        self.assertFalse(os.path.isfile(stale))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""pynav serve: ranges, conditional requests, gzip, rebuilt zips and --tiles subfolders."""
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+class ServeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.site = os.path.join(self.tmp, "site")
+        os.makedirs(self.site)
+        self.files = {
+            "index.html": b"<html>" + b"index " * 500 + b"</html>",
+            "page_0.html": b"<html>page 0</html>",
+            "page_0.jpg": bytes(range(256)) * 8,
+            "0123456789abcdef0123.jpg": b"shared slice",
+            pynav.MANIFEST_FILE_NAME: b"{}",
+        }
+        for name, data in self.files.items():
+            with open(os.path.join(self.site, name), "wb") as f:
+                f.write(data)
+        self.zip = os.path.join(self.tmp, "site.zip")
+        pynav.zip(self.site, self.zip)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def serve(self, path):
+        server = pynav.PreviewServer(path, port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def get(self, server, name, **headers):
+        """Returns (status, headers, body) of a GET of name."""
+        request = urllib.request.Request(server.url + name, headers=headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def check_site(self, server):
+        status, headers, body = self.get(server, "page_0.jpg")
+        self.assertEqual((status, body), (200, self.files["page_0.jpg"]))
+        self.assertEqual(headers["Content-Type"], "image/jpeg")
+        self.assertEqual(headers["Cache-Control"], "no-cache")
+        etag, lastModified = headers["ETag"], headers["Last-Modified"]
+
+        # Single byte ranges
+        status, headers, body = self.get(server, "page_0.jpg", Range="bytes=10-19")
+        self.assertEqual((status, body), (206, self.files["page_0.jpg"][10:20]))
+        self.assertEqual(headers["Content-Range"], "bytes 10-19/2048")
+        status, headers, body = self.get(server, "page_0.jpg", Range="bytes=-5")
+        self.assertEqual((status, body), (206, self.files["page_0.jpg"][-5:]))
+        status, headers, body = self.get(server, "page_0.jpg", Range="bytes=2040-")
+        self.assertEqual((status, body), (206, self.files["page_0.jpg"][2040:]))
+        status, headers, body = self.get(server, "page_0.jpg", Range="bytes=4096-")
+        self.assertEqual((status, body), (416, b""))
+        self.assertEqual(headers["Content-Range"], "bytes */2048")
+        # A stale If-Range gets the whole file
+        status, headers, body = self.get(server, "page_0.jpg", Range="bytes=0-9", **{"If-Range": '"other"'})
+        self.assertEqual((status, len(body)), (200, 2048))
+
+        # Conditional requests
+        self.assertEqual(self.get(server, "page_0.jpg", **{"If-None-Match": etag})[0], 304)
+        self.assertEqual(self.get(server, "page_0.jpg", **{"If-None-Match": '"other", ' + etag})[0], 304)
+        self.assertEqual(self.get(server, "page_0.jpg", **{"If-None-Match": '"other"'})[0], 200)
+        self.assertEqual(self.get(server, "page_0.jpg", **{"If-Modified-Since": lastModified})[0], 304)
+        self.assertEqual(self.get(server, "page_0.jpg", **{"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})[0], 200)
+
+        # Text is gzipped on the fly, with its own ETag
+        status, headers, body = self.get(server, "index.html", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertTrue(headers["ETag"].endswith('-gz"'))
+        self.assertEqual(gzip.decompress(body), self.files["index.html"])
+        self.assertLess(len(body), len(self.files["index.html"]))
+        self.assertEqual(self.get(server, "index.html", **{"If-None-Match": headers["ETag"]})[0], 304)
+        status, headers, body = self.get(server, "index.html")
+        self.assertIsNone(headers["Content-Encoding"])
+        self.assertFalse(headers["ETag"].endswith('-gz"'))
+        self.assertEqual(body, self.files["index.html"])
+        # Images are not
+        status, headers, body = self.get(server, "page_0.jpg", **{"Accept-Encoding": "gzip"})
+        self.assertIsNone(headers["Content-Encoding"])
+        self.assertEqual(body, self.files["page_0.jpg"])
+
+        # Content-addressed names never change
+        self.assertEqual(self.get(server, "0123456789abcdef0123.jpg")[1]["Cache-Control"],
+            "public, max-age=31536000, immutable")
+        # The root is the index, no manifest, subpaths or missing files
+        self.assertEqual(self.get(server, "")[2], self.files["index.html"])
+        for name in (pynav.MANIFEST_FILE_NAME, "../index.html", "sub/page_0.jpg", "%2e%2e%2findex.html", "missing.jpg"):
+            self.assertEqual(self.get(server, name)[0], 404, name)
+
+    def test_folder(self):
+        self.check_site(self.serve(self.site))
+
+    def test_zip(self):
+        self.check_site(self.serve(self.zip))
+
+    def test_listing_without_an_index(self):
+        os.remove(os.path.join(self.site, "index.html"))
+        status, headers, body = self.get(self.serve(self.site), "")
+        self.assertEqual(status, 200)
+        self.assertIn(b"<a href='page_0.html'>", body)
+        self.assertNotIn(b"page_0.jpg", body)
+
+    def test_not_a_site(self):
+        with self.assertRaises(pynav.PynavError):
+            pynav.get_site(os.path.join(self.site, "page_0.jpg"))
+
+    def rezip(self, data, n):
+        """Replaces the zip with one whose page_0.html is data, like a rebuild does."""
+        with open(os.path.join(self.site, "page_0.html"), "wb") as f:
+            f.write(data)
+        pynav.zip(self.site, self.zip + ".new")
+        os.replace(self.zip + ".new", self.zip)
+        # A new mtime even on coarse clocks
+        st = os.stat(self.zip)
+        os.utime(self.zip, ns=(st.st_atime_ns, st.st_mtime_ns + n * 10 ** 9))
+
+    def test_rebuilt_zip_is_served(self):
+        server = self.serve(self.zip)
+        self.assertEqual(self.get(server, "page_0.html")[2], b"<html>page 0</html>")
+        fds = open_fds()
+        for n in range(1, 11):
+            self.rezip("<html>build {0}</html>".format(n).encode("ascii"), n)
+            self.assertEqual(self.get(server, "page_0.html")[2], "<html>build {0}</html>".format(n).encode("ascii"))
+        # The replaced archives are closed
+        self.assertLessEqual(open_fds(), fds + 1)
+
+    def test_replaced_archive_closes_after_its_last_request(self):
+        site = pynav.ZipSite(self.zip)
+        self.addCleanup(site.close)
+        inFlight = site.get("page_0.jpg")
+        old = site._archive.zf
+        self.rezip(b"<html>new</html>", 1)
+        current = site.get("page_0.html")
+        self.assertEqual(b"".join(current.read(0, 15)), b"<html>new</html>")
+        current.close()
+        # Still readable by the request that started before the swap
+        self.assertIsNotNone(old.fp)
+        self.assertEqual(b"".join(inFlight.read(0, 2047)), self.files["page_0.jpg"])
+        inFlight.close()
+        self.assertIsNone(old.fp)
+        # Closing twice does not release twice
+        inFlight.close()
+        self.assertEqual(site._archive.users, 0)
+
+    def test_half_written_zip_keeps_the_last_good_one(self):
+        server = self.serve(self.zip)
+        with open(self.zip + ".new", "wb") as f:
+            f.write(b"PK not yet")
+        os.replace(self.zip + ".new", self.zip)
+        self.assertEqual(self.get(server, "page_0.html")[2], b"<html>page 0</html>")
+
+    def test_serves_a_build(self):
+        src = os.path.join(self.tmp, "src")
+        synthetic.make_project(src, 2, 64, 120, "png")
+        result = pynav.build(pynav.BuildSettings(src, os.path.join(self.tmp, "out"), convert_app=FAKE_CONVERT,
+            inputFormat="png", index=True, zip=True))
+        for path in (result.destination, result.zip):
+            server = self.serve(path)
+            for page in result.pages:
+                status, headers, body = self.get(server, page["html"])
+                self.assertEqual(status, 200, path)
+                with open(os.path.join(result.destination, page["html"]), "rb") as f:
+                    self.assertEqual(body, f.read())
+
+
+@unittest.skipIf(pynav.Image is None, "--tiles needs Pillow")
+class ServeTilesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        src = os.path.join(cls.tmp, "src")
+        synthetic.make_project(src, 1, 600, 300, "png")
+        cls.result = pynav.build(pynav.BuildSettings(src, os.path.join(cls.tmp, "out"), convert_app=FAKE_CONVERT,
+            inputFormat="png", tiles=256, zip=True))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    serve = ServeTest.serve
+    get = ServeTest.get
+
+    def check(self, server):
+        page = self.result.pages[0]
+        html = os.path.splitext(page["source"])[0] + ".html"
+        tiles = pynav.tile_files(page["tiles"])
+        self.assertTrue(any("/" in name for name in tiles))
+        for name in [html] + tiles:
+            self.assertEqual(self.get(server, name)[0], 200, name)
+        folder = os.path.splitext(page["tiles"]["dzi"])[0] + "_files"
+        for name in (pynav.MANIFEST_FILE_NAME, folder + "/../" + html, folder + "//0/0_0.png",
+                folder + "/%2e%2e/" + html, "%2fetc/passwd", folder + "/0/..%5c..%5c" + html,
+                folder + "/0/missing.png"):
+            self.assertEqual(self.get(server, name)[0], 404, name)
+
+    def test_folder(self):
+        self.check(self.serve(self.result.destination))
+
+    def test_zip(self):
+        self.check(self.serve(self.result.zip))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--single-pass slicing, running pynav.py against benchmarks/fake_convert.py."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class SinglePassTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(self.src)
+        synthetic.write_png(os.path.join(self.src, "tall.png"), 40, 450)
+        synthetic.write_png(os.path.join(self.src, "short.png"), 40, 60)
+        self.bin = os.path.join(self.tmp, "bin")
+        os.makedirs(self.bin)
+        os.symlink(FAKE_CONVERT, os.path.join(self.bin, "convert"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def pynav(self, dest, *args):
+        environ = dict(os.environ, PATH=self.bin + os.pathsep + os.environ["PATH"], PYNAV_FAKE_CONVERT_LATENCY="0.3")
+        start = time.time()
+        subprocess.check_call([sys.executable, PYNAV, self.src, os.path.join(self.tmp, dest), "-if", "png", "-m",
+            "-slc", "100", "-j", "1"] + list(args), env=environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return time.time() - start
+
+    def outputs(self, dest):
+        """Returns the size of every image and the content of every html of dest."""
+        outputs = {}
+        for name in os.listdir(os.path.join(self.tmp, dest)):
+            path = os.path.join(self.tmp, dest, name)
+            if name.endswith(".jpg"):
+                outputs[name] = pynav.get_image_size(path)
+            else:
+                with open(path, "rb") as f:
+                    outputs[name] = f.read()
+        return outputs
+
+    def test_same_outputs_as_one_call_per_slice(self):
+        perSlice = self.pynav("per_slice")
+        singlePass = self.pynav("single_pass", "--single-pass")
+        outputs = self.outputs("per_slice")
+        self.assertEqual(outputs, self.outputs("single_pass"))
+        self.assertEqual(sorted(name for name in outputs if name.startswith("tall")), ["tall.html", "tall.jpg",
+            "tall_slice_1.jpg", "tall_slice_2.jpg", "tall_slice_3.jpg", "tall_slice_4.jpg"])
+        self.assertEqual(outputs["tall_slice_4.jpg"], (40, 50))
+        # One convert call per page instead of one per slice
+        self.assertLess(singlePass, perSlice / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Source discovery: natural order, extension aliases, --include/--exclude and --recursive."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def touch(self, *names):
+        for name in names:
+            path = os.path.join(self.tmp, *name.split("/"))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+
+    def scan(self, image_format="psd", **options):
+        return [pynav.source_name(path, self.tmp) for path in pynav.get_files_from_folder(self.tmp, image_format, **options)]
+
+    def test_natural_key(self):
+        self.assertEqual(sorted(["page_10", "Page_9", "page_2", "page_1b", "page_1a"], key=pynav.natural_key),
+            ["page_1a", "page_1b", "page_2", "Page_9", "page_10"])
+
+    def test_natural_order_and_extensions(self):
+        self.touch("page_10.psd", "page_2.PSD", "page_1.psd", "notes.txt", "page_3.psd.bak", "cover.psb")
+        os.makedirs(os.path.join(self.tmp, "folder.psd"))
+        self.assertEqual(self.scan(), ["page_1.psd", "page_2.PSD", "page_10.psd"])
+
+    def test_extension_aliases(self):
+        self.touch("a.jpg", "b.JPEG", "c.tif", "d.tiff", "e.png")
+        self.assertEqual(self.scan("jpeg"), ["a.jpg", "b.JPEG"])
+        self.assertEqual(self.scan("jpg"), ["a.jpg", "b.JPEG"])
+        self.assertEqual(self.scan(".tif"), ["c.tif", "d.tiff"])
+        self.assertEqual(self.scan("png"), ["e.png"])
+
+    def test_subfolders_only_with_recursive(self):
+        self.touch("page_1.psd", "chapter_2/page_1.psd", "chapter_10/page_1.psd", "chapter_2/part_1/page_1.psd",
+            "chapter_2/page_2.psd", ".cache/page_1.psd")
+        self.assertEqual(self.scan(), ["page_1.psd"])
+        # Depth first, the files of a folder before its subfolders, no hidden folders
+        self.assertEqual(self.scan(recursive=True), ["page_1.psd", "chapter_2/page_1.psd", "chapter_2/page_2.psd",
+            "chapter_2/part_1/page_1.psd", "chapter_10/page_1.psd"])
+
+    def test_recursive_skips_pynav_destinations(self):
+        self.touch("page_1.psd", "chapter_1/page_1.psd", "old_build/page_1.psd", "old_build/" + pynav.MANIFEST_FILE_NAME,
+            "old_build/sub/page_1.psd")
+        self.assertEqual(self.scan(recursive=True), ["page_1.psd", "chapter_1/page_1.psd"])
+        # A manifest in the source folder itself does not hide it
+        self.touch(pynav.MANIFEST_FILE_NAME)
+        self.assertEqual(self.scan(recursive=True), ["page_1.psd", "chapter_1/page_1.psd"])
+
+    def test_include_and_exclude(self):
+        self.touch("page_1.psd", "page_2.psd", "draft_1.psd", "chapter_1/page_1.psd", "chapter_1/draft_2.psd",
+            "extras/page_1.psd")
+        self.assertEqual(self.scan(include=["page_*"]), ["page_1.psd", "page_2.psd"])
+        self.assertEqual(self.scan(recursive=True, exclude=["draft_*"]), ["page_1.psd", "page_2.psd",
+            "chapter_1/page_1.psd", "extras/page_1.psd"])
+        # Relative paths, an excluded folder is not entered
+        self.assertEqual(self.scan(recursive=True, include=["chapter_1/*"]), ["chapter_1/draft_2.psd", "chapter_1/page_1.psd"])
+        self.assertEqual(self.scan(recursive=True, exclude=["extras", "*/draft_*"]), ["draft_1.psd", "page_1.psd",
+            "page_2.psd", "chapter_1/page_1.psd"])
+        self.assertEqual(self.scan(recursive=True, include=["page_*"], exclude=["chapter_1/*"]), ["page_1.psd",
+            "page_2.psd", "extras/page_1.psd"])
+
+    def test_entries_carry_their_stat(self):
+        synthetic.write_png(os.path.join(self.tmp, "page_1.png"), 8, 8)
+        entry, = pynav.scan_sources(self.tmp, "png")
+        self.assertEqual(entry.stat().st_size, os.stat(entry.path).st_size)
+
+
+class RecursiveBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        for name in ("page_10.png", "page_9.png", "chapter_2/page_1.png", "chapter_10/page_1.png"):
+            path = os.path.join(self.src, *name.split("/"))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            synthetic.write_png(path, 16, 16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, dest, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, dest, convert_app=FAKE_CONVERT, inputFormat="png",
+            index=True, recursive=True, **settings))
+
+    def test_sections_and_names(self):
+        result = self.build(os.path.join(self.tmp, "out"))
+        self.assertEqual([page["source"] for page in result.pages], ["page_9.png", "page_10.png",
+            "chapter_2/page_1.png", "chapter_10/page_1.png"])
+        self.assertEqual([page["html"] for page in result.pages], ["page_9.html", "page_10.html",
+            "chapter_2_page_1.html", "chapter_10_page_1.html"])
+        with open(os.path.join(result.destination, "index.html")) as f:
+            index = f.read()
+        self.assertLess(index.index("page_10.html"), index.index("<b>chapter_2</b>"))
+        self.assertLess(index.index("<b>chapter_2</b>"), index.index("chapter_2_page_1.html"))
+        self.assertLess(index.index("chapter_2_page_1.html"), index.index("<b>chapter_10</b>"))
+
+    def test_destination_inside_the_source(self):
+        # The build of a png project writes pngs into the source tree
+        dest = os.path.join(self.src, "out")
+        first = self.build(dest, outputFormat="png")
+        self.assertEqual(len(first.pages), 4)
+        # Neither the current destination nor an earlier one (it has a manifest) become sources
+        shutil.copytree(dest, os.path.join(self.src, "old_out"))
+        again = self.build(dest, outputFormat="png", incremental=True)
+        self.assertEqual([page["source"] for page in again.pages], [page["source"] for page in first.pages])
+        self.assertEqual(set(page["status"] for page in again.pages), set(["Skip"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Compiled html templates against the old chain of str.replace calls."""
+
+import os
+import re
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+from bench_templates import render_replace
+
+SLICE_TAGS_SHEET = ("<html><title>[pynav-title]</title><body>"
+    "<img class='a' src='[pynav-img]'>"
+    "<img class='b' src='[pynav-img-slice-1]'>"
+    "<img class='c' src='[pynav-img-slice-2]'>"
+    "<a href='[pynav-next-html]'>next</a></body></html>")
+
+PICTURE_SLICE_TAGS_SHEET = ("<body>"
+    "<picture>[pynav-img-sources]<img src='[pynav-img]' srcset='[pynav-img-srcset]'></picture>"
+    "<picture>[pynav-img-sources]<img src='[pynav-img-slice-1]' srcset='[pynav-img-srcset]'></picture>"
+    "</body>")
+
+
+def slices(count):
+    return ["page_slice_{0}.jpg".format(n) for n in range(count)]
+
+def variants(slice_images, widths, webp):
+    return [pynav.slice_variants({"file": img, "width": 1280, "height": 100}, widths, webp) for img in slice_images]
+
+def render_replace_responsive(template, mobile, title, css, width, height, nextHtmlFile, slice_images, slice_variants=None):
+    """render_replace plus the responsive tags, each <img> or <picture> copy filled with the values of its slice."""
+    def fill(text, n):
+        values = pynav.responsive_values(slice_images[n], slice_variants[n] if slice_variants else None, width)
+        for name, value in values.items():
+            text = text.replace("[pynav-{0}]".format(name), value)
+        return text
+    tags = render_replace(template, False, title, css, width, height, nextHtmlFile, ["[pynav-img]"])
+    if mobile:
+        block = re.search(r"<picture\b.*?</picture>|<[^>]+\[pynav-img\][^>]+>", tags, re.S).group()
+        return tags.replace(block, "".join(fill(block, n).replace("[pynav-img]", img) for n, img in enumerate(slice_images)))
+    return fill(tags, 0).replace("[pynav-img]", slice_images[0])
+
+
+class TemplateTest(unittest.TestCase):
+
+    def render(self, text, mobile, slice_images, slice_variants=None):
+        args = (mobile, "Pynav", "body { margin: 0; }", "1280", "9000", "page_2.html", slice_images, slice_variants)
+        return render_replace_responsive(text, *args), pynav.render_html_page(pynav.compile_template(text), *args)
+
+    def test_desktop_sheet(self):
+        for count in (1, 3):
+            for slice_variants in (None, variants(slices(count), [640], True)):
+                old, new = self.render(pynav.default_sheets()["desktop"], False, slices(count), slice_variants)
+                self.assertEqual(new, old)
+                self.assertIn("page_slice_0.jpg", new)
+                self.assertNotIn("[pynav-", new)
+        self.assertIn("image-set(url('page_slice_0.webp') type('image/webp'), url('page_slice_0.jpg') type('image/jpeg'))", new)
+
+    def test_mobile_sheet_repeats_the_picture(self):
+        for count in (1, 2, 8):
+            for slice_variants in (None, variants(slices(count), [640], False), variants(slices(count), [320, 640], True)):
+                old, new = self.render(pynav.default_sheets()["mobile"], True, slices(count), slice_variants)
+                self.assertEqual(new, old)
+                self.assertEqual(new.count("<picture>"), count)
+                self.assertEqual(new.count("<img "), count)
+                self.assertNotIn("[pynav-", new)
+        self.assertIn("<picture><source type='image/webp' srcset='page_slice_7_320w.webp 320w, page_slice_7_640w.webp 640w, "
+            "page_slice_7.webp 1280w'><img class='pynav-img-class' src='page_slice_7.jpg' "
+            "srcset='page_slice_7_320w.jpg 320w, page_slice_7_640w.jpg 640w, page_slice_7.jpg 1280w'></picture>", new)
+
+    def test_compiled_once(self):
+        sheet = pynav.default_sheets()["mobile"]
+        self.assertIs(pynav.compile_template(sheet), pynav.compile_template(sheet))
+
+    def test_slice_tags(self):
+        template = pynav.compile_template(SLICE_TAGS_SHEET)
+        # Missing slices drop their tag
+        html = pynav.render_html_page(template, True, "T", "", "1", "1", "n.html", slices(1))
+        self.assertEqual(html.count("<img "), 1)
+        self.assertIn("src='page_slice_0.jpg'", html)
+        self.assertNotIn("class='b'", html)
+        self.assertNotIn("class='c'", html)
+        # More slices than tags, the last tag is repeated
+        html = pynav.render_html_page(template, True, "T", "", "1", "1", "n.html", slices(5))
+        self.assertEqual(html.count("<img class='c'"), 3)
+        self.assertLess(html.index("page_slice_2.jpg"), html.index("page_slice_3.jpg"))
+        self.assertLess(html.index("page_slice_3.jpg"), html.index("page_slice_4.jpg"))
+        self.assertNotIn("[pynav-", html)
+
+    def test_slice_tags_in_pictures(self):
+        template = pynav.compile_template(PICTURE_SLICE_TAGS_SHEET)
+        # The <picture> of a missing slice goes as a whole
+        html = pynav.render_html_page(template, True, "T", "", "1280", "1", "n.html", slices(1))
+        self.assertEqual(html, "<body><picture><img src='page_slice_0.jpg' srcset='page_slice_0.jpg 1280w'></picture></body>")
+        html = pynav.render_html_page(template, True, "T", "", "1280", "1", "n.html", slices(3), variants(slices(3), [], True))
+        self.assertEqual(html.count("<picture>"), 3)
+        for n in range(3):
+            self.assertIn("<source type='image/webp' srcset='page_slice_{0}.webp 1280w'><img src='page_slice_{0}.jpg'".format(n), html)
+
+    def test_unknown_tags_are_left(self):
+        html = pynav.compile_template("<p>[pynav-title] [pynav-other]</p>").render({"title": "T"})
+        self.assertEqual(html, "<p>T [pynav-other]</p>")
+
+    def test_index(self):
+        link = "<li><a href='page_0.html'>page_0</a></li>"
+        html = pynav.compile_template(pynav.default_sheets()["index"]).render({"title": "Pynav", "css": "", "page-link": link})
+        self.assertIn(link, html)
+        self.assertIn("Index of Pynav", html)
+        self.assertNotIn("[pynav-", html)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--tiles: deep zoom levels, the tiles of a page and tiled builds on every backend."""
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def listed(folder):
+    """Returns the "/" separated paths of the files below folder."""
+    names = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            names.append(os.path.relpath(os.path.join(root, name), folder).replace(os.sep, "/"))
+    return sorted(names)
+
+
+class LevelsTest(unittest.TestCase):
+
+    def test_tile_levels(self):
+        self.assertEqual(pynav.tile_levels(1, 1), [(1, 1)])
+        self.assertEqual(pynav.tile_levels(600, 300), [(1, 1), (2, 1), (3, 2), (5, 3), (10, 5), (19, 10),
+            (38, 19), (75, 38), (150, 75), (300, 150), (600, 300)])
+        # A power of two side takes no extra level
+        self.assertEqual(len(pynav.tile_levels(256, 256)), 9)
+
+    def test_tile_files(self):
+        tiles = {"dzi": "page.dzi", "size": 256, "format": "jpg", "width": 600, "height": 300}
+        names = pynav.tile_files(tiles)
+        self.assertEqual(names[0], "page.dzi")
+        # 3 x 2 tiles at full size, 2 x 1 at the half, one for the smaller levels
+        self.assertEqual(names[-6:], ["page_files/10/{0}_{1}.jpg".format(column, row) for row in range(2) for column in range(3)])
+        self.assertEqual(len(names), 1 + 9 + 2 + 6)
+
+
+@unittest.skipIf(pynav.Image is None, "--tiles needs Pillow")
+class WriteTilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_pyramid(self):
+        image = pynav.Image.new("RGBA", (600, 300), (10, 20, 30, 255))
+        tiles = pynav.write_tiles(image, os.path.join(self.tmp, "page.jpg"), "JPG", 80, 256)
+        self.assertEqual(tiles, {"dzi": "page.dzi", "size": 256, "format": "jpg", "width": 600, "height": 300,
+            "levels": 11, "placeholder": 8})
+        self.assertEqual(listed(self.tmp), sorted(pynav.tile_files(tiles) + ["page.jpg"]))
+        # The placeholder is the largest level in one tile, tiles at the edges are cut short
+        self.assertEqual(pynav.get_image_size(os.path.join(self.tmp, "page.jpg")), (150, 75))
+        self.assertEqual(pynav.get_image_size(os.path.join(self.tmp, "page_files", "10", "2_1.jpg")), (88, 44))
+        with open(os.path.join(self.tmp, "page.dzi")) as f:
+            dzi = f.read()
+        self.assertIn("TileSize='256'", dzi)
+        self.assertIn("Width='600' Height='300'", dzi)
+
+
+@unittest.skipIf(pynav.Image is None, "--tiles needs Pillow")
+class TilesBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        synthetic.make_project(self.src, 2, 600, 300, "png")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, name, **settings):
+        return pynav.build(pynav.BuildSettings(self.src, os.path.join(self.tmp, name), convert_app=FAKE_CONVERT,
+            inputFormat="png", tiles=256, **settings))
+
+    def test_every_backend(self):
+        for backend in pynav.CONVERT_BACKENDS:
+            result = self.build(backend, backend=backend)
+            self.assertEqual(result.errors, [], backend)
+            names = []
+            for page in result.pages:
+                self.assertEqual(page["tiles"]["levels"], 11, backend)
+                self.assertEqual(pynav.get_image_size(os.path.join(result.destination, page["slices"][0])), (150, 75))
+                names += pynav.get_page_outputs("", page)
+                with open(os.path.join(result.destination, page["html"])) as f:
+                    html = f.read()
+                self.assertIn('"folder": "{0}_files"'.format(os.path.splitext(page["slices"][0])[0]), html)
+            self.assertEqual(listed(result.destination), sorted(set(names + [pynav.MANIFEST_FILE_NAME])), backend)
+
+    def test_incremental_and_zip(self):
+        result = self.build("out", zip=True)
+        again = self.build("out", zip=True, incremental=True)
+        self.assertEqual([page["status"] for page in again.pages], ["Skip"] * 2)
+        self.assertEqual([page["tiles"] for page in again.pages], [page["tiles"] for page in result.pages])
+        with zipfile.ZipFile(again.zip) as zf:
+            self.assertTrue(set(pynav.tile_files(again.pages[0]["tiles"])) <= set(zf.namelist()))
+
+    def test_not_with_the_viewer(self):
+        with self.assertRaises(pynav.PynavError):
+            self.build("out", viewer=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--trace and --profile: the Tracer and the spans of a build."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_spans_from_threads(self):
+        tracer = pynav.Tracer()
+        def work(n):
+            with tracer.span("page_{0}".format(n), "convert", source="page_{0}".format(n)) as args:
+                args["exitCode"] = 0
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(event["name"] for event in tracer.events), ["page_0", "page_1", "page_2", "page_3"])
+        for event in tracer.events:
+            self.assertEqual((event["cat"], event["ph"], event["args"]["exitCode"]), ("convert", "X", 0))
+            self.assertGreaterEqual(event["dur"], 0)
+
+    def test_failed_block_is_still_timed(self):
+        tracer = pynav.Tracer()
+        with self.assertRaises(ValueError):
+            with tracer.span("page", "probe"):
+                raise ValueError()
+        self.assertEqual([event["cat"] for event in tracer.events], ["probe"])
+
+    def test_disabled(self):
+        with pynav.NULL_TRACER.span("page", "convert") as args:
+            args["exitCode"] = 0
+        self.assertEqual(pynav.NULL_TRACER.events, [])
+
+    def test_write_json_and_jsonl(self):
+        tracer = pynav.Tracer()
+        for stage in ("scan", "convert"):
+            with tracer.span("page", stage):
+                pass
+        tracer.write(os.path.join(self.tmp, "trace.json"))
+        with open(os.path.join(self.tmp, "trace.json")) as f:
+            trace = json.load(f)
+        self.assertEqual([event["cat"] for event in trace["traceEvents"]], ["scan", "convert"])
+        tracer.write(os.path.join(self.tmp, "trace.jsonl"))
+        with open(os.path.join(self.tmp, "trace.jsonl")) as f:
+            self.assertEqual([json.loads(line)["cat"] for line in f], ["scan", "convert"])
+
+    def test_summary(self):
+        tracer = pynav.Tracer()
+        tracer.events = [
+            {"name": "a", "cat": "convert", "dur": 3e6, "args": {"source": "a.png"}},
+            {"name": "b", "cat": "convert", "dur": 1e6, "args": {"source": "b.png"}},
+            {"name": "a", "cat": "hash", "dur": 0.5e6, "args": {"source": "a.png"}},
+        ]
+        lines = tracer.summary().splitlines()
+        self.assertEqual(lines[1].split(), ["convert", "4.000", "2", "2000.00"])
+        self.assertEqual(lines[2].split(), ["hash", "0.500", "1", "500.00"])
+        self.assertEqual([line.split()[0] for line in lines[lines.index("Slowest sources       time (s)") + 1:]],
+            ["a.png", "b.png"])
+
+
+class BuildTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 3, 32, 250, "png")
+        self.bin = os.path.join(self.tmp, "bin")
+        os.makedirs(self.bin)
+        os.symlink(FAKE_CONVERT, os.path.join(self.bin, "convert"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_build_spans(self):
+        trace = os.path.join(self.tmp, "trace.json")
+        result = subprocess.run([sys.executable, PYNAV, self.src, self.dest, "-if", "png", "-m", "-slc", "100",
+            "-j", "2", "-index", "-z", "-tr", trace, "-prof"], env=dict(os.environ, PATH=self.bin + os.pathsep + os.environ["PATH"]),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        with open(trace) as f:
+            events = json.load(f)["traceEvents"]
+        stages = set(event["cat"] for event in events)
+        self.assertTrue(set(["scan", "probe", "hash", "convert", "render", "write", "index", "zip"]) <= stages, stages)
+        converts = [event for event in events if event["cat"] == "convert"]
+        # One call per slice, 3 slices per page
+        self.assertEqual(len(converts), 9)
+        for event in converts:
+            self.assertEqual(event["args"]["exitCode"], 0)
+            self.assertEqual(len(event["args"]["slices"]), 1)
+        # --profile
+        self.assertIn("Slowest sources", result.stdout)
+        for n in range(3):
+            self.assertIn("page_00{0}.png".format(n + 1), result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--viewer: viewer.html and pages.json."""
+
+import os
+import re
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class ViewerPageTest(unittest.TestCase):
+
+    def test_page_item(self):
+        entry = {"image": "page.jpg", "html": "page.html", "width": "64", "height": "250",
+            "slices": ["page.jpg", "page_slice_1.jpg", "page_slice_2.jpg"]}
+        self.assertEqual(pynav.viewer_page(entry, 100.0), {"name": "page", "html": "page.html", "width": 64, "height": 250,
+            "slices": [{"src": "page.jpg", "width": 64, "height": 100}, {"src": "page_slice_1.jpg", "width": 64, "height": 100},
+                {"src": "page_slice_2.jpg", "width": 64, "height": 50}]})
+
+    def test_srcset_and_webp(self):
+        slc = {"file": "page.jpg", "x": 0, "y": 0, "width": 64, "height": 100}
+        entry = {"image": "page.jpg", "html": None, "width": "64", "height": "100", "slices": ["page.jpg"],
+            "variants": [pynav.slice_variants(slc, [32], True)]}
+        item = pynav.viewer_page(entry, 100.0)["slices"][0]
+        self.assertEqual(item["srcset"], "page_32w.jpg 32w, page.jpg 64w")
+        self.assertEqual(item["webp"], "page_32w.webp 32w, page.webp 64w")
+
+
+class ViewerBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        synthetic.make_project(self.src, 3, 64, 250, "png")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, **overrides):
+        values = dict(convert_app=FAKE_CONVERT, inputFormat="png", mobile=True, sliceSize=100, jobs=2, viewer=True)
+        values.update(overrides)
+        return pynav.build(pynav.BuildSettings(self.src, self.dest, **values))
+
+    def inline_pages(self):
+        with open(os.path.join(self.dest, pynav.VIEWER_PAGE_NAME)) as f:
+            html = f.read()
+        script = re.search(r"<script id='pynav-pages' type='application/json'>(.*?)</script>", html, re.S).group(1)
+        return html, json.loads(script)
+
+    def test_viewer_and_pages_json(self):
+        result = self.build(title="</script> mockup", zip=True, webp=True)
+        self.assertEqual(result.viewer, os.path.join(self.dest, pynav.VIEWER_PAGE_NAME))
+        with open(os.path.join(self.dest, pynav.VIEWER_PAGES_NAME)) as f:
+            pages = json.load(f)
+        # The same list inline, where the title cannot close the script
+        html, inline = self.inline_pages()
+        self.assertEqual(inline, pages)
+        self.assertNotIn("</script> mockup", html.split("<script id='pynav-pages'")[1].split("</script>")[0])
+        self.assertEqual((pages["title"], pages["mobile"]), ("</script> mockup", True))
+        # In source order, linked to their htmls
+        self.assertEqual([page["source"] for page in result.pages], [page["name"] + ".png" for page in pages["pages"]])
+        self.assertIn("href='{0}'".format(pages["pages"][0]["html"]), html)
+        for page in pages["pages"]:
+            self.assertEqual([slc["height"] for slc in page["slices"]], [100, 100, 50])
+            self.assertEqual(page["slices"][0]["webp"], page["name"] + ".webp 64w")
+            for slc in page["slices"]:
+                self.assertTrue(os.path.isfile(os.path.join(self.dest, slc["src"])))
+        with zipfile.ZipFile(result.zip) as zf:
+            self.assertTrue(set([pynav.VIEWER_PAGE_NAME, pynav.VIEWER_PAGES_NAME]) <= set(zf.namelist()))
+
+    def test_skipped_pages_stay_in_the_viewer(self):
+        self.build(incremental=True)
+        synthetic.write_png(os.path.join(self.src, "page_002.png"), 64, 400, gray=0x20)
+        result = self.build(incremental=True)
+        self.assertEqual(sorted(page["status"] for page in result.pages), ["Converted", "Skip", "Skip"])
+        html, inline = self.inline_pages()
+        self.assertEqual(len(inline["pages"]), 3)
+        page = [page for page in inline["pages"] if page["name"] == "page_002"][0]
+        self.assertEqual(len(page["slices"]), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""--watch: folder watchers, cancelled conversions and debounced rebuilds."""
+
+import os
+import re
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+import concurrent.futures
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+def wait_for(condition, timeout=10):
+    """Polls condition until it is true, fails after timeout seconds."""
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.05)
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        synthetic.write_png(os.path.join(self.tmp, "a.png"), 8, 8)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check_watcher(self, watcher):
+        try:
+            self.assertEqual(watcher.wait(0.2), set())
+            synthetic.write_png(os.path.join(self.tmp, "b.png"), 8, 8)
+            self.assertEqual(watcher.wait(2), set(["b.png"]))
+            os.rename(os.path.join(self.tmp, "a.png"), os.path.join(self.tmp, "c.png"))
+            changed = set()
+            while changed != set(["a.png", "c.png"]):
+                names = watcher.wait(2)
+                self.assertTrue(names)
+                changed |= names
+            os.remove(os.path.join(self.tmp, "b.png"))
+            self.assertEqual(watcher.wait(2), set(["b.png"]))
+        finally:
+            watcher.close()
+
+    def check_recursive(self, watcher):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        os.makedirs(os.path.join(outside, "new"))
+        synthetic.write_png(os.path.join(outside, "new", "x.png"), 8, 8)
+        try:
+            synthetic.write_png(os.path.join(self.tmp, "chapter", "a.png"), 8, 8, gray=1)
+            self.assertEqual(watcher.wait(2), set(["chapter/a.png"]))
+            # A folder moved in comes with its files, and is watched from then on
+            os.rename(os.path.join(outside, "new"), os.path.join(self.tmp, "chapter", "new"))
+            self.assertEqual(watcher.wait(2), set(["chapter/new/x.png"]))
+            synthetic.write_png(os.path.join(self.tmp, "chapter", "new", "y.png"), 8, 8)
+            self.assertEqual(watcher.wait(2), set(["chapter/new/y.png"]))
+            # Moved out, its files are gone
+            os.rename(os.path.join(self.tmp, "chapter", "new"), os.path.join(outside, "new"))
+            changed = watcher.wait(2)
+            self.assertTrue(changed)
+            self.assertTrue(all(name.startswith("chapter/new/") for name in changed), changed)
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        self.check_watcher(pynav.PollingWatcher(self.tmp, interval=0.05))
+
+    def test_polling_watcher_recursive(self):
+        os.makedirs(os.path.join(self.tmp, "chapter"))
+        self.check_recursive(pynav.PollingWatcher(self.tmp, interval=0.05, recursive=True))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify")
+    def test_inotify_watcher(self):
+        self.check_watcher(pynav.InotifyWatcher(self.tmp))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify")
+    def test_inotify_watcher_recursive(self):
+        os.makedirs(os.path.join(self.tmp, "chapter"))
+        self.check_recursive(pynav.InotifyWatcher(self.tmp, recursive=True))
+
+    def test_subfolders_only_with_recursive(self):
+        os.makedirs(os.path.join(self.tmp, "chapter"))
+        watcher = pynav.PollingWatcher(self.tmp, interval=0.05)
+        try:
+            synthetic.write_png(os.path.join(self.tmp, "chapter", "a.png"), 8, 8)
+            self.assertEqual(watcher.wait(0.3), set())
+        finally:
+            watcher.close()
+
+
+class CancelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "page.png")
+        synthetic.write_png(self.source, 8, 300)
+        self.env = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.tmp)
+
+    def test_external_backend_kills_convert(self):
+        os.environ["PYNAV_FAKE_CONVERT_LATENCY"] = "5"
+        cancel = threading.Event()
+        threading.Timer(0.3, cancel.set).start()
+        start = time.time()
+        with self.assertRaises(concurrent.futures.CancelledError):
+            pynav.convert_image(pynav.ExternalConvertBackend(FAKE_CONVERT), "90", "png", "jpg", 100.0, self.source,
+                os.path.join(self.tmp, "page.jpg"), True, cancel)
+        self.assertLess(time.time() - start, 3)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "page.jpg")))
+
+    def test_cancelled_before_it_starts(self):
+        cancel = threading.Event()
+        cancel.set()
+        for name in pynav.CONVERT_BACKENDS:
+            if name == "python" and pynav.Image is None:
+                continue
+            with self.assertRaises(concurrent.futures.CancelledError):
+                pynav.convert_image(pynav.get_backend(name, FAKE_CONVERT), "90", "png", "jpg", 100.0, self.source,
+                    os.path.join(self.tmp, "page.jpg"), False, cancel)
+
+
+class WatchTest(unittest.TestCase):
+    """pynav.py --watch against benchmarks/fake_convert.py."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dest = os.path.join(self.tmp, "out")
+        os.makedirs(self.src)
+        for n in range(3):
+            synthetic.write_png(os.path.join(self.src, "page_{0}.png".format(n)), 32, 32)
+        bin = os.path.join(self.tmp, "bin")
+        os.makedirs(bin)
+        os.symlink(FAKE_CONVERT, os.path.join(bin, "convert"))
+        self.log = os.path.join(self.tmp, "log")
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        shutil.rmtree(self.tmp)
+
+    def start(self, latency, *args):
+        environ = dict(os.environ, PATH=os.path.join(self.tmp, "bin") + os.pathsep + os.environ["PATH"],
+            PYNAV_FAKE_CONVERT_LATENCY=str(latency), PYTHONUNBUFFERED="1")
+        with open(self.log, "w") as log:
+            self.process = subprocess.Popen([sys.executable, PYNAV, self.src, self.dest, "-if", "png", "-j", "3", "-w"] + list(args),
+                env=environ, stdout=log, stderr=subprocess.STDOUT)
+        wait_for(lambda: self.output().count("files converted") == 1)
+
+    def output(self):
+        with open(self.log) as f:
+            return f.read()
+
+    def builds(self):
+        """Returns the status of every page of each build after the first."""
+        builds = self.output().split("rebuilding")[1:]
+        return [dict((name, status or "Converted") for name, status
+            in re.findall(r"\.\.\. (\S+\.png)(?: \((\w+)\))?$", build, re.M)) for build in builds]
+
+    def stop(self):
+        self.process.send_signal(signal.SIGINT)
+        self.process.wait(10)
+        self.assertIn("Stopped watching", self.output())
+
+    def test_saves_are_debounced(self):
+        self.start(0)
+        # Three saves in a row, one rebuild of that page
+        for n in range(3):
+            synthetic.write_png(os.path.join(self.src, "page_1.png"), 32, 32, gray=n)
+            time.sleep(0.1)
+        wait_for(lambda: self.output().count("files converted") == 2)
+        time.sleep(1)
+        self.stop()
+        self.assertEqual(self.builds(), [{"page_0.png": "Skip", "page_1.png": "Converted", "page_2.png": "Skip"}])
+
+    def test_saved_again_while_converting(self):
+        self.start(1.5)
+        synthetic.write_png(os.path.join(self.src, "page_1.png"), 32, 32, gray=1)
+        # The rebuild starts after the debounce, save again while page_1 converts
+        wait_for(lambda: "rebuilding" in self.output())
+        time.sleep(0.3)
+        synthetic.write_png(os.path.join(self.src, "page_1.png"), 32, 32, gray=2)
+        wait_for(lambda: self.output().count("files converted") == 3)
+        self.stop()
+        builds = self.builds()
+        self.assertEqual(builds[0]["page_1.png"], "Cancelled")
+        self.assertEqual(builds[1], {"page_0.png": "Skip", "page_1.png": "Converted", "page_2.png": "Skip"})
+
+    def test_recursive_watches_the_subfolders(self):
+        os.makedirs(os.path.join(self.src, "chapter_1"))
+        synthetic.write_png(os.path.join(self.src, "chapter_1", "extra_0.png"), 32, 32)
+        self.start(0, "-r")
+        synthetic.write_png(os.path.join(self.src, "chapter_1", "extra_0.png"), 32, 32, gray=1)
+        wait_for(lambda: self.output().count("files converted") == 2)
+        self.stop()
+        self.assertEqual(self.builds(), [{"page_0.png": "Skip", "page_1.png": "Skip", "page_2.png": "Skip",
+            "extra_0.png": "Converted"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
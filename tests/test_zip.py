@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Streaming --zip packaging."""
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), "benchmarks")
+PYNAV = os.path.join(os.path.dirname(TESTS_DIR), "pynav.py")
+FAKE_CONVERT = os.path.join(BENCH_DIR, "fake_convert.py")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCH_DIR)
+import pynav
+import synthetic
+
+
+class ZipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.files = {}
+        for name in ("a.jpg", "b.png", "a.html", "index.html", "style.css"):
+            path = os.path.join(self.tmp, name)
+            with open(path, "w") as f:
+                f.write(name * 200)
+            self.files[name] = path
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def assertCompression(self, archive):
+        with zipfile.ZipFile(archive) as zf:
+            types = dict((info.filename, info.compress_type) for info in zf.infolist())
+            self.assertEqual(len(zf.namelist()), len(types))
+            self.assertEqual(zf.read("a.html"), b"a.html" * 200)
+        self.assertEqual(types, {"a.jpg": zipfile.ZIP_STORED, "b.png": zipfile.ZIP_STORED,
+            "a.html": zipfile.ZIP_DEFLATED, "index.html": zipfile.ZIP_DEFLATED, "style.css": zipfile.ZIP_DEFLATED})
+
+    def test_streamer_stores_images_and_deflates_text(self):
+        archive = os.path.join(self.tmp, "out.zip")
+        streamer = pynav.ZipStreamer(archive)
+        for name in sorted(self.files):
+            streamer.add(self.files[name])
+        # Each name goes in once
+        streamer.add(self.files["a.jpg"])
+        self.assertFalse(os.path.exists(archive))
+        streamer.close()
+        self.assertCompression(archive)
+        self.assertFalse(os.path.exists(archive + ".tmp"))
+
+    def test_abort_drops_the_archive(self):
+        archive = os.path.join(self.tmp, "out.zip")
+        streamer = pynav.ZipStreamer(archive)
+        streamer.add(self.files["a.jpg"])
+        streamer.abort()
+        self.assertFalse(os.path.exists(archive))
+        self.assertFalse(os.path.exists(archive + ".tmp"))
+
+    def test_zip_uses_the_same_rule(self):
+        src = os.path.join(self.tmp, "src")
+        os.makedirs(src)
+        for path in self.files.values():
+            shutil.copy(path, src)
+        pynav.zip(src, os.path.join(self.tmp, "out.zip"))
+        self.assertCompression(os.path.join(self.tmp, "out.zip"))
+
+    def test_build_zip(self):
+        src = os.path.join(self.tmp, "src")
+        dest = os.path.join(self.tmp, "out")
+        os.makedirs(src)
+        for n in range(3):
+            synthetic.write_png(os.path.join(src, "page_{0}.png".format(n)), 32, 250)
+        bin = os.path.join(self.tmp, "bin")
+        os.makedirs(bin)
+        os.symlink(FAKE_CONVERT, os.path.join(bin, "convert"))
+        subprocess.check_call([sys.executable, PYNAV, src, dest, "-if", "png", "-m", "-slc", "100", "-j", "3",
+            "-index", "-z"], env=dict(os.environ, PATH=bin + os.pathsep + os.environ["PATH"]),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with zipfile.ZipFile(os.path.join(dest, "out.zip")) as zf:
+            names = zf.namelist()
+        # Every page file and the index, not the manifest nor the zip itself
+        self.assertEqual(sorted(names), sorted(name for name in os.listdir(dest) if name not in ("out.zip", pynav.MANIFEST_FILE_NAME)))
+        self.assertEqual(len(names), 3 * 4 + 1)
+        self.assertEqual(names[-1], "index.html")
+
+
+if __name__ == "__main__":
+    unittest.main()